@@ -3,16 +3,24 @@ import sys
 import logging
 import time
 import json
-import zipfile
 import threading
 import shutil
-import pandas as pd
-from flask import Flask, request, jsonify, send_file, render_template, Response
+from flask import Flask, request, jsonify, send_file, send_from_directory, render_template, Response, abort
 import uuid
 
-# Import helper functions (to be implemented)
-from downloader import download_audio_from_url
-from transcriber import transcribe_audio
+# pandas, downloader (yt-dlp, bs4) and transcriber (whisper, torch) are imported
+# in process_file, so the server answers right away; see WARMUP below
+from result_cache import get_cache
+from job_store import JobStore
+from progress_bus import ProgressBus
+from zip_builder import ResultZip, ZipStream
+from scheduler import JobScheduler, default_memory_budget_mb
+from pipeline import Stage, run_pipeline
+from metrics import JobMetrics, STAGE_BUCKETS, audio_duration, peak_rss_bytes, render_prometheus
+from audio_separator import STEM_MODES
+from audio_io import convert_audio
+from model_manager import get_manager
+from warmup import Warmup
 
 app = Flask(__name__)
 
@@ -27,6 +35,69 @@ app.config['UPLOAD_FOLDER'] = os.path.join(base_dir, 'uploads')
 app.config['RESULTS_FOLDER'] = os.path.join(base_dir, 'results')
 app.config['SECRET_KEY'] = 'supersecretkey'
 
+# Worker threads per pipeline stage and how many rows may wait between stages.
+# Downloads are network bound, so by default two run while Demucs/Whisper work.
+app.config['PIPELINE_WORKERS'] = {
+    'download': int(os.environ.get('DOWNLOAD_WORKERS', 2)),
+    'separate': int(os.environ.get('SEPARATION_WORKERS', 1)),
+    'transcribe': int(os.environ.get('TRANSCRIPTION_WORKERS', 1)),
+}
+app.config['PIPELINE_QUEUE_SIZE'] = int(os.environ.get('PIPELINE_QUEUE_SIZE', 2))
+# Rows already waiting for transcription (the queue holds PIPELINE_QUEUE_SIZE) are decoded
+# together, up to this many rows, in batches of WHISPER_BATCH_SIZE windows. Off (1) by default:
+# batched windows are decoded independently, so the text can differ from transcribe()'s
+app.config['TRANSCRIBE_BATCH'] = int(os.environ.get('TRANSCRIBE_BATCH', 1))
+
+# Downloads keep their original codec, which is what separation and Whisper decode. When an
+# export needs a given format (e.g. DOWNLOAD_FORMAT=mp3) only the audio put in the ZIP is converted
+app.config['DOWNLOAD_FORMAT'] = os.environ.get('DOWNLOAD_FORMAT') or None
+
+app.config['WHISPER_MODEL'] = os.environ.get('WHISPER_MODEL', 'large')
+# 'whisper', or 'whisper-int8' for an int8-quantized model that is faster on CPU-only
+# hosts (see whisper_backends; WHISPER_THREADS/WHISPER_INTEROP_THREADS set torch threads)
+app.config['WHISPER_BACKEND'] = os.environ.get('WHISPER_BACKEND', 'whisper')
+# Cascade: a faster model (e.g. 'small') transcribes first and only its low-confidence
+# parts are re-run with WHISPER_MODEL (see cascade.py for the CASCADE_* thresholds)
+app.config['WHISPER_CASCADE'] = os.environ.get('WHISPER_CASCADE') or None
+app.config['DEMUCS_MODEL'] = 'htdemucs'
+# Default stem mode ('all', 'two' or 'vocals'); each job can pick another one in the
+# form, and each row in a STEMS column of the spreadsheet.
+app.config['DEMUCS_STEMS'] = os.environ.get('DEMUCS_STEMS', 'all')
+# Demucs quality/CPU/memory trade-offs: shorter segments lower peak memory, every
+# extra shift is a full extra pass, jobs run segments in parallel threads on CPU.
+app.config['DEMUCS_SEGMENT'] = float(os.environ['DEMUCS_SEGMENT']) if os.environ.get('DEMUCS_SEGMENT') else None
+app.config['DEMUCS_SHIFTS'] = int(os.environ.get('DEMUCS_SHIFTS', 1))
+app.config['DEMUCS_OVERLAP'] = float(os.environ.get('DEMUCS_OVERLAP', 0.25))
+app.config['DEMUCS_JOBS'] = int(os.environ.get('DEMUCS_JOBS', 0))
+# Only send voiced regions of the vocals stem to Whisper
+app.config['VAD_GATING'] = os.environ.get('VAD_GATING', '1') != '0'
+
+# Decode each track once and hand the vocals to Whisper as an in-memory array.
+# Stems are only written to disk when they are kept for the ZIP.
+app.config['IN_MEMORY_AUDIO'] = os.environ.get('IN_MEMORY_AUDIO', '1') != '0'
+app.config['KEEP_STEMS'] = os.environ.get('KEEP_STEMS', '1') != '0'
+
+# Downloads, stems and transcripts are reused across jobs through this cache
+app.config['CACHE_FOLDER'] = os.path.join(base_dir, 'cache')
+app.config['CACHE_ENABLED'] = os.environ.get('CACHE_ENABLED', '1') != '0'
+
+# At most JOB_SLOTS jobs run at once; the rest wait in a priority queue and only
+# start when their estimated RAM fits in MEMORY_BUDGET_MB
+app.config['JOB_SLOTS'] = int(os.environ.get('JOB_SLOTS', 2))
+app.config['MEMORY_BUDGET_MB'] = default_memory_budget_mb()
+
+# 'inline' runs jobs in this process; 'external' leaves them in the job store
+# for worker.py processes and only serves uploads, progress and downloads
+app.config['WORKER_MODE'] = os.environ.get('WORKER_MODE', 'inline')
+
+# Import the pipeline modules and load the Whisper and Demucs models in the
+# background once the server is up, so the first job does not wait for them.
+# /ready reports the progress.
+app.config['WARMUP'] = os.environ.get('WARMUP', '1') != '0'
+
+# Job status, per-row stage and output paths survive restarts in this SQLite file
+app.config['JOB_DB'] = os.environ.get('JOB_DB') or os.path.join(base_dir, 'jobs.db')
+
 # Logging to a file for easier debugging on target machines
 log_file = os.path.join(base_dir, 'app.log')
 logging.basicConfig(level=logging.INFO, filename=log_file,
@@ -64,21 +135,35 @@ _redirect_demucs_cache()
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['RESULTS_FOLDER'], exist_ok=True)
 
-# Store job progress in memory (for simplicity)
-# Ideally use Redis or a database for production
-jobs = {}
+# Job progress and per-row task state, persisted so a restart can resume.
+# Every change is also published on the bus that feeds /progress.
+bus = ProgressBus()
+store = JobStore(app.config['JOB_DB'], bus=bus)
 
-def process_file(job_id, file_path):
+def _cancel_queued_job(job_id):
+    store.update_job(job_id, status="Cancelled", error="Job cancelled", done=True)
+
+def process_file(job_id, file_path, cancel_event=None):
     """
     Background worker to process the uploaded file.
+    Rows flow through a download -> separate -> transcribe pipeline so the
+    stages of consecutive rows overlap. Each row's last completed stage is
+    recorded in the job store, so a job restarted after a crash picks up
+    where every row left off. Setting cancel_event stops the job once the
+    stage calls already running return: rows that have not been through every
+    stage by then are dropped, not finished.
     """
     job_dir = os.path.join(app.config['RESULTS_FOLDER'], job_id)
     os.makedirs(job_dir, exist_ok=True)
     
     try:
         logging.info(f"Started processing job {job_id} for file {file_path}")
-        jobs[job_id]['status'] = 'Reading file...'
-        jobs[job_id]['progress'] = 5
+        store.update_job(job_id, status='Reading file...', progress=5)
+
+        # Heavy imports, deferred until the first job (or the warm-up)
+        import pandas as pd
+        from downloader import download_audio_from_url
+        from transcriber import transcribe_batch, transcribe_result
         
         # Read Excel/CSV
         if file_path.endswith('.csv'):
@@ -98,16 +183,44 @@ def process_file(job_id, file_path):
         if total_urls == 0:
             raise ValueError("No rows found")
             
-        jobs[job_id]['log'].append(f"Found {total_urls} URLs to process.")
+        store.append_log(job_id, f"Found {total_urls} URLs to process.")
         logging.info(f"Job {job_id}: {total_urls} URLs")
         
-        # Process each URL
-        audio_files = []
-        
         # Helper for separation
-        from audio_separator import separate_audio
-        import shutil
-        
+        from audio_separator import separate_audio, separate_for_transcription, separation_settings, default_track_dir
+
+        cache = get_cache(app.config['CACHE_FOLDER']) if app.config['CACHE_ENABLED'] else None
+        model_size = app.config['WHISPER_MODEL']
+        backend = app.config['WHISPER_BACKEND']
+        cascade = app.config['WHISPER_CASCADE']
+        vad_gating = app.config['VAD_GATING']
+        batched = app.config['TRANSCRIBE_BATCH'] > 1
+        options = store.get_job(job_id)['options']
+        chunked = options.get('long_audio', False)
+        if chunked:
+            store.append_log(job_id, "Long audio mode: long tracks are transcribed in parallel chunks.")
+        demucs_model = app.config['DEMUCS_MODEL']
+        job_stems = options.get('stems') or app.config['DEMUCS_STEMS']
+        demucs_options = {'segment': app.config['DEMUCS_SEGMENT'], 'shifts': app.config['DEMUCS_SHIFTS'],
+                          'overlap': app.config['DEMUCS_OVERLAP']}
+        demucs_jobs = app.config['DEMUCS_JOBS']
+        in_memory = app.config['IN_MEMORY_AUDIO']
+        keep_stems = app.config['KEEP_STEMS']
+        export_format = app.config['DOWNLOAD_FORMAT']
+        # Downloads are always in their native codec, cached under the key they always had
+        download_variant = {'audio_format': None}
+        # Counters are shared by all jobs, so report the difference for this one
+        cache_before = cache.stats() if cache else None
+
+        # Rows are appended to the archive as soon as they finish
+        zip_filename = f"{job_id}_results.zip"
+        zip_path = os.path.join(app.config['RESULTS_FOLDER'], zip_filename)
+        result_zip = ResultZip(zip_path, job_dir)
+
+        # Build one work item per valid row, skipping rows a previous run already finished
+        tasks = store.get_tasks(job_id)
+        items = []
+        already_done = 0
         for i, row in enumerate(rows):
             url = row.get('URL')
             if not url or pd.isna(url):
@@ -116,121 +229,472 @@ def process_file(job_id, file_path):
             platform = row.get('PLATAFORMA')
             if pd.isna(platform):
                 platform = None
-                
-            temp_demucs_dir = None
-            try:
-                # Update progress
-                current_idx = i + 1
-                progress = 10 + (current_idx / total_urls) * 70 
-                jobs[job_id]['progress'] = progress
-                jobs[job_id]['status'] = f"Processing {current_idx}/{total_urls}: {url}"
-                
-                log_msg = f"Downloading: {url}"
-                if platform:
-                    log_msg += f" (Platform: {platform})"
-                jobs[job_id]['log'].append(log_msg)
-                
-                # 1. Download Audio
+
+            # A STEMS column overrides the job's stem mode for that row
+            stems = row.get('STEMS')
+            stems = None if stems is None or pd.isna(stems) else str(stems).strip().lower()
+            if stems not in STEM_MODES:
+                if stems:
+                    store.append_log(job_id, f"Row {i + 1}: unknown STEMS value '{stems}', using '{job_stems}'.")
+                stems = job_stems
+
+            task = tasks.get(i)
+            if task and (task['stage'] == 'transcribed' or task['failed']):
+                already_done += 1
+                continue
+            if not task:
+                store.update_task(job_id, i, url=url, platform=platform, stage='pending')
+
+            items.append({'index': i, 'current_idx': i + 1, 'url': url, 'platform': platform, 'stems': stems,
+                          'resume': task or {}})
+
+        if already_done:
+            store.append_log(job_id, f"Resuming: {already_done} rows were already processed before the restart.")
+
+        finished = {'count': already_done}
+        finished_lock = threading.Lock()
+
+        # Per-row stage timings: kept in the store for /metrics and written to the ZIP as a report
+        metrics = JobMetrics(job_id, on_stage=lambda row, stage, seconds, fields: store.record_stage(
+            job_id, row, stage, seconds, bytes_downloaded=fields.get('bytes_downloaded'),
+            audio_seconds=fields.get('audio_seconds'), peak_rss=peak_rss_bytes()))
+
+        def stems_dir_for(audio_path):
+            # Where a row's stems are kept, and their folder in the ZIP
+            return os.path.join(job_dir, 'separated_audio', os.path.splitext(os.path.basename(audio_path))[0])
+
+        def timed(stage_name, func):
+            def run(item):
+                with metrics.stage(item['index'], stage_name) as extra:
+                    item['metrics'] = extra
+                    return func(item)
+            return run
+
+        def cleanup(item):
+            # Release the in-memory vocals buffer
+            item.pop('transcription_source', None)
+            # Cleanup Demucs temp files for this track
+            temp_demucs_dir = item.get('temp_demucs_dir')
+            if temp_demucs_dir and os.path.exists(temp_demucs_dir):
+                try:
+                    shutil.rmtree(temp_demucs_dir)
+                except Exception as e:
+                    print(f"Failed to clean up temp dir {temp_demucs_dir}: {e}")
+
+        def finish_row(item):
+            cleanup(item)
+            with finished_lock:
+                finished['count'] += 1
+                done = finished['count']
+            store.update_job(job_id, progress=10 + (done / total_urls) * 70)
+
+        def download_stage(item):
+            url = item['url']
+            platform = item['platform']
+            current_idx = item['current_idx']
+            store.update_job(job_id, status=f"Processing {current_idx}/{total_urls}: {url}")
+            
+            log_msg = f"Downloading: {url}"
+            if platform:
+                log_msg += f" (Platform: {platform})"
+            store.append_log(job_id, log_msg)
+            
+            # 1. Download Audio (or reuse a cached download of the same URL)
+            resume = item['resume']
+            if resume.get('stage') in ('downloaded', 'separated') and resume.get('audio_path') \
+                    and os.path.exists(resume['audio_path']):
+                audio_path, audio_hash = resume['audio_path'], resume['audio_hash']
+                store.append_log(job_id, f"Resuming, already downloaded: {os.path.basename(audio_path)}")
+            elif cache:
+                audio_path, audio_hash = cache.get_download(url, job_dir, variant=download_variant)
+                if audio_path:
+                    store.append_log(job_id, f"Using cached download: {os.path.basename(audio_path)}")
+            else:
+                audio_path, audio_hash = None, None
+
+            if not audio_path:
                 audio_path = download_audio_from_url(url, job_dir, platform=platform)
                 if not audio_path:
-                    jobs[job_id]['log'].append(f"Failed to download: {url}")
-                    continue
-                    
-                audio_files.append(audio_path)
-                jobs[job_id]['log'].append(f"Downloaded: {os.path.basename(audio_path)}")
-                logging.info(f"Job {job_id}: downloaded {audio_path}")
-                
-                # 2. Separate Vocals (Demucs)
-                jobs[job_id]['status'] = f"Separating vocals {current_idx}/{total_urls}: {os.path.basename(audio_path)}"
-                jobs[job_id]['log'].append(f"Separating vocals...")
-                logging.info(f"Job {job_id}: starting separation for {audio_path}")
-                
-                # Create a temp dir for this file's separation to keep main dir clean
-                temp_demucs_dir = os.path.join(job_dir, f"temp_demucs_{i}")
-                vocals_path = separate_audio(audio_path, output_base_dir=temp_demucs_dir)
-                
-                transcription_source = vocals_path if vocals_path else audio_path
-                
-                if vocals_path:
-                    jobs[job_id]['log'].append(f"Vocals separated successfully.")
-                    logging.info(f"Job {job_id}: vocals at {vocals_path}")
-                else:
-                    jobs[job_id]['log'].append(f"Vocal separation failed, using original audio.")
-                    logging.warning(f"Job {job_id}: vocal separation failed for {audio_path}")
-
-                # 3. Transcribe Audio
-                jobs[job_id]['status'] = f"Transcribing {current_idx}/{total_urls}..."
-                jobs[job_id]['log'].append(f"Transcribing...")
-                logging.info(f"Job {job_id}: transcribing {transcription_source}")
-                
-                print(f"[DEBUG] Calling transcribe_audio for {os.path.basename(transcription_source)}")
-                transcript_text = transcribe_audio(transcription_source)
-                print(f"[DEBUG] Returned from transcribe_audio")
+                    store.append_log(job_id, f"Failed to download: {url}")
+                    store.update_task(job_id, item['index'], failed=True, error='Download failed')
+                    finish_row(item)
+                    return None
+                item['metrics']['bytes_downloaded'] = os.path.getsize(audio_path)
+                if cache:
+                    audio_hash = cache.put_download(url, audio_path, variant=download_variant)
+                store.append_log(job_id, f"Downloaded: {os.path.basename(audio_path)}")
                 
-                # Save transcription
-                # Use original filename base for the txt file
-                original_base = os.path.splitext(os.path.basename(audio_path))[0]
-                txt_filename = original_base + ".txt"
-                txt_path = os.path.join(job_dir, txt_filename)
-                
-                with open(txt_path, 'w', encoding='utf-8') as f:
-                    f.write(transcript_text)
-                logging.info(f"Job {job_id}: transcription saved to {txt_path}")
-
-                # Copy separated audio files to job directory
-                audio_basename = os.path.splitext(os.path.basename(audio_path))[0]
-                separated_source_dir = os.path.join(os.path.dirname(audio_path), f"{audio_basename}_separated", 'htdemucs')
-
-                if os.path.exists(separated_source_dir):
-                    separated_dest_dir = os.path.join(job_dir, 'separated_audio', audio_basename)
-                    if os.path.exists(separated_dest_dir):
-                        shutil.rmtree(separated_dest_dir)
-                    os.makedirs(os.path.dirname(separated_dest_dir), exist_ok=True)
-                    shutil.copytree(separated_source_dir, separated_dest_dir)
-                    jobs[job_id]['log'].append(f"Separated audio files saved.")
-
-                jobs[job_id]['log'].append(f"Transcription completed.")
+            metrics.set(item['index'], url=url)
+            item['metrics']['audio_seconds'] = audio_duration(audio_path)
+            item['audio_path'] = audio_path
+            item['audio_hash'] = audio_hash
+            if resume.get('stage') != 'separated':
+                store.update_task(job_id, item['index'], stage='downloaded', audio_path=audio_path, audio_hash=audio_hash)
+            logging.info(f"Job {job_id}: downloaded {audio_path}")
+            return item
+
+        def separate_stage(item):
+            audio_path = item['audio_path']
+            current_idx = item['current_idx']
+
+            # 2. Separate Vocals (Demucs)
+            store.update_job(job_id, status=f"Separating vocals {current_idx}/{total_urls}: {os.path.basename(audio_path)}")
+            store.append_log(job_id, f"Separating vocals: {os.path.basename(audio_path)}")
+            logging.info(f"Job {job_id}: starting separation for {audio_path}")
+            
+            # Scratch space for the demucs CLI, whose output is then moved into track_dir
+            temp_demucs_dir = os.path.join(job_dir, f"temp_demucs_{item['index']}")
+            item['temp_demucs_dir'] = temp_demucs_dir
+            stem_settings = separation_settings(demucs_model, item['stems'], **demucs_options)
+            audio_hash = item['audio_hash']
+
+            # Kept stems are written once, straight into the folder the ZIP packages;
+            # otherwise they only live in the scratch folder until the row is done
+            if keep_stems:
+                track_dir = stems_dir_for(audio_path)
+                item['stems_dir'] = track_dir
+            else:
+                track_dir = default_track_dir(temp_demucs_dir, demucs_model, audio_path)
+
+            vocals_path = None
+            vocals_pcm = None
+            resume = item['resume']
+            if resume.get('stage') == 'separated' and resume.get('vocals_path') \
+                    and os.path.exists(resume['vocals_path']):
+                vocals_path = resume['vocals_path']
+                store.append_log(job_id, f"Resuming, already separated: {os.path.basename(audio_path)}")
+            else:
+                # Leftovers of an interrupted separation, possibly with another stem mode
+                shutil.rmtree(track_dir, ignore_errors=True)
+            if not vocals_path and cache and audio_hash:
+                if cache.get_stems(audio_hash, stem_settings, track_dir):
+                    vocals_path = os.path.join(track_dir, 'vocals.mp3')
+                    store.append_log(job_id, f"Using cached stems: {os.path.basename(audio_path)}")
+
+            if not vocals_path and in_memory:
+                try:
+                    vocals_pcm, vocals_path = separate_for_transcription(
+                        audio_path, model_name=demucs_model, keep_dir=track_dir if keep_stems else None,
+                        stems=item['stems'], jobs=demucs_jobs, **demucs_options)
+                except Exception as e:
+                    logging.warning(f"Job {job_id}: in-memory separation failed for {audio_path}, using files: {e}")
+
+            if vocals_pcm is None and not vocals_path:
+                vocals_path = separate_audio(audio_path, output_base_dir=temp_demucs_dir, model_name=demucs_model,
+                                             stems=item['stems'], jobs=demucs_jobs, track_dir=track_dir,
+                                             **demucs_options)
+
+            if vocals_path and cache and audio_hash:
+                cache.put_stems(audio_hash, stem_settings, os.path.dirname(vocals_path))
+            
+            separated = vocals_pcm is not None or vocals_path is not None
+            item['separation'] = stem_settings if separated else None
+            store.update_task(job_id, item['index'], stage='separated', vocals_path=vocals_path)
+            if separated:
+                store.append_log(job_id, f"Vocals separated successfully: {os.path.basename(audio_path)}")
+                logging.info(f"Job {job_id}: vocals {'in memory' if vocals_pcm is not None else 'at ' + vocals_path}")
+            else:
+                store.append_log(job_id, f"Vocal separation failed, using original audio: {os.path.basename(audio_path)}")
+                logging.warning(f"Job {job_id}: vocal separation failed for {audio_path}")
+
+            if vocals_pcm is not None:
+                item['transcription_source'] = vocals_pcm
+            else:
+                item['transcription_source'] = vocals_path if vocals_path else audio_path
+            return item
+
+        def transcript_settings_for(item):
+            # Whisper output depends on the stems it was fed, so they are part of the key
+            # VAD only makes sense on a separated vocals stem
+            use_vad = vad_gating and item['separation'] is not None
+            transcript_settings = {'model_size': model_size, 'separation': item['separation'], 'vad': use_vad,
+                                   'chunked': chunked}
+            if backend != 'whisper':
+                # Only in the key when not the default, so earlier cached transcripts stay valid
+                transcript_settings['backend'] = backend
+            if cascade:
+                transcript_settings['cascade'] = cascade
+            if batched:
+                # Batched decoding gives slightly different text than sequential decoding
+                transcript_settings['decode'] = 'batched'
+            return transcript_settings
+
+        def cached_transcript(item):
+            audio_path = item['audio_path']
+            current_idx = item['current_idx']
+            # 3. Transcribe Audio
+            store.update_job(job_id, status=f"Transcribing {current_idx}/{total_urls}...")
+            store.append_log(job_id, f"Transcribing: {os.path.basename(audio_path)}")
+            logging.info(f"Job {job_id}: transcribing {os.path.basename(audio_path)}")
+
+            audio_hash = item['audio_hash']
+            result = cache.get_transcript(audio_hash, transcript_settings_for(item)) if cache and audio_hash else None
+            if result:
+                store.append_log(job_id, f"Using cached transcription: {os.path.basename(audio_path)}")
+            return result
+
+        def save_transcript(item, result, cached=False):
+            audio_path = item['audio_path']
+            if not cached and cache and item['audio_hash']:
+                cache.put_transcript(item['audio_hash'], transcript_settings_for(item), result)
+            transcript_text = result['text']
+            if result.get('chunks'):
+                store.append_log(job_id, f"Transcribed in {result['chunks']} parallel chunks: {os.path.basename(audio_path)}")
+
+            cascade_stats = result.get('cascade')
+            if cascade_stats and not cached:
+                audio_seconds = cascade_stats['audio_seconds']
+                escalated = cascade_stats['escalated_seconds']
+                share = escalated / audio_seconds if audio_seconds else 0.0
+                scope = "whole track" if cascade_stats['whole_track'] else \
+                    f"{cascade_stats['low_confidence_segments']}/{cascade_stats['segments']} segments"
+                store.append_log(job_id,
+                    f"Cascade: {escalated:.0f}s of {audio_seconds:.0f}s ({share:.0%}, {scope}) "
+                    f"re-transcribed with {cascade_stats['model']}: {os.path.basename(audio_path)}")
+                metrics.set(item['index'], escalated_seconds=escalated)
+
+            vad_stats = result.get('vad')
+            if vad_stats:
+                audio_seconds = vad_stats['audio_seconds']
+                saved = vad_stats['seconds_skipped'] / audio_seconds if audio_seconds else 0.0
+                store.append_log(job_id,
+                    f"VAD: speech {vad_stats['speech_ratio']:.0%} of {audio_seconds:.0f}s, "
+                    f"skipped {vad_stats['seconds_skipped']:.0f}s ({saved:.0%} less Whisper compute): "
+                    f"{os.path.basename(audio_path)}")
+            
+            # Save transcription
+            # Use original filename base for the txt file
+            original_base = os.path.splitext(os.path.basename(audio_path))[0]
+            txt_filename = original_base + ".txt"
+            txt_path = os.path.join(job_dir, txt_filename)
+            
+            with open(txt_path, 'w', encoding='utf-8') as f:
+                f.write(transcript_text)
+            logging.info(f"Job {job_id}: transcription saved to {txt_path}")
+            store.update_task(job_id, item['index'], stage='transcribed', txt_path=txt_path)
+            item['txt_path'] = txt_path
+            return item
+
+        def transcribe_one(item):
+            result = transcribe_result(item['transcription_source'], model_size=model_size,
+                                       vad=transcript_settings_for(item)['vad'], chunked=chunked, backend=backend,
+                                       cascade=cascade)
+            return result
+
+        def transcribe_stage(items):
+            """
+            Batched stage: the rows whose vocals are ready at the same time have
+            their Whisper windows decoded together (transcriber.transcribe_batch).
+
+            Returns:
+                list: The item, or the exception it raised, for each row.
+            """
+            outputs = [None] * len(items)
+            seconds = [0.0] * len(items)
+            pending = []
+            for n, item in enumerate(items):
+                start = time.perf_counter()
+                try:
+                    result = cached_transcript(item)
+                    if result:
+                        outputs[n] = save_transcript(item, result, cached=True)
+                    else:
+                        pending.append(n)
+                except Exception as e:
+                    outputs[n] = e
+                seconds[n] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            results = {}
+            if len(pending) > 1:
+                names = ", ".join(os.path.basename(items[n]['audio_path']) for n in pending)
+                store.append_log(job_id, f"Transcribing {len(pending)} tracks in one batch: {names}")
+                try:
+                    batch = transcribe_batch([items[n]['transcription_source'] for n in pending],
+                                             model_size=model_size, chunked=chunked, backend=backend, cascade=cascade,
+                                             vad=[transcript_settings_for(items[n])['vad'] for n in pending])
+                    results = dict(zip(pending, batch))
+                except Exception as e:
+                    # One bad track should not fail the others: retry them one by one
+                    logging.exception(f"Job {job_id}: batched transcription failed, transcribing one by one")
+                    store.append_log(job_id, f"Batched transcription failed ({e}), transcribing one by one")
+            # The batch's time is shared between its rows by audio length (equally for paths)
+            batch_seconds = time.perf_counter() - start
+            weights = {n: 1 if isinstance(items[n]['transcription_source'], str)
+                       else len(items[n]['transcription_source']) for n in pending}
+            for n in pending:
+                seconds[n] += batch_seconds * weights[n] / (sum(weights.values()) or 1)
+            for n in pending:
+                start = time.perf_counter()
+                try:
+                    outputs[n] = save_transcript(items[n], results[n] if n in results else transcribe_one(items[n]))
+                except Exception as e:
+                    outputs[n] = e
+                seconds[n] += time.perf_counter() - start
+
+            for item, item_seconds in zip(items, seconds):
+                metrics.record(item['index'], 'transcribe', item_seconds)
+            return outputs
+
+        def package_stage(item):
+            audio_path = item['audio_path']
+            txt_path = item['txt_path']
+            current_idx = item['current_idx']
+            try:
+                # Make the row's results available right away; the stems are already in place
+                export_path = convert_audio(audio_path, export_format) if export_format else audio_path
+                row_files = [export_path, txt_path]
+                separated_dir = item.get('stems_dir')
+                if separated_dir and os.path.isdir(separated_dir):
+                    row_files += [os.path.join(separated_dir, name) for name in sorted(os.listdir(separated_dir))]
+                    store.append_log(job_id, f"Separated audio files saved.")
+                result_zip.add(row_files)
+                store.update_task(job_id, item['index'],
+                                  files=[os.path.relpath(path, job_dir).replace(os.sep, '/') for path in row_files if os.path.isfile(path)])
+
+                store.append_log(job_id, f"Transcription completed: {os.path.basename(audio_path)}")
                 logging.info(f"Job {job_id}: completed item {current_idx}/{total_urls}")
-                
-            except Exception as e:
-                jobs[job_id]['log'].append(f"Error processing {url}: {str(e)}")
-                logging.exception(f"Job {job_id}: error processing {url}")
             finally:
-                # Cleanup Demucs temp files for this track
-                if temp_demucs_dir and os.path.exists(temp_demucs_dir):
-                    try:
-                        shutil.rmtree(temp_demucs_dir)
-                    except Exception as e:
-                        print(f"Failed to clean up temp dir {temp_demucs_dir}: {e}")
+                finish_row(item)
+            return item
+
+        def on_error(stage_name, item, e):
+            store.append_log(job_id, f"Error processing {item['url']}: {str(e)}")
+            store.update_task(job_id, item['index'], failed=True, error=str(e))
+            logging.exception(f"Job {job_id}: error in {stage_name} stage for {item['url']}")
+            # package_stage already finished its row in its finally block
+            if stage_name != 'package':
+                finish_row(item)
+
+        workers = app.config['PIPELINE_WORKERS']
+        run_pipeline(items, [
+            Stage('download', timed('download', download_stage), workers['download']),
+            Stage('separate', timed('separate', separate_stage), workers['separate']),
+            # Rows whose vocals are ready at the same time are transcribed as one batch
+            Stage('transcribe', transcribe_stage, workers['transcribe'],
+                  batch_size=app.config['TRANSCRIBE_BATCH']),
+            # Copying stems and appending to the ZIP
+            Stage('package', timed('package', package_stage)),
+        ], queue_size=app.config['PIPELINE_QUEUE_SIZE'], on_error=on_error,
+            stop_event=cancel_event, on_drop=lambda stage_name, item: cleanup(item))
+
+        if cache:
+            stats = cache.stats()
+            summary = ", ".join(
+                f"{stage} {stats['hits'][stage] - cache_before['hits'][stage]} hit / "
+                f"{stats['misses'][stage] - cache_before['misses'][stage]} miss"
+                for stage in stats['hits'])
+            store.append_log(job_id, f"Cache: {summary}")
+            logging.info(f"Job {job_id}: cache {summary} (size {stats['size_bytes']} bytes)")
                 
-        # 3. Zip Results
-        jobs[job_id]['status'] = "Creating ZIP archive..."
-        jobs[job_id]['progress'] = 90
-        
-        zip_filename = f"{job_id}_results.zip"
-        zip_path = os.path.join(app.config['RESULTS_FOLDER'], zip_filename)
-        
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for root, dirs, files in os.walk(job_dir):
-                for file in files:
-                    # Only include files that are not the zip itself (though zip is in RESULTS_FOLDER, not job_dir)
-                    # And ensure we are not zipping any leftover temp folders if walk goes into them (though we tried to delete)
-                    zipf.write(os.path.join(root, file), file)
+        # 3. Zip Results (rows are already in the archive; this makes sure it exists even if every row failed)
+        store.update_job(job_id, status="Finalizing ZIP archive...", progress=90)
+        metrics.finish()
+        report = metrics.report()
+        result_zip.add([metrics.write_report(job_dir)])
+        if report['real_time_factor']:
+            store.append_log(job_id, "Timing: " + ", ".join(
+                f"{stage} {seconds:.0f}s" for stage, seconds in report['stage_seconds'].items())
+                + f"; {report['audio_seconds']:.0f}s of audio in {report['wall_seconds']:.0f}s"
+                f" (real-time factor {report['real_time_factor']:.2f})")
+
+        if cancel_event is not None and cancel_event.is_set():
+            # Only offer the ZIP when it holds at least one row
+            packaged = any(task['files'] for task in store.get_tasks(job_id).values())
+            if packaged:
+                store.append_log(job_id, "Job cancelled. The ZIP contains the rows finished before cancelling.")
+            else:
+                store.append_log(job_id, "Job cancelled before any row finished.")
+            store.update_job(job_id, status="Cancelled", error="Job cancelled",
+                             download_url=f"/download/{zip_filename}" if packaged else None, done=True)
+            return
                     
-        jobs[job_id]['progress'] = 100
-        jobs[job_id]['status'] = "Done!"
-        jobs[job_id]['download_url'] = f"/download/{zip_filename}"
-        jobs[job_id]['done'] = True
+        store.update_job(job_id, progress=100, status="Done!", download_url=f"/download/{zip_filename}", done=True)
         
     except Exception as e:
-        jobs[job_id]['error'] = str(e)
-        jobs[job_id]['done'] = True
-        jobs[job_id]['status'] = "Failed"
+        store.update_job(job_id, error=str(e), done=True, status="Failed")
+
+# Started after process_file is defined: it is the scheduler's job runner
+scheduler = JobScheduler(
+    process_file,
+    slots=app.config['JOB_SLOTS'],
+    memory_budget_mb=app.config['MEMORY_BUDGET_MB'],
+    on_queue_change=lambda job_id, position: store.update_job(job_id, status=f"Queued (position {position})"),
+    on_cancel=_cancel_queued_job,
+)
+
+def _submit_job(job_id, file_path):
+    options = store.get_job(job_id)['options']
+    # A cascade keeps its fast model loaded next to the large one
+    model_sizes = tuple(size for size in (app.config['WHISPER_MODEL'], app.config['WHISPER_CASCADE']) if size)
+    return scheduler.submit(job_id, args=(file_path,), priority=options.get('priority', 0),
+                            model_size=model_sizes)
+
+def resume_unfinished_jobs():
+    """
+    Restarts every job the store still marks as running (e.g. after a crash).
+    """
+    for job_id, file_path in store.unfinished_jobs():
+        if not file_path or not os.path.exists(file_path):
+            store.update_job(job_id, error='Uploaded file is missing, cannot resume', done=True, status='Failed')
+            continue
+        logging.info(f"Resuming job {job_id} for file {file_path}")
+        store.append_log(job_id, "Server restarted, resuming job.")
+        _submit_job(job_id, file_path)
+
+def _import_pipeline():
+    import pandas
+    import downloader
+    import transcriber
+    import audio_separator
+
+def _load_whisper():
+    from transcriber import get_model
+    get_model(app.config['WHISPER_MODEL'], app.config['WHISPER_BACKEND'])
+    if app.config['WHISPER_CASCADE']:
+        get_model(app.config['WHISPER_CASCADE'], app.config['WHISPER_BACKEND'])
+
+def _load_demucs():
+    from audio_separator import get_separator
+    get_separator(app.config['DEMUCS_MODEL'])
+
+def warmup_steps(load_models=True):
+    steps = [('imports', _import_pipeline)]
+    if load_models:
+        steps += [('whisper', _load_whisper), ('demucs', _load_demucs)]
+    return steps
+
+# Started in __main__ when WARMUP is on. In external worker mode the web server
+# runs no jobs, so it only warms the imports; worker.py warms its own models.
+warmup = Warmup(warmup_steps(load_models=app.config['WORKER_MODE'] != 'external'))
+
+def relay_worker_progress(interval=0.5):
+    """
+    In external worker mode other processes update the jobs: pull their changes
+    from the store so the bus (and /progress) sees them.
+    """
+    while True:
+        try:
+            store.refresh()
+        except Exception as e:
+            logging.error(f"Progress relay failed: {e}")
+        time.sleep(interval)
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/ready')
+def ready():
+    """
+    Warm-up state. 200 once the models are loaded (or warm-up is off), 503 while
+    warming or if a step failed; jobs are accepted either way.
+    """
+    if not app.config['WARMUP']:
+        return jsonify({'state': 'disabled', 'ready': True, 'steps': {}})
+    status = warmup.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -246,55 +710,223 @@ def upload_file():
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(file_path)
         
-        # Initialize job
-        jobs[job_id] = {
-            'status': 'Uploaded',
-            'progress': 0,
-            'log': [],
-            'done': False
+        # Per-job options from the upload form
+        try:
+            priority = int(request.form.get('priority', 0))
+        except ValueError:
+            priority = 0
+        stems = request.form.get('stems', '').lower()
+        options = {
+            'long_audio': request.form.get('long_audio', 'false').lower() in ('true', 'on', '1'),
+            'priority': priority,
+            # Empty means the server default (DEMUCS_STEMS)
+            'stems': stems if stems in STEM_MODES else None,
         }
+
+        if app.config['WORKER_MODE'] == 'external':
+            # A worker process claims it from the job store
+            store.create_job(job_id, file_path, options, status='Queued')
+            waiting = [j['job_id'] for j in store.queued_jobs() if j['worker_id'] is None]
+            position = waiting.index(job_id) + 1 if job_id in waiting else 0
+            return jsonify({'job_id': job_id, 'queue_position': position})
+
+        # Initialize job
+        store.create_job(job_id, file_path, options)
         
-        # Start processing in background thread
-        thread = threading.Thread(target=process_file, args=(job_id, file_path))
-        thread.start()
+        # Queue for processing; the scheduler starts it when a slot and enough memory are free
+        position = _submit_job(job_id, file_path)
         
-        return jsonify({'job_id': job_id})
+        return jsonify({'job_id': job_id, 'queue_position': position})
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if app.config['WORKER_MODE'] == 'external':
+        # The worker running the job sees the request on its next heartbeat
+        state = store.request_cancel(job_id)
+        if state is None:
+            return jsonify({'error': 'Job is not queued or running'}), 404
+        return jsonify({'job_id': job_id, 'cancelled': state})
+    state = scheduler.cancel(job_id)
+    if state is None:
+        return jsonify({'error': 'Job is not queued or running'}), 404
+    if state == 'running':
+        store.append_log(job_id, "Cancellation requested, stopping once the steps already running finish...")
+    return jsonify({'job_id': job_id, 'cancelled': state})
+
+@app.route('/queue')
+def queue_status():
+    if app.config['WORKER_MODE'] == 'external':
+        jobs = store.queued_jobs()
+        return jsonify({
+            'mode': 'external',
+            'running': [j for j in jobs if j['worker_id']],
+            'queued': [j for j in jobs if not j['worker_id']],
+        })
+    return jsonify(dict(scheduler.snapshot(), mode='inline'))
+
+@app.route('/models')
+def loaded_models():
+    """
+    Models loaded in this process (in external mode they live in the workers),
+    their memory, how many transcriptions hold them and how long they have been idle.
+    """
+    return jsonify(dict(get_manager().snapshot(), mode=app.config['WORKER_MODE']))
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Prometheus metrics aggregated from the job store, so they cover worker processes too.
+    """
+    summary = store.metrics_summary(STAGE_BUCKETS)
+    counters = [
+        ('lyric_downloaded_bytes_total', 'Bytes downloaded from source URLs.', None, summary['bytes_downloaded']),
+        ('lyric_audio_seconds_total', 'Seconds of audio processed.', None, summary['audio_seconds']),
+        ('lyric_rows_total', 'Spreadsheet rows finished.', {'result': 'done'}, summary['rows']['done']),
+        ('lyric_rows_total', 'Spreadsheet rows finished.', {'result': 'failed'}, summary['rows']['failed']),
+    ]
+    gauges = [('lyric_jobs', 'Jobs by final status; active jobs are not finished yet.', {'status': status}, count)
+              for status, count in sorted(summary['jobs'].items())]
+    gauges += [
+        ('lyric_stage_peak_rss_bytes', 'Highest peak RSS of a processing process after a stage.', None, summary['peak_rss']),
+        ('process_peak_rss_bytes', 'Peak RSS of the web process.', None, peak_rss_bytes()),
+    ]
+    models = get_manager().snapshot()
+    gauges += [('lyric_model_memory_bytes', 'Memory of the models loaded in the web process.',
+                {'model': m['key']}, int(m['mb'] * 1024 * 1024)) for m in models['models']]
+    if models['budget_mb'] is not None:
+        gauges.append(('lyric_model_memory_budget_bytes', 'Memory budget for loaded models.', None,
+                       int(models['budget_mb'] * 1024 * 1024)))
+    if app.config['WORKER_MODE'] == 'inline':
+        snapshot = scheduler.snapshot()
+        gauges += [
+            ('lyric_queue_jobs', 'Jobs in the scheduler.', {'state': 'running'}, len(snapshot['running'])),
+            ('lyric_queue_jobs', 'Jobs in the scheduler.', {'state': 'queued'}, len(snapshot['queued'])),
+        ]
+    return Response(render_prometheus(summary['stages'], counters, gauges),
+                    mimetype='text/plain; version=0.0.4')
+
+def _sse(seq, data):
+    return f"id: {seq}\ndata: {json.dumps(data)}\n\n"
 
 @app.route('/progress/<job_id>')
 def progress(job_id):
+    # EventSource sends Last-Event-ID by itself when it reconnects
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+
     def generate():
-        while True:
-            if job_id not in jobs:
-                yield f"data: {json.dumps({'error': 'Job not found'})}\n\n"
-                break
-                
-            job = jobs[job_id]
-            
-            # Construct data payload
-            data = {
+        last = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+
+        # New clients, or clients whose position is no longer in the history, get a full snapshot
+        if last is None or not bus.has_since(job_id, last):
+            # Take the sequence number first: events after it are replayed, and the
+            # client drops log lines the snapshot already contained
+            last = bus.latest_seq(job_id)
+            job = store.get_job(job_id)
+            if job is None:
+                yield f"data: {json.dumps({'type': 'error', 'error': 'Job not found'})}\n\n"
+                return
+            yield "retry: 2000\n\n"
+            yield _sse(last, {
+                'type': 'snapshot',
                 'status': job.get('status'),
                 'progress': job.get('progress'),
-                'log': job.get('log', [])[-1] if job.get('log') else None, # clear log to avoid sending history repeatedly? No, frontend handles append.
-                # Actually, simpler to just send latest log line if it's new, but for simplicity let's rely on frontend logic
+                'log': job['log'],
                 'done': job.get('done'),
                 'download_url': job.get('download_url'),
                 'error': job.get('error')
-            }
-            
-            yield f"data: {json.dumps(data)}\n\n"
-            
+            })
             if job.get('done'):
-                break
-                
-            time.sleep(1) # Poll interval
+                return
+
+        while True:
+            events = bus.wait(job_id, last, timeout=15)
+            if not events:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                continue
+            for seq, event in events:
+                yield _sse(seq, event)
+                last = seq
+                if event.get('done'):
+                    return
             
-    return Response(generate(), mimetype='text/event-stream')
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/download/<filename>')
 def download_result(filename):
     return send_file(os.path.join(app.config['RESULTS_FOLDER'], filename), as_attachment=True)
 
+def _job_files(job_id):
+    """
+    Result files of every finished row, relative to the job directory, in row order.
+    """
+    tasks = store.get_tasks(job_id)
+    return [f for _, task in sorted(tasks.items()) for f in task['files']]
+
+@app.route('/download/<job_id>/stream')
+def download_stream(job_id):
+    """
+    Streams the job's ZIP while it is being built: finished rows are sent
+    right away and the response stays open until the last row is done.
+    """
+    if store.get_job(job_id) is None:
+        abort(404)
+    job_dir = os.path.join(app.config['RESULTS_FOLDER'], job_id)
+
+    def generate():
+        stream = ZipStream()
+        sent = set()
+        seq = bus.latest_seq(job_id)
+        while True:
+            done = store.get_job(job_id)['done']
+            for relpath in _job_files(job_id):
+                path = os.path.join(job_dir, relpath)
+                if relpath in sent or not os.path.isfile(path):
+                    continue
+                sent.add(relpath)
+                yield from stream.write_file(path, relpath)
+            if done:
+                break
+            # Sleep until the job reports something new
+            events = bus.wait(job_id, seq, timeout=15)
+            if events:
+                seq = events[-1][0]
+        yield from stream.close()
+
+    return Response(generate(), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="{job_id}_results.zip"'})
+
+@app.route('/results/<job_id>/files')
+def list_result_files(job_id):
+    """
+    Lists the result files available so far, with a download URL for each.
+    """
+    job = store.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    files = [{'name': relpath, 'url': f"/results/{job_id}/files/{relpath}"} for relpath in _job_files(job_id)]
+    return jsonify({'done': job['done'], 'files': files})
+
+@app.route('/results/<job_id>/files/<path:relpath>')
+def download_result_file(job_id, relpath):
+    if relpath not in _job_files(job_id):
+        abort(404)
+    # send_from_directory refuses paths that escape the job directory
+    return send_from_directory(os.path.join(app.config['RESULTS_FOLDER'], job_id), relpath, as_attachment=True)
+
 if __name__ == '__main__':
+    # Needed for the long-audio process pool in the bundled exe
+    import multiprocessing
+    multiprocessing.freeze_support()
+
+    if app.config['WORKER_MODE'] == 'external':
+        # Workers resume abandoned jobs themselves when their claim expires
+        threading.Thread(target=relay_worker_progress, name='progress-relay', daemon=True).start()
+    else:
+        resume_unfinished_jobs()
+    if app.config['WARMUP']:
+        warmup.start()
     # When bundled, run without debugger and allow threading so background workers
     # and request handling run concurrently.
     app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False, threaded=True)
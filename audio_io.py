@@ -0,0 +1,122 @@
+"""
+Audio decoding helpers shared by separation and transcription.
+
+Audio is decoded once with ffmpeg into a float32 buffer; the separated vocals
+are then handed to Whisper as a 16 kHz mono array instead of being written to
+an MP3 and decoded again.
+"""
+
+import json
+import os
+import subprocess
+
+import numpy as np
+
+# Whisper models expect 16 kHz mono input
+WHISPER_SAMPLE_RATE = 16000
+
+
+def decode_audio(audio_path, samplerate=44100, channels=2):
+    """
+    Decodes any ffmpeg-readable file into float32 PCM.
+
+    Args:
+        audio_path (str): Path to the audio file.
+        samplerate (int): Output sample rate.
+        channels (int): Output channel count.
+
+    Returns:
+        numpy.ndarray: Array of shape (channels, samples), dtype float32.
+    """
+    cmd = [
+        'ffmpeg', '-nostdin', '-threads', '0',
+        '-i', audio_path,
+        '-f', 'f32le', '-acodec', 'pcm_f32le',
+        '-ac', str(channels), '-ar', str(samplerate),
+        '-'
+    ]
+    try:
+        out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to decode audio: {e.stderr.decode(errors='ignore')}") from e
+
+    pcm = np.frombuffer(out, dtype=np.float32)
+    return pcm.reshape(-1, channels).T.copy()
+
+
+def to_whisper_input(wav, samplerate):
+    """
+    Downmixes and resamples a (channels, samples) buffer for Whisper.
+
+    Args:
+        wav (numpy.ndarray or torch.Tensor): Audio of shape (channels, samples) or (samples,).
+        samplerate (int): Sample rate of wav.
+
+    Returns:
+        numpy.ndarray: 1-D float32 array at 16 kHz.
+    """
+    import torch
+    import julius
+
+    tensor = torch.as_tensor(wav, dtype=torch.float32)
+    if tensor.dim() > 1:
+        tensor = tensor.mean(dim=0)
+    if samplerate != WHISPER_SAMPLE_RATE:
+        tensor = julius.resample_frac(tensor, samplerate, WHISPER_SAMPLE_RATE)
+    return tensor.numpy().astype(np.float32, copy=False)
+
+
+def probe_audio(audio_path):
+    """
+    Checks with ffprobe that a file has a decodable audio stream.
+
+    Args:
+        audio_path (str): Path to the audio file.
+
+    Returns:
+        dict: codec, sample_rate, channels and duration of the first audio stream,
+              or None if the file has no readable audio.
+    """
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name,sample_rate,channels:format=duration',
+        '-of', 'json',
+        audio_path
+    ]
+    try:
+        out = subprocess.run(cmd, capture_output=True, check=True, text=True).stdout
+        data = json.loads(out)
+    except (subprocess.CalledProcessError, ValueError, OSError) as e:
+        print(f"ffprobe failed for {audio_path}: {e}")
+        return None
+
+    streams = data.get('streams') or []
+    if not streams:
+        return None
+    stream = streams[0]
+    duration = data.get('format', {}).get('duration')
+    return {
+        'codec': stream.get('codec_name'),
+        'sample_rate': int(stream.get('sample_rate') or 0),
+        'channels': int(stream.get('channels') or 0),
+        'duration': float(duration) if duration else None,
+    }
+
+
+def convert_audio(audio_path, audio_format='mp3', bitrate='192k'):
+    """
+    Re-encodes a file for exports that need a specific format.
+    Returns audio_path unchanged if it already has that extension.
+
+    Returns:
+        str: Path to the converted file, next to the original.
+    """
+    base, ext = os.path.splitext(audio_path)
+    if ext.lower() == f".{audio_format}":
+        return audio_path
+
+    out_path = f"{base}.{audio_format}"
+    cmd = ['ffmpeg', '-nostdin', '-y', '-i', audio_path, '-vn', '-b:a', bitrate, out_path]
+    subprocess.run(cmd, capture_output=True, check=True)
+    return out_path
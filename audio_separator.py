@@ -1,19 +1,371 @@
 import os
+import json
 import subprocess
 import shutil
+from contextlib import contextmanager
 
-def separate_audio(audio_path, output_base_dir="separated_audio"):
+from model_manager import get_manager
+
+# Weights of the Demucs models in MB, to make room in the model budget before loading
+DEMUCS_MODEL_MB = {
+    'htdemucs': 170,
+    'htdemucs_6s': 110,
+    'htdemucs_ft': 670,
+}
+
+# 'api' runs Demucs inside this process with a cached model, 'cli' spawns the demucs command
+DEFAULT_ENGINE = os.environ.get('SEPARATION_ENGINE', 'api')
+
+# Which stems are produced and written:
+#   'all'    every stem of the model (drums, bass, other, vocals for htdemucs)
+#   'two'    vocals and no_vocals (the accompaniment), like demucs --two-stems vocals
+#   'vocals' two-stem separation, but only vocals is written
+STEM_MODES = ('all', 'two', 'vocals')
+ACCOMPANIMENT_STEM = 'no_vocals'
+# Written next to the stems so every output records how it was produced
+SETTINGS_FILENAME = 'separation.json'
+
+
+def separation_settings(model_name='htdemucs', stems='all', segment=None, shifts=1, overlap=0.25):
+    """
+    The settings that change what Demucs outputs, in the form they are recorded
+    next to the stems and used as a cache key. The number of jobs only changes
+    speed, so it is not part of them.
+
+    Args:
+        model_name (str): Demucs model name.
+        stems (str): One of STEM_MODES.
+        segment (float, optional): Segment length in seconds (None: the model's default).
+                                   Shorter segments lower peak memory.
+        shifts (int): Random shifts averaged; each one is a full extra pass.
+        overlap (float): Overlap between segments.
+
+    Returns:
+        dict: model, stems, segment, shifts, overlap.
+    """
+    if stems not in STEM_MODES:
+        raise ValueError(f"Unknown stem mode {stems!r}, expected one of {', '.join(STEM_MODES)}")
+    return {
+        'model': model_name,
+        'stems': stems,
+        'segment': float(segment) if segment else None,
+        'shifts': int(shifts),
+        'overlap': float(overlap),
+    }
+
+
+def write_settings(track_dir, settings):
+    """
+    Records the separation settings in track_dir/separation.json.
+    """
+    os.makedirs(track_dir, exist_ok=True)
+    path = os.path.join(track_dir, SETTINGS_FILENAME)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(settings, f, indent=2, sort_keys=True)
+    return path
+
+
+def _load_separator(model_name):
+    from demucs.pretrained import get_model as get_demucs_model
+
+    model = get_demucs_model(model_name)
+    model.eval()
+    model.to(_device())
+    return model
+
+
+def _device():
+    import torch
+
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+@contextmanager
+def use_separator(model_name='htdemucs'):
+    """
+    Holds a pretrained Demucs model from the shared model manager, loading it on
+    first use. It cannot be unloaded (idle or over budget) until the block ends.
+
+    Yields:
+        tuple: (model in eval mode, device it is on)
+    """
+    with get_manager().acquire(f'demucs:{model_name}', lambda: _load_separator(model_name),
+                               estimate_mb=DEMUCS_MODEL_MB.get(model_name)) as model:
+        yield model, _device()
+
+
+def get_separator(model_name='htdemucs'):
+    """
+    Loads a pretrained Demucs model into the shared model manager (e.g. to preload it).
+
+    Args:
+        model_name (str): Demucs model name (e.g. 'htdemucs').
+
+    Returns:
+        tuple: (model in eval mode, device it is on)
+    """
+    with use_separator(model_name) as loaded:
+        return loaded
+
+
+def _apply_separator(wav, model_name, shifts=1, overlap=0.25, split=True, segment=None, jobs=0):
+    """
+    Runs the cached Demucs model on a (channels, samples) tensor at the model's sample rate.
+
+    Returns:
+        dict: Stem name to (channels, samples) tensor.
+    """
+    import torch
+    from demucs.apply import apply_model
+
+    # Same normalization as the demucs CLI
+    ref = wav.mean(0)
+    wav = (wav - ref.mean()) / ref.std()
+
+    with use_separator(model_name) as (model, device), torch.no_grad():
+        sources = apply_model(model, wav[None], device=device, shifts=shifts, split=split, overlap=overlap,
+                              segment=segment, num_workers=jobs, progress=False)[0]
+        names = model.sources
+    sources = sources * ref.std() + ref.mean()
+
+    return {name: source.cpu() for name, source in zip(names, sources)}
+
+
+def separate_tensors(audio_path, model_name='htdemucs', shifts=1, overlap=0.25, split=True, segment=None,
+                     jobs=0, stems='all'):
+    """
+    Separates audio in-process and returns the stems as tensors.
+
+    Args:
+        audio_path (str): Path to the input audio file.
+        model_name (str): Demucs model name.
+        shifts (int): Number of random shifts averaged (higher is slower, slightly better).
+        overlap (float): Overlap between split segments.
+        split (bool): Process the track in segments to bound memory use.
+        segment (float, optional): Segment length in seconds; None uses the model's default.
+        jobs (int): Threads processing segments in parallel on CPU (0: none).
+        stems (str): 'all', or 'two'/'vocals' to get vocals and no_vocals (the sum
+                     of the other stems) like demucs --two-stems vocals.
+
+    Returns:
+        tuple: (dict mapping stem name to a (channels, samples) tensor, samplerate)
+    """
+    from audio_io import decode_audio
+    import torch
+
+    with use_separator(model_name) as (model, _):
+        samplerate = model.samplerate
+        wav = torch.from_numpy(decode_audio(audio_path, samplerate=samplerate, channels=model.audio_channels))
+        sources = _apply_separator(wav, model_name, shifts=shifts, overlap=overlap, split=split,
+                                   segment=segment, jobs=jobs)
+    if stems != 'all':
+        vocals = sources.pop('vocals')
+        sources = {'vocals': vocals, ACCOMPANIMENT_STEM: sum(sources.values())}
+    return sources, samplerate
+
+
+def save_stems(stems, samplerate, track_dir, mode='all'):
+    """
+    Writes separated stems as MP3 files into track_dir. In 'vocals' mode only
+    vocals.mp3 is written.
+
+    Returns:
+        str: Path to vocals.mp3, or None if there is no vocals stem.
+    """
+    from demucs.audio import save_audio
+
+    os.makedirs(track_dir, exist_ok=True)
+    for name, source in stems.items():
+        if mode == 'vocals' and name != 'vocals':
+            continue
+        save_audio(source, os.path.join(track_dir, f"{name}.mp3"), samplerate)
+
+    vocals_path = os.path.join(track_dir, "vocals.mp3")
+    return vocals_path if os.path.exists(vocals_path) else None
+
+
+def separate_for_transcription(audio_path, model_name='htdemucs', keep_dir=None, stems='all', segment=None,
+                               shifts=1, overlap=0.25, jobs=0):
+    """
+    Decodes once, separates in memory and returns the vocals ready for Whisper.
+    Nothing touches disk unless keep_dir is given.
+
+    Args:
+        audio_path (str): Path to the input audio file.
+        model_name (str): Demucs model name.
+        keep_dir (str, optional): If set, stems are also written here as MP3,
+                                  with the settings in separation.json.
+        stems, segment, shifts, overlap, jobs: See separate_tensors.
+
+    Returns:
+        tuple: (16 kHz mono float32 vocals array, path to vocals.mp3 or None)
+    """
+    from audio_io import to_whisper_input
+
+    settings = separation_settings(model_name, stems, segment, shifts, overlap)
+    sources, samplerate = separate_tensors(audio_path, model_name=model_name, shifts=shifts, overlap=overlap,
+                                           segment=segment, jobs=jobs, stems=stems)
+    vocals_path = None
+    if keep_dir:
+        vocals_path = save_stems(sources, samplerate, keep_dir, mode=stems)
+        write_settings(keep_dir, settings)
+    return to_whisper_input(sources['vocals'], samplerate), vocals_path
+
+
+def default_track_dir(output_base_dir, model_name, audio_path):
+    """
+    Where the demucs CLI writes the stems of audio_path: output_base_dir/model_name/song_name
+    """
+    song_name = os.path.splitext(os.path.basename(audio_path))[0]
+    return os.path.join(output_base_dir, model_name, song_name)
+
+
+def move_stems(src_dir, dest_dir):
+    """
+    Moves every file of src_dir into dest_dir and removes src_dir. On the same
+    filesystem each file is renamed, so nothing is copied.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    for name in os.listdir(src_dir):
+        src = os.path.join(src_dir, name)
+        if os.path.isfile(src):
+            shutil.move(src, os.path.join(dest_dir, name))
+    shutil.rmtree(src_dir, ignore_errors=True)
+    return dest_dir
+
+
+def _separate_in_process(audio_path, track_dir, settings, jobs):
+    """
+    Separates with the cached Demucs model and writes the MP3 stems straight into track_dir.
+    """
+    model_name = settings['model']
+    stems, samplerate = separate_tensors(audio_path, model_name=model_name, shifts=settings['shifts'],
+                                         overlap=settings['overlap'], segment=settings['segment'], jobs=jobs,
+                                         stems=settings['stems'])
+
+    vocals_path = save_stems(stems, samplerate, track_dir, mode=settings['stems'])
+    write_settings(track_dir, settings)
+
+    if vocals_path:
+        print(f"Vocals found at: {vocals_path}")
+        return vocals_path
+
+    print(f"Could not locate vocals file in: {track_dir}")
+    return None
+
+
+def _separate_cli(audio_path, output_base_dir, settings, jobs, track_dir):
+    """
+    Separates by running the demucs command in a new process. The command
+    always writes output_base_dir/model_name/song_name; if track_dir is
+    elsewhere the stems are moved there.
+    """
+    model_name = settings['model']
+    # Construct Demucs command
+    # -n htdemucs: Use the hybrid transformer model (faster and good quality)
+    # --mp3: Save as MP3 to avoid TorchCodec errors and save space
+    command = [
+        "demucs",
+        "-n", model_name,
+        "--mp3",
+        "--out", output_base_dir,
+        "--shifts", str(settings['shifts']),
+        "--overlap", str(settings['overlap']),
+    ]
+    if settings['stems'] != 'all':
+        command += ["--two-stems", "vocals"]
+    if settings['segment']:
+        command += ["--segment", str(settings['segment'])]
+    if jobs:
+        command += ["-j", str(jobs)]
+    command.append(audio_path)
+
+    # Run Demucs
+    subprocess.run(command, check=True)
+
+    # Construct expected path to vocals
+    # Demucs output structure: output_dir/htdemucs/song_name/vocals.mp3
+    filename = os.path.basename(audio_path)
+    song_name = os.path.splitext(filename)[0]
+
+    # Demucs might sanitize the song name in the output folder
+    # We need to find the correct folder in htdemucs output
+    model_output_dir = os.path.join(output_base_dir, model_name)
+
+    # Find the folder that sounds like our song
+    # Simplest way is to look for the most recently created folder or match name
+    # But Demucs naming can be tricky with special chars.
+    # For now, let's assume standard behavior or search.
+
+    # Let's try to predict the name Demucs used
+    # Demucs replaces spaces with similar chars or keeps them depending on version
+    # It's safer to check the directory list in model_output_dir
+
+    candidate_dirs = os.listdir(model_output_dir)
+    # Filter for directories
+    candidate_dirs = [d for d in candidate_dirs if os.path.isdir(os.path.join(model_output_dir, d))]
+
+    # Find the best match (naive approach: checks if song_name is part of dir name?)
+    # Better: Since we just ran it, it should be there.
+    # Let's try direct path first.
+    vocals_path = os.path.join(model_output_dir, song_name, "vocals.mp3")
+
+    if os.path.exists(vocals_path):
+         # The CLI has no option to skip the accompaniment, so drop it afterwards
+         accompaniment = os.path.join(os.path.dirname(vocals_path), f"{ACCOMPANIMENT_STEM}.mp3")
+         if settings['stems'] == 'vocals' and os.path.exists(accompaniment):
+             os.remove(accompaniment)
+         if os.path.abspath(track_dir) != os.path.abspath(os.path.dirname(vocals_path)):
+             vocals_path = os.path.join(move_stems(os.path.dirname(vocals_path), track_dir), "vocals.mp3")
+         write_settings(track_dir, settings)
+         print(f"Vocals found at: {vocals_path}")
+         return vocals_path
+
+    # If not found directly, try finding the folder by matching sanitized name behavior?
+    # Or just return None for now and debug if needed.
+    # Actually, let's try to look for the track name in the output folder
+    for d in candidate_dirs:
+         # If the directory name is a "clean" version of song_name
+         pass
+
+    # If direct path failed, maybe check recent modify time?
+    # For now, sticking to simple path.
+
+    print(f"Could not locate vocals file at expected path: {vocals_path}")
+    # Try to look into subdirectories of model_output_dir to find 'vocals.wav'
+    # and return the one matching our file?
+
+    return None
+
+
+def separate_audio(audio_path, output_base_dir="separated_audio", model_name="htdemucs", engine=None,
+                   stems='all', segment=None, shifts=1, overlap=0.25, jobs=0, track_dir=None):
     """
     Separates audio using Demucs.
-    
+
     Args:
         audio_path (str): Path to the input audio file.
         output_base_dir (str): Base directory for Demucs output.
-        
+        track_dir (str, optional): Final folder of the stems. Defaults to the CLI
+                                   layout, output_base_dir/model_name/song_name.
+                                   The in-process engine writes there directly; the
+                                   CLI output is moved there (a rename on the same
+                                   filesystem), so stems are never written twice.
+        model_name (str): Demucs model name.
+        engine (str, optional): 'api' to run Demucs in-process with a cached model,
+                                'cli' to spawn the demucs command. Defaults to
+                                SEPARATION_ENGINE. The API engine falls back to the
+                                CLI if it fails.
+        stems, segment, shifts, overlap, jobs: See separate_tensors.
+
     Returns:
         str: Path to the isolated vocals file, or None if failed.
     """
+    engine = engine or DEFAULT_ENGINE
     try:
+        settings = separation_settings(model_name, stems, segment, shifts, overlap)
+        track_dir = track_dir or default_track_dir(output_base_dir, model_name, audio_path)
+
         if not os.path.exists(audio_path):
             print(f"Audio file not found: {audio_path}")
             return None
@@ -22,68 +374,15 @@ def separate_audio(audio_path, output_base_dir="separated_audio"):
         if not os.path.exists(output_base_dir):
             os.makedirs(output_base_dir)
 
-        print(f"Separating audio with Demucs: {audio_path}")
-        
-        # Construct Demucs command
-        # -n htdemucs: Use the hybrid transformer model (faster and good quality)
-        # --mp3: Save as MP3 to avoid TorchCodec errors and save space
-        command = [
-            "demucs",
-            "-n", "htdemucs",
-            "--mp3",
-            "--out", output_base_dir,
-            audio_path
-        ]
-        
-        # Run Demucs
-        subprocess.run(command, check=True)
-        
-        # Construct expected path to vocals
-        # Demucs output structure: output_dir/htdemucs/song_name/vocals.mp3
-        filename = os.path.basename(audio_path)
-        song_name = os.path.splitext(filename)[0]
-        
-        # Demucs might sanitize the song name in the output folder
-        # We need to find the correct folder in htdemucs output
-        model_output_dir = os.path.join(output_base_dir, "htdemucs")
-        
-        # Find the folder that sounds like our song
-        # Simplest way is to look for the most recently created folder or match name
-        # But Demucs naming can be tricky with special chars. 
-        # For now, let's assume standard behavior or search.
-        
-        # Let's try to predict the name Demucs used
-        # Demucs replaces spaces with similar chars or keeps them depending on version
-        # It's safer to check the directory list in model_output_dir
-        
-        candidate_dirs = os.listdir(model_output_dir)
-        # Filter for directories
-        candidate_dirs = [d for d in candidate_dirs if os.path.isdir(os.path.join(model_output_dir, d))]
-        
-        # Find the best match (naive approach: checks if song_name is part of dir name?)
-        # Better: Since we just ran it, it should be there.
-        # Let's try direct path first.
-        vocals_path = os.path.join(model_output_dir, song_name, "vocals.mp3")
-        
-        if os.path.exists(vocals_path):
-             print(f"Vocals found at: {vocals_path}")
-             return vocals_path
-             
-        # If not found directly, try finding the folder by matching sanitized name behavior?
-        # Or just return None for now and debug if needed.
-        # Actually, let's try to look for the track name in the output folder
-        for d in candidate_dirs:
-             # If the directory name is a "clean" version of song_name
-             pass 
-
-        # If direct path failed, maybe check recent modify time?
-        # For now, sticking to simple path.
-        
-        print(f"Could not locate vocals file at expected path: {vocals_path}")
-        # Try to look into subdirectories of model_output_dir to find 'vocals.wav'
-        # and return the one matching our file?
-        
-        return None
+        print(f"Separating audio with Demucs ({engine}): {audio_path}")
+
+        if engine == 'api':
+            try:
+                return _separate_in_process(audio_path, track_dir, settings, jobs)
+            except Exception as e:
+                print(f"In-process Demucs failed, falling back to CLI: {e}")
+
+        return _separate_cli(audio_path, output_base_dir, settings, jobs, track_dir)
 
     except subprocess.CalledProcessError as e:
         print(f"Demucs separation failed: {e}")
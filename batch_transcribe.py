@@ -2,15 +2,168 @@
 """
 Batch transcription script for processing all audio files in the uploads folder.
 Uses Demucs for vocal separation before transcription for improved accuracy.
+The stems are written to results/<name>/separated with the Demucs settings in
+separation.json; --stems, --segment, --shifts, --overlap and --demucs-jobs
+trade separation quality against CPU time and memory.
+
+With --workers N the files are spread over N processes. Each worker loads the
+Whisper model once and uses --threads torch threads, so N x threads should not
+exceed the number of cores. The longest files are handed out first so one long
+file does not finish alone at the end; results are still reported in file order.
+--backend whisper-int8 runs an int8-quantized Whisper, faster on CPU-only machines.
+Files go through in groups of --batch: separated one after another, then
+transcribed together with their 30-second Whisper windows decoded in shared
+batches, which keeps the CPU busier than one window at a time.
+
+Runs are incremental: results_dir/manifest.jsonl records the size, mtime and
+content hash of every transcribed file with the settings used, one line per
+finished file, so a later (or interrupted) run only processes files that are
+new, changed, or were transcribed with other settings. --force ignores it.
 """
 
+import json
 import os
 import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from transcriber import transcribe_audio
+from transcriber import transcribe_batch, transcribe_result
+from whisper_backends import DEFAULT_BACKEND, configure_threads
+from audio_separator import separation_settings
+from result_cache import get_cache, hash_file, settings_key
+from metrics import JobMetrics, audio_duration, peak_rss_bytes
+
+FAILURES_FILENAME = 'failures.json'
+MANIFEST_FILENAME = 'manifest.jsonl'
 
 
-def batch_transcribe(uploads_dir='uploads', results_dir='results', use_separation=True):
+class Manifest:
+    """
+    Append-only record of the files a previous run finished.
+
+    Every finished file appends one JSON line (later lines win), so nothing is
+    lost if the run is interrupted. compact() rewrites the file with one line
+    per input at the end of a run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Half-written last line of an interrupted run
+                        continue
+                    self.entries[entry['file']] = entry
+
+    def check(self, filename, filepath, settings, output_path):
+        """
+        Returns (up to date, content hash or None). The file is only hashed when its
+        size or mtime changed; same content with a new mtime still counts as done.
+        """
+        entry = self.entries.get(filename)
+        if not entry or entry['settings'] != settings_key(settings) or not os.path.exists(output_path):
+            return False, None
+        stat = os.stat(filepath)
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return True, entry['hash']
+        audio_hash = hash_file(filepath)
+        if audio_hash != entry['hash']:
+            return False, audio_hash
+        self.add(filename, filepath, audio_hash, settings)
+        return True, audio_hash
+
+    def add(self, filename, filepath, audio_hash, settings):
+        stat = os.stat(filepath)
+        entry = {'file': filename, 'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': audio_hash,
+                 'settings': settings_key(settings), 'updated': time.time()}
+        self.entries[filename] = entry
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def compact(self, keep):
+        """
+        Rewrites the manifest with the latest entry of every file in `keep`.
+        """
+        self.entries = {name: entry for name, entry in self.entries.items() if name in keep}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, self.path)
+
+
+def _init_worker(model_size, threads, backend, cascade=None):
+    from transcriber import get_model
+    from whisper_backends import configure_threads
+
+    configure_threads(threads)
+    get_model(model_size, backend)
+    if cascade:
+        get_model(cascade, backend)
+
+
+def _transcribe_files(filepaths, model_size, separation=None, stems_dirs=None, backend=None, cascade=None):
+    """
+    Runs in a worker process. separation holds separate_for_transcription options,
+    or None to transcribe the original audio; stems are written to stems_dirs.
+    Several files are separated one after another, then transcribed together
+    as one batch (transcriber.transcribe_batch).
+
+    Returns:
+        list: Per file, (result, whether the vocals were separated, seconds per stage,
+              peak RSS of the worker), or the exception it raised.
+    """
+    stems_dirs = stems_dirs or [None] * len(filepaths)
+    audios = list(filepaths)
+    separated = [False] * len(filepaths)
+    seconds = [{} for _ in filepaths]
+    if separation is not None:
+        from audio_separator import separate_for_transcription
+
+        for n, (filepath, stems_dir) in enumerate(zip(filepaths, stems_dirs)):
+            start = time.perf_counter()
+            if stems_dir:
+                # Stems of an earlier run may come from another stem mode
+                shutil.rmtree(stems_dir, ignore_errors=True)
+            try:
+                audios[n], _ = separate_for_transcription(filepath, keep_dir=stems_dir, **separation)
+                separated[n] = True
+            except Exception as e:
+                print(f"[ERROR] Vocal separation failed for {os.path.basename(filepath)}, using original audio: {e}")
+            seconds[n]['separate'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = None
+    if len(audios) > 1:
+        try:
+            results = transcribe_batch(audios, model_size=model_size, backend=backend, cascade=cascade)
+        except Exception as e:
+            print(f"[ERROR] Batched transcription failed, transcribing one by one: {e}")
+    if results is None:
+        results = []
+        for audio in audios:
+            try:
+                results.append(transcribe_result(audio, model_size=model_size, backend=backend, cascade=cascade))
+            except Exception as e:
+                results.append(e)
+    # The batch's time is shared between its files by audio length (equally for paths)
+    elapsed = time.perf_counter() - start
+    weights = [1 if isinstance(audio, str) else len(audio) for audio in audios]
+    for n, weight in enumerate(weights):
+        seconds[n]['transcribe'] = elapsed * weight / (sum(weights) or 1)
+
+    peak = peak_rss_bytes()
+    return [result if isinstance(result, Exception) else (result, separated[n], seconds[n], peak)
+            for n, result in enumerate(results)]
+
+
+def batch_transcribe(uploads_dir='uploads', results_dir='results', use_separation=True, cache_dir='cache',
+                     model_size='large', workers=1, threads=None, force=False, stems='all', segment=None,
+                     shifts=1, overlap=0.25, demucs_jobs=0, backend=None, batch=1, cascade=None):
     """
     Batch transcribes all audio files from uploads_dir and saves results to results_dir.
 
@@ -18,12 +171,47 @@ def batch_transcribe(uploads_dir='uploads', results_dir='results', use_separatio
         uploads_dir (str): Directory containing audio files to process.
         results_dir (str): Directory to save transcription results.
         use_separation (bool): Whether to use vocal separation before transcription (default True).
+        cache_dir (str, optional): Result cache shared with the web app. Files whose content was
+                                   already transcribed with the same settings are not re-run.
+                                   None disables the cache.
+        model_size (str): Whisper model size (default 'large').
+        workers (int): Worker processes. 1 transcribes in this process.
+        threads (int, optional): Torch threads per worker. Defaults to CPUs / workers.
+        force (bool): Transcribe every file, even those the manifest marks as up to date.
+        stems (str): Stems written to results: 'all', 'two' (vocals + accompaniment) or 'vocals'.
+        segment, shifts, overlap: Demucs settings (see audio_separator.separation_settings).
+        demucs_jobs (int): Demucs threads per file (0: none).
+        backend (str, optional): Whisper inference backend, e.g. 'whisper-int8'
+                                 (see whisper_backends). Default WHISPER_BACKEND.
+        batch (int): Files separated in turn and then transcribed as one batch, their
+                     Whisper windows decoded together (default 1: one file at a time).
+        cascade (str, optional): Faster model size (e.g. 'small') tried first; only its
+                                 low-confidence parts are re-run with model_size (see cascade.py).
+
+    Per-file stage timings, audio duration and real-time factor are written to
+    results_dir/metrics.json, and every failed file with its error to
+    results_dir/failures.json.
     """
+    cache = get_cache(cache_dir) if cache_dir else None
+    stem_settings = separation_settings(stems=stems, segment=segment, shifts=shifts, overlap=overlap) \
+        if use_separation else None
+    separation = {'stems': stems, 'segment': segment, 'shifts': shifts, 'overlap': overlap,
+                  'jobs': demucs_jobs} if use_separation else None
+    transcript_settings = {'model_size': model_size, 'separation': stem_settings}
+    backend = backend or DEFAULT_BACKEND
+    if backend != 'whisper':
+        # Only recorded when not the default, so earlier manifests and cached transcripts stay valid
+        transcript_settings['backend'] = backend
+    if cascade:
+        transcript_settings['cascade'] = cascade
+    if batch > 1:
+        # Batched decoding gives slightly different text than sequential decoding
+        transcript_settings['decode'] = 'batched'
     # Ensure results directory exists
     os.makedirs(results_dir, exist_ok=True)
 
     # Audio file extensions
-    audio_extensions = ('.mp3', '.wav', '.flac', '.m4a', '.aac', '.ogg')
+    audio_extensions = ('.mp3', '.wav', '.flac', '.m4a', '.aac', '.ogg', '.opus', '.webm')
 
     # Get list of audio files
     audio_files = []
@@ -38,80 +226,208 @@ def batch_transcribe(uploads_dir='uploads', results_dir='results', use_separatio
         print("No audio files found in uploads directory.")
         return
 
+    workers = max(1, int(workers))
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
     print(f"Found {total} audio files to transcribe")
-    print(f"Using vocal separation: {use_separation}\n")
+    print(f"Using vocal separation: {use_separation}" + (f" ({stems} stems)" if use_separation else ""))
+    print(f"Whisper: {model_size} ({backend} backend)" + (f", {cascade} first (cascade)" if cascade else ""))
+    print(f"Workers: {workers} ({threads} threads each)")
+    print()
 
-    # Process each audio file
-    processed = 0
-    failed = 0
+    metrics = JobMetrics('batch')
+    manifest = Manifest(os.path.join(results_dir, MANIFEST_FILENAME))
+    skipped = 0
+    failures = []
+    # Per-file outcome lines, printed in file order as soon as every earlier file is done
+    outcomes = {}
+    next_to_print = [1]
 
-    for i, filename in enumerate(audio_files, 1):
-        filepath = os.path.join(uploads_dir, filename)
+    def report_outcome(i, lines):
+        # None marks a file skipped silently
+        outcomes[i] = lines
+        while next_to_print[0] in outcomes:
+            n = next_to_print[0]
+            lines = outcomes.pop(n)
+            next_to_print[0] += 1
+            if lines is None:
+                continue
+            print(f"[{n}/{total}] {audio_files[n - 1]}")
+            for line in lines:
+                print(f"  {line}")
+            print()
+
+    def fail(i, filename, error):
+        failures.append({'file': filename, 'error': str(error)})
+        report_outcome(i, [f"✗ Error: {error}"])
+
+    def txt_path_for(filename):
         audio_basename = Path(filename).stem
+        return os.path.join(results_dir, audio_basename, f"{audio_basename}.txt")
 
-        print(f"[{i}/{total}] Transcribing: {filename}")
+    def stems_dir_for(filename):
+        return os.path.join(results_dir, Path(filename).stem, 'separated')
 
-        try:
-            # Create subdirectory for this audio file's results
-            audio_result_dir = os.path.join(results_dir, audio_basename)
-            os.makedirs(audio_result_dir, exist_ok=True)
-
-            # Transcribe audio
-            print(f"  → Separating vocals and transcribing...")
-            transcript_text = transcribe_audio(filepath, model_size='large', use_separation=use_separation)
-
-            # Check for errors
-            if transcript_text.startswith("Error"):
-                print(f"  ✗ Transcription error: {transcript_text}")
-                failed += 1
-                continue
+    def save(i, filename, result, cached, audio_hash, settings):
+        audio_basename = Path(filename).stem
+        lines = ["→ Using cached transcription"] if cached else []
 
-            # Save transcription
-            txt_filename = f"{audio_basename}.txt"
-            txt_path = os.path.join(audio_result_dir, txt_filename)
-            with open(txt_path, 'w', encoding='utf-8') as f:
-                f.write(transcript_text)
+        # Create subdirectory for this audio file's results
+        audio_result_dir = os.path.join(results_dir, audio_basename)
+        os.makedirs(audio_result_dir, exist_ok=True)
 
-            print(f"  ✓ Transcription saved to {txt_path}")
+        # Save transcription
+        txt_filename = f"{audio_basename}.txt"
+        txt_path = os.path.join(audio_result_dir, txt_filename)
+        with open(txt_path, 'w', encoding='utf-8') as f:
+            f.write(result['text'])
+        lines.append(f"✓ Transcription saved to {txt_path}")
+        cascade_stats = result.get('cascade')
+        if cascade_stats and not cached:
+            scope = " (whole track)" if cascade_stats['whole_track'] else ""
+            lines.append(f"→ Cascade: {cascade_stats['escalated_seconds']:.0f}s of {cascade_stats['audio_seconds']:.0f}s "
+                         f"re-transcribed with {cascade_stats['model']}{scope}")
+            metrics.set(i, escalated_seconds=cascade_stats['escalated_seconds'])
 
-            # Copy separated audio files if they exist
-            if use_separation:
-                separated_source_dir = os.path.join(uploads_dir, f"{audio_basename}_separated", audio_basename)
+        stems_dir = stems_dir_for(filename)
+        if use_separation and not cached and os.path.isdir(stems_dir):
+            lines.append(f"✓ Separated audio files saved to {stems_dir}")
+        manifest.add(filename, os.path.join(uploads_dir, filename), audio_hash, settings)
+        report_outcome(i, lines)
 
-                if os.path.exists(separated_source_dir):
-                    separated_dest_dir = os.path.join(audio_result_dir, "separated")
+    # Cache lookups and writes stay in this process, next to the manifest
+    pending = []
+    for i, filename in enumerate(audio_files, 1):
+        filepath = os.path.join(uploads_dir, filename)
+        try:
+            with metrics.stage(i, 'manifest_check'):
+                up_to_date, audio_hash = manifest.check(filename, filepath, transcript_settings, txt_path_for(filename))
+            if up_to_date and not force:
+                skipped += 1
+                report_outcome(i, None)
+                continue
+            duration = audio_duration(filepath)
+            metrics.set(i, file=filename, audio_seconds=duration)
+            with metrics.stage(i, 'cache_lookup'):
+                audio_hash = audio_hash or hash_file(filepath)
+                result = cache.get_transcript(audio_hash, transcript_settings) if cache else None
+        except Exception as e:
+            fail(i, filename, e)
+            continue
+        if result:
+            save(i, filename, result, cached=True, audio_hash=audio_hash, settings=transcript_settings)
+        else:
+            pending.append((i, filename, filepath, audio_hash, duration))
 
-                    # Remove existing separated directory if present
-                    if os.path.exists(separated_dest_dir):
-                        shutil.rmtree(separated_dest_dir)
+    def finish(i, filename, audio_hash, outcome):
+        result, separated, seconds, worker_peak = outcome
+        for stage, stage_seconds in seconds.items():
+            metrics.record(i, stage, stage_seconds, peak_rss=worker_peak)
+        # A failed separation means the original audio was transcribed. Recording
+        # that in the manifest too makes the next run retry the file.
+        settings = transcript_settings if separated else dict(transcript_settings, separation=None)
+        if cache:
+            cache.put_transcript(audio_hash, settings, result)
+        save(i, filename, result, cached=False, audio_hash=audio_hash, settings=settings)
 
-                    # Copy separated files
-                    shutil.copytree(separated_source_dir, separated_dest_dir)
-                    print(f"  ✓ Separated audio files saved to {separated_dest_dir}")
+    def finish_group(group, results):
+        for (i, filename, _, audio_hash, _), outcome in zip(group, results):
+            if isinstance(outcome, Exception):
+                fail(i, filename, outcome)
+                continue
+            try:
+                finish(i, filename, audio_hash, outcome)
+            except Exception as e:
+                fail(i, filename, e)
 
-            processed += 1
-            print()
+    def group_args(group):
+        return [p[2] for p in group], model_size, separation, [stems_dir_for(p[1]) for p in group], backend, cascade
 
-        except Exception as e:
-            print(f"  ✗ Error: {str(e)}\n")
-            failed += 1
+    batch = max(1, int(batch))
+    if workers > 1:
+        # Longest first (by duration, or size when ffprobe could not tell); similar
+        # lengths also end up in the same batch
+        pending.sort(key=lambda p: p[4] if p[4] is not None else os.path.getsize(p[2]) / 16000, reverse=True)
+    groups = [pending[n:n + batch] for n in range(0, len(pending), batch)]
+
+    if workers == 1:
+        # This process is the worker; the model is loaded on the first file
+        configure_threads(threads)
+        for group in groups:
+            try:
+                results = _transcribe_files(*group_args(group))
+            except Exception as e:
+                results = [e] * len(group)
+            finish_group(group, results)
+    elif groups:
+        with ProcessPoolExecutor(max_workers=min(workers, len(groups)), initializer=_init_worker,
+                                 initargs=(model_size, threads, backend, cascade)) as pool:
+            futures = {pool.submit(_transcribe_files, *group_args(group)): group for group in groups}
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    results = [e] * len(group)
+                finish_group(group, results)
+
+    manifest.compact(set(audio_files))
+    metrics.finish()
+    report = metrics.report()
+    report_path = metrics.write_report(results_dir)
+    failures.sort(key=lambda f: f['file'])
+    failures_path = os.path.join(results_dir, FAILURES_FILENAME)
+    with open(failures_path, 'w', encoding='utf-8') as f:
+        json.dump({'total': total, 'failed': len(failures), 'failures': failures}, f, indent=2, ensure_ascii=False)
 
     # Print summary
     print("=" * 60)
     print(f"Batch transcription completed!")
     print(f"  Total files: {total}")
-    print(f"  Successfully processed: {processed}")
-    print(f"  Failed: {failed}")
+    print(f"  Unchanged since last run (skipped): {skipped}")
+    print(f"  Successfully processed: {total - skipped - len(failures)}")
+    print(f"  Failed: {len(failures)}" + (f" (see {failures_path})" if failures else ""))
+    if cache:
+        stats = cache.stats()
+        print(f"  Cache: {stats['hits']['transcript']} hit / {stats['misses']['transcript']} miss")
+    if report['real_time_factor']:
+        print(f"  Audio: {report['audio_seconds']:.0f}s in {report['wall_seconds']:.0f}s "
+              f"(real-time factor {report['real_time_factor']:.2f})")
+    print(f"  Timings saved to: {report_path}")
     print(f"  Results saved to: {results_dir}/")
     print("=" * 60)
 
 
 if __name__ == '__main__':
-    import sys
+    import argparse
+    from audio_separator import STEM_MODES
+    from whisper_backends import backend_names
 
-    # Accept optional command line arguments
-    uploads = sys.argv[1] if len(sys.argv) > 1 else 'uploads'
-    results = sys.argv[2] if len(sys.argv) > 2 else 'results'
-    separation = sys.argv[3].lower() != 'false' if len(sys.argv) > 3 else True
+    parser = argparse.ArgumentParser(description="Transcribe every audio file in a folder.")
+    # Positional arguments kept compatible with: batch_transcribe.py [uploads] [results] [separation]
+    parser.add_argument('uploads', nargs='?', default='uploads')
+    parser.add_argument('results', nargs='?', default='results')
+    parser.add_argument('separation', nargs='?', default='true', help="'false' to skip vocal separation")
+    parser.add_argument('--model', default='large', help="Whisper model size (default: large)")
+    parser.add_argument('--backend', default=None, choices=backend_names(),
+                        help="Whisper inference backend, e.g. whisper-int8 on CPU (default: WHISPER_BACKEND or whisper)")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes (default: 1)")
+    parser.add_argument('--threads', type=int, default=None, help="Torch threads per worker (default: CPUs / workers)")
+    parser.add_argument('--batch', type=int, default=1,
+                        help="Files transcribed together, their Whisper windows batched (default: 1, off)")
+    parser.add_argument('--cascade', default=None, metavar='MODEL',
+                        help="Transcribe with this faster model first (e.g. small) and re-run only its "
+                             "low-confidence parts with --model")
+    parser.add_argument('--force', action='store_true', help="Re-transcribe files the manifest marks as up to date")
+    parser.add_argument('--stems', default='all', choices=STEM_MODES,
+                        help="Stems to write: all, two (vocals + accompaniment) or vocals (default: all)")
+    parser.add_argument('--segment', type=float, default=None,
+                        help="Demucs segment length in seconds; shorter uses less memory (default: model's)")
+    parser.add_argument('--shifts', type=int, default=1, help="Demucs random shifts; each is a full extra pass (default: 1)")
+    parser.add_argument('--overlap', type=float, default=0.25, help="Demucs overlap between segments (default: 0.25)")
+    parser.add_argument('--demucs-jobs', type=int, default=0, help="Demucs threads per file (default: 0)")
+    args = parser.parse_args()
 
-    batch_transcribe(uploads, results, separation)
+    batch_transcribe(args.uploads, args.results, args.separation.lower() != 'false', model_size=args.model,
+                     workers=args.workers, threads=args.threads, force=args.force, stems=args.stems,
+                     segment=args.segment, shifts=args.shifts, overlap=args.overlap, demucs_jobs=args.demucs_jobs,
+                     backend=args.backend, batch=args.batch, cascade=args.cascade)
@@ -0,0 +1,217 @@
+"""
+Whisper decoding batched across tracks.
+
+whisper's transcribe() walks a track 30 seconds at a time, so the encoder and
+the decoder run with a batch of one and most of the CPU's vector width is
+idle. decode_batch cuts every track into windows of at most 30 seconds at
+quiet points, and runs the log-mel windows of all the tracks through
+whisper.decode together, WHISPER_BATCH_SIZE windows at a time. The decoded
+tokens are turned back into per-track results with the same structure as
+transcribe(): 'text', 'segments' (with timestamps on the track's timeline)
+and 'language'.
+
+Windows are decoded independently, as transcribe() does with
+condition_on_previous_text=False, and the temperature fallback is applied
+per window with the same thresholds.
+"""
+
+import os
+
+import numpy as np
+
+from audio_io import WHISPER_SAMPLE_RATE
+from long_audio import find_split_points
+
+# Windows sent through the encoder at once
+DEFAULT_BATCH_SIZE = int(os.environ.get('WHISPER_BATCH_SIZE', 8))
+
+# Split targets and search span: windows end at the quietest point within
+# SEARCH_SECONDS of every WINDOW_SECONDS, so none is longer than 30 s
+WINDOW_SECONDS = 24.0
+SEARCH_SECONDS = 6.0
+
+# transcribe()'s defaults
+TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+# Options decode_batch understands; other transcribe() options (initial_prompt,
+# word_timestamps...) need the sequential path
+DECODE_OPTIONS = ('language', 'task', 'temperature', 'beam_size', 'best_of', 'patience', 'fp16')
+
+
+def split_windows(audio, samplerate=WHISPER_SAMPLE_RATE):
+    """
+    Returns (start, end) sample ranges of at most 30 seconds covering the audio.
+    """
+    if len(audio) == 0:
+        return []
+    points = find_split_points(audio, samplerate, chunk_seconds=WINDOW_SECONDS, search_seconds=SEARCH_SECONDS)
+    bounds = [0] + [int(p * samplerate) for p in points] + [len(audio)]
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def _needs_fallback(result):
+    # Same rule as transcribe(): an improbable window over silence is skipped
+    # later, not re-decoded; a confident one is still checked for repetition
+    if result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD:
+        return False
+    return result.compression_ratio > COMPRESSION_RATIO_THRESHOLD or result.avg_logprob < LOGPROB_THRESHOLD
+
+
+def _decode_with_fallback(model, mel, language, task, temperatures, fp16, beam_size, best_of, patience):
+    """
+    Decodes a batch of windows, re-decoding at the next temperature only the
+    windows whose output looks like a failure (repetitive or improbable).
+
+    Returns:
+        list[DecodingResult]: One result per window.
+    """
+    import whisper
+
+    results = [None] * len(mel)
+    todo = list(range(len(mel)))
+    for temperature in temperatures:
+        options = {'language': language, 'task': task, 'temperature': temperature, 'fp16': fp16,
+                   'without_timestamps': False}
+        if temperature > 0:
+            options['best_of'] = best_of
+        else:
+            options.update(beam_size=beam_size, patience=patience)
+        decoded = whisper.decode(model, mel[todo], whisper.DecodingOptions(**options))
+        retry = []
+        for i, result in zip(todo, decoded):
+            results[i] = result
+            if _needs_fallback(result):
+                retry.append(i)
+        todo = retry
+        if not todo:
+            break
+    return results
+
+
+def _segments(result, tokenizer, offset, duration, time_precision, frames_per_second):
+    """
+    Splits a window's tokens into segments at its timestamp tokens. Times are
+    shifted by the window's offset in the track.
+    """
+    segments = []
+    start = None
+    text_tokens = []
+
+    def close(end):
+        text = tokenizer.decode(text_tokens)
+        if text.strip():
+            segments.append({
+                'seek': int(offset * frames_per_second),
+                'start': round(offset + (start or 0.0), 3),
+                'end': round(offset + min(end, duration), 3),
+                'text': text,
+                'tokens': list(text_tokens),
+                'temperature': result.temperature,
+                'avg_logprob': result.avg_logprob,
+                'compression_ratio': result.compression_ratio,
+                'no_speech_prob': result.no_speech_prob,
+            })
+
+    for token in result.tokens:
+        if token >= tokenizer.timestamp_begin:
+            time = (token - tokenizer.timestamp_begin) * time_precision
+            if text_tokens:
+                close(time)
+                text_tokens = []
+                start = None
+            else:
+                start = time
+        else:
+            text_tokens.append(token)
+    if text_tokens:
+        # No closing timestamp: the segment runs to the end of the window
+        close(duration)
+    return segments
+
+
+def decode_batch(model, audios, batch_size=None, language=None, task='transcribe', temperature=TEMPERATURES,
+                 beam_size=None, best_of=None, patience=None, fp16=True):
+    """
+    Transcribes several 16 kHz mono float32 arrays with one Whisper model,
+    batching their 30-second windows through the encoder and decoder.
+
+    Args:
+        model: A loaded whisper model (whisper.load_model or a whisper_backends backend).
+        audios (list[numpy.ndarray]): The tracks.
+        batch_size (int, optional): Windows per batch. Defaults to WHISPER_BATCH_SIZE (8).
+        language (str, optional): Language code; detected per track from its first window if None.
+        task (str): 'transcribe' or 'translate'.
+        temperature (float or tuple): Temperatures tried in order for windows that fail.
+        beam_size, best_of, patience: As in whisper.DecodingOptions.
+        fp16 (bool): Half precision; only used on CUDA.
+
+    Returns:
+        list[dict]: One transcribe()-style result per track, in input order.
+    """
+    import torch
+    import whisper
+    from whisper.audio import HOP_LENGTH, N_FRAMES
+    from whisper.tokenizer import get_tokenizer
+
+    batch_size = max(1, batch_size or DEFAULT_BATCH_SIZE)
+    temperatures = (temperature,) if isinstance(temperature, (int, float)) else tuple(temperature)
+    fp16 = fp16 and model.device.type != 'cpu'
+    frames_per_second = WHISPER_SAMPLE_RATE / HOP_LENGTH
+    time_precision = N_FRAMES // model.dims.n_audio_ctx / frames_per_second
+
+    # (track, offset seconds, duration seconds, mel) of every window
+    windows = []
+    for track, audio in enumerate(audios):
+        audio = np.asarray(audio, dtype=np.float32)
+        for start, end in split_windows(audio):
+            mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio[start:end]), model.dims.n_mels)
+            windows.append((track, start / WHISPER_SAMPLE_RATE, (end - start) / WHISPER_SAMPLE_RATE, mel))
+
+    languages = [language] * len(audios)
+    if language is None and not model.is_multilingual:
+        languages = ['en'] * len(audios)
+    elif language is None:
+        # Like transcribe(): each track's language comes from its first 30 seconds
+        firsts = {}
+        for i, (track, _, _, _) in enumerate(windows):
+            firsts.setdefault(track, i)
+        tracks = sorted(firsts)
+        for n in range(0, len(tracks), batch_size):
+            chunk = tracks[n:n + batch_size]
+            mel = torch.stack([windows[firsts[t]][3] for t in chunk]).to(model.device)
+            _, probs = model.detect_language(mel)
+            for track, track_probs in zip(chunk, probs):
+                languages[track] = max(track_probs, key=track_probs.get)
+
+    segments = [[] for _ in audios]
+    # A batch shares its prompt, so windows are grouped by their track's language
+    for lang in sorted(set(languages[t] for t, _, _, _ in windows)):
+        group = [w for w in windows if languages[w[0]] == lang]
+        tokenizer = get_tokenizer(model.is_multilingual, num_languages=model.num_languages, language=lang,
+                                  task=task)
+        for n in range(0, len(group), batch_size):
+            batch = group[n:n + batch_size]
+            mel = torch.stack([w[3] for w in batch]).to(model.device)
+            results = _decode_with_fallback(model, mel, lang, task, temperatures, fp16, beam_size,
+                                            best_of, patience)
+            for (track, offset, duration, _), result in zip(batch, results):
+                if result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD:
+                    # Silence, as transcribe() skips it
+                    continue
+                segments[track] += _segments(result, tokenizer, offset, duration, time_precision,
+                                             frames_per_second)
+
+    outputs = []
+    for track, track_segments in enumerate(segments):
+        track_segments.sort(key=lambda s: s['start'])
+        for i, segment in enumerate(track_segments):
+            segment['id'] = i
+        outputs.append({
+            'text': ''.join(s['text'] for s in track_segments),
+            'segments': track_segments,
+            'language': languages[track],
+        })
+    return outputs
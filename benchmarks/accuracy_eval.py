@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Accuracy-versus-speed evaluation of transcription settings.
+
+Runs every audio file of a folder through the transcriber under a matrix of
+settings (Whisper model size, inference backend, small-to-large cascade, vocal
+separation, VAD gating, long-audio chunking), scores the output against reference lyrics with
+jiwer and measures the real-time factor (processing seconds per second of
+audio). Files are transcribed in parallel processes.
+
+Each audio file needs a reference next to it with the same name and a .txt
+extension (song.mp3 -> song.txt), or in --refs-dir.
+
+Outputs, in --out-dir:
+    summary.csv    one row per setting: WER, CER, real-time factor
+    per_file.csv   one row per file and setting, with the hypothesis and, in
+                   cascade mode, the seconds re-run with the large model
+    pareto.png     WER against real-time factor, with the Pareto front
+
+Usage:
+    python benchmarks/accuracy_eval.py eval_set/ --sizes tiny,base,small --workers 2 --max-wer 0.35
+    python benchmarks/accuracy_eval.py eval_set/ --sizes large --backends whisper,whisper-int8 \
+        --separation false --vad false --workers 1 --threads 8 --interop-threads 1
+    CASCADE_LOGPROB=-0.6 python benchmarks/accuracy_eval.py eval_set/ --sizes large --cascades none,small,base
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import audio_duration
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.m4a', '.aac', '.ogg', '.opus', '.webm')
+SETTING_KEYS = ('model_size', 'backend', 'cascade', 'separation', 'vad', 'chunked')
+
+
+def normalize(text):
+    """
+    Lowercases and strips punctuation so scores only count word differences.
+    """
+    text = re.sub(r"[^\w\s']", ' ', text.lower())
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def build_matrix(sizes, separation, vad, chunked, backends=('whisper',), cascades=(None,)):
+    """
+    Every combination of the options. VAD only applies to separated vocals,
+    so VAD without separation (identical to no VAD) is left out, and so is a
+    cascade from a model to itself.
+    """
+    matrix = []
+    for size, backend, cascade, sep, use_vad, chunk in itertools.product(sizes, backends, cascades, separation,
+                                                                         vad, chunked):
+        if use_vad and not sep:
+            continue
+        if cascade == size:
+            continue
+        matrix.append({'model_size': size, 'backend': backend, 'cascade': cascade, 'separation': sep,
+                       'vad': use_vad, 'chunked': chunk})
+    return matrix
+
+
+def find_pairs(data_dir, refs_dir=None):
+    """
+    Returns (audio path, reference text) for every audio file with a non-empty reference.
+    """
+    pairs = []
+    for name in sorted(os.listdir(data_dir)):
+        if not name.lower().endswith(AUDIO_EXTENSIONS):
+            continue
+        ref_path = os.path.join(refs_dir or data_dir, os.path.splitext(name)[0] + '.txt')
+        if not os.path.exists(ref_path):
+            print(f"Skipping {name}: no reference {ref_path}")
+            continue
+        with open(ref_path, encoding='utf-8') as f:
+            reference = f.read()
+        if not normalize(reference):
+            print(f"Skipping {name}: empty reference")
+            continue
+        pairs.append((os.path.join(data_dir, name), reference))
+    return pairs
+
+
+def _init_worker(threads, interop_threads):
+    from whisper_backends import configure_threads
+
+    configure_threads(threads, interop_threads)
+
+
+def _run_one(audio_path, setting):
+    from transcriber import get_model, transcribe_result
+
+    # Model loading is a one-off per worker, not part of the per-file cost
+    get_model(setting['model_size'], setting['backend'])
+    if setting['cascade']:
+        get_model(setting['cascade'], setting['backend'])
+    if setting['separation']:
+        from audio_separator import get_separator
+
+        get_separator()
+    start = time.perf_counter()
+    # As transcriber.transcribe_audio, keeping the result for the cascade stats
+    audio, separated = audio_path, False
+    if setting['separation']:
+        from audio_separator import separate_for_transcription
+
+        try:
+            audio, _ = separate_for_transcription(audio_path)
+            separated = True
+        except Exception as e:
+            print(f"[ERROR] Vocal separation failed, using original audio: {e}")
+    try:
+        result = transcribe_result(audio, model_size=setting['model_size'], vad=setting['vad'] and separated,
+                                   chunked=setting['chunked'], backend=setting['backend'],
+                                   cascade=setting['cascade'])
+        text, error = result['text'], None
+    except Exception as e:
+        result, text, error = {}, '', f"Error transcribing audio: {e}"
+    seconds = time.perf_counter() - start
+    escalated = result.get('cascade', {}).get('escalated_seconds')
+    return {'file': os.path.basename(audio_path), **setting, 'seconds': round(seconds, 3),
+            'escalated_seconds': escalated, 'hypothesis': text.strip(), 'error': error}
+
+
+def score(rows, references, durations):
+    """
+    Aggregates per-file results of one setting into corpus-level WER/CER and real-time factor.
+    """
+    import jiwer
+
+    ok = [r for r in rows if not r['error']]
+    if not ok:
+        return {'wer': None, 'cer': None, 'real_time_factor': None, 'escalated_ratio': None, 'files': 0,
+                'failed': len(rows)}
+    refs = [normalize(references[r['file']]) for r in ok]
+    hyps = [normalize(r['hypothesis']) for r in ok]
+    audio_seconds = sum(durations[r['file']] or 0 for r in ok)
+    escalated = [r['escalated_seconds'] for r in ok if r['escalated_seconds'] is not None]
+    return {
+        'wer': round(jiwer.wer(refs, hyps), 4),
+        'cer': round(jiwer.cer(refs, hyps), 4),
+        'real_time_factor': round(sum(r['seconds'] for r in ok) / audio_seconds, 4) if audio_seconds else None,
+        # Share of the audio the cascade re-ran with the large model
+        'escalated_ratio': round(sum(escalated) / audio_seconds, 4) if escalated and audio_seconds else None,
+        'files': len(ok),
+        'failed': len(rows) - len(ok),
+    }
+
+
+def pareto_front(summary):
+    """
+    Settings not beaten on both WER and real-time factor by another setting, fastest first.
+    """
+    points = sorted((s for s in summary if s['wer'] is not None and s['real_time_factor'] is not None),
+                    key=lambda s: (s['real_time_factor'], s['wer']))
+    front = []
+    for s in points:
+        if not front or s['wer'] < front[-1]['wer']:
+            front.append(s)
+    return front
+
+
+def plot(summary, front, path):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    import seaborn as sns
+
+    data = pd.DataFrame([s for s in summary if s['wer'] is not None and s['real_time_factor'] is not None])
+    if data.empty:
+        return None
+    data['setting'] = data.apply(
+        lambda s: ('sep' if s['separation'] else 'raw') + ('+vad' if s['vad'] else '') + ('+chunk' if s['chunked'] else ''),
+        axis=1)
+    fig, ax = plt.subplots(figsize=(9, 6))
+    data['model'] = data.apply(
+        lambda s: (f"{s['cascade']}>" if s['cascade'] else '') + s['model_size'] + ' ' + s['backend'], axis=1)
+    sns.scatterplot(data=data, x='real_time_factor', y='wer', hue='model', style='setting', s=90, ax=ax)
+    ax.plot([s['real_time_factor'] for s in front], [s['wer'] for s in front], '--', color='grey',
+            label='Pareto front')
+    ax.set_xlabel('Real-time factor (processing s / audio s, lower is faster)')
+    ax.set_ylabel('WER (lower is better)')
+    ax.set_title('Transcription accuracy vs speed')
+    ax.legend(loc='best', fontsize=8)
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    plt.close(fig)
+    return path
+
+
+def _write_csv(path, rows, columns):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _parse_flags(value):
+    return [v.strip().lower() in ('1', 'true', 'on', 'yes') for v in value.split(',') if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('data_dir', help='Folder with audio files and their .txt references')
+    parser.add_argument('--refs-dir', help='Folder with the references, if not next to the audio')
+    parser.add_argument('--sizes', default='tiny,base,small', help='Comma-separated Whisper model sizes')
+    parser.add_argument('--backends', default='whisper',
+                        help='Comma-separated inference backends, e.g. whisper,whisper-int8')
+    parser.add_argument('--cascades', default='none',
+                        help='Comma-separated fast models for cascade mode, none for no cascade, e.g. none,small')
+    parser.add_argument('--separation', default='true,false', help='Separation values to try')
+    parser.add_argument('--vad', default='false,true', help='VAD gating values to try')
+    parser.add_argument('--chunked', default='false', help='Long-audio chunking values to try')
+    parser.add_argument('--workers', type=int, default=2, help='Parallel worker processes (default: 2)')
+    parser.add_argument('--threads', type=int, default=None, help='Torch threads per worker (default: CPUs / workers)')
+    parser.add_argument('--interop-threads', type=int, default=None,
+                        help='Torch inter-op threads per worker (default: WHISPER_INTEROP_THREADS or torch\'s)')
+    parser.add_argument('--max-wer', type=float, default=None,
+                        help='Accuracy bar: report the fastest setting with WER at or below this')
+    parser.add_argument('--out-dir', default='eval_results', help='Output folder (default: eval_results)')
+    args = parser.parse_args()
+
+    pairs = find_pairs(args.data_dir, args.refs_dir)
+    if not pairs:
+        raise SystemExit("No audio files with references found.")
+    matrix = build_matrix([s for s in args.sizes.split(',') if s], _parse_flags(args.separation),
+                          _parse_flags(args.vad), _parse_flags(args.chunked),
+                          [b.strip() for b in args.backends.split(',') if b.strip()],
+                          [None if c.strip().lower() == 'none' else c.strip() for c in args.cascades.split(',') if c.strip()])
+    references = {os.path.basename(path): ref for path, ref in pairs}
+    durations = {os.path.basename(path): audio_duration(path) for path, _ in pairs}
+
+    workers = max(1, args.workers)
+    threads = args.threads or max(1, (os.cpu_count() or 1) // workers)
+    print(f"{len(pairs)} files x {len(matrix)} settings, {workers} workers ({threads} threads each)")
+
+    # Grouped by model size so each worker loads as few models as possible
+    tasks = [(path, setting) for setting in matrix for path, _ in pairs]
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(threads, args.interop_threads)) as pool:
+        futures = [pool.submit(_run_one, path, setting) for path, setting in tasks]
+        for n, future in enumerate(as_completed(futures), 1):
+            row = future.result()
+            rows.append(row)
+            status = 'FAILED' if row['error'] else f"{row['seconds']:.1f}s"
+            cascade = f" cascade={row['cascade']} (escalated {row['escalated_seconds']}s)" if row['cascade'] else ''
+            print(f"[{n}/{len(tasks)}] {row['file']} {row['model_size']} {row['backend']}{cascade} "
+                  f"sep={row['separation']} vad={row['vad']} chunked={row['chunked']}: {status}")
+
+    summary = []
+    for setting in matrix:
+        setting_rows = [r for r in rows if all(r[k] == setting[k] for k in SETTING_KEYS)]
+        summary.append({**setting, **score(setting_rows, references, durations)})
+    front = pareto_front(summary)
+    front_keys = {tuple(s[k] for k in SETTING_KEYS) for s in front}
+    for s in summary:
+        s['pareto'] = tuple(s[k] for k in SETTING_KEYS) in front_keys
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    _write_csv(os.path.join(args.out_dir, 'summary.csv'), summary,
+               [*SETTING_KEYS, 'wer', 'cer', 'real_time_factor', 'escalated_ratio', 'files', 'failed', 'pareto'])
+    rows.sort(key=lambda r: (r['file'], *(str(r[k]) for k in SETTING_KEYS)))
+    _write_csv(os.path.join(args.out_dir, 'per_file.csv'), rows,
+               ['file', *SETTING_KEYS, 'seconds', 'escalated_seconds', 'error', 'hypothesis'])
+    plot_path = plot(summary, front, os.path.join(args.out_dir, 'pareto.png'))
+
+    print("=" * 60)
+    for s in sorted(summary, key=lambda s: (s['real_time_factor'] is None, s['real_time_factor'] or 0)):
+        wer = f"{s['wer']:.3f}" if s['wer'] is not None else '-'
+        cer = f"{s['cer']:.3f}" if s['cer'] is not None else '-'
+        rtf = f"{s['real_time_factor']:.3f}" if s['real_time_factor'] is not None else '-'
+        cascade = f" cascade={s['cascade']} escalated {s['escalated_ratio'] or 0:.0%}" if s['cascade'] else ''
+        print(f"{'*' if s['pareto'] else ' '} {s['model_size']:>6} {s['backend']:<12} sep={s['separation']!s:5} vad={s['vad']!s:5} "
+              f"chunked={s['chunked']!s:5} WER {wer} CER {cer} RTF {rtf}{cascade}")
+    print("(* = on the Pareto front)")
+    if args.max_wer is not None:
+        meeting = [s for s in front if s['wer'] <= args.max_wer]
+        if meeting:
+            best = meeting[0]
+            print(f"Fastest setting with WER <= {args.max_wer}: " +
+                  ", ".join(f"{k}={best[k]}" for k in SETTING_KEYS) +
+                  f" (WER {best['wer']:.3f}, RTF {best['real_time_factor']:.3f})")
+        else:
+            print(f"No setting reaches WER <= {args.max_wer}")
+    print(f"Results saved to: {args.out_dir}/" + (f" (plot: {plot_path})" if plot_path else ""))
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Measures the per-track time saved by keeping downloads in their native codec.
+
+For each local sample file (opus/m4a/flac/... as yt-dlp would fetch them) this
+times what the old FFmpegExtractAudio step did (transcode to 192 kbps MP3)
+against the native path (stream copy into an audio container plus an ffprobe
+check), and reports both.
+
+Usage:
+    python benchmarks/download_transcode.py samples/*.opus samples/*.m4a
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_io import probe_audio
+
+
+def time_mp3(audio_path, work_dir):
+    out_path = os.path.join(work_dir, 'transcoded.mp3')
+    start = time.perf_counter()
+    subprocess.run(['ffmpeg', '-nostdin', '-y', '-i', audio_path, '-vn', '-acodec', 'libmp3lame',
+                    '-b:a', '192k', out_path], capture_output=True, check=True)
+    return time.perf_counter() - start
+
+
+def time_native(audio_path, work_dir):
+    ext = os.path.splitext(audio_path)[1]
+    out_path = os.path.join(work_dir, 'native' + ext)
+    start = time.perf_counter()
+    subprocess.run(['ffmpeg', '-nostdin', '-y', '-i', audio_path, '-vn', '-acodec', 'copy', out_path],
+                   capture_output=True, check=True)
+    if not probe_audio(out_path):
+        raise RuntimeError(f"Native copy of {audio_path} is not decodable")
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('audio_files', nargs='+', help='Local sample files in their downloaded codec')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='dl_bench_')
+    saved = []
+    try:
+        for audio_path in args.audio_files:
+            info = probe_audio(audio_path) or {}
+            mp3 = time_mp3(audio_path, work_dir)
+            native = time_native(audio_path, work_dir)
+            saved.append(mp3 - native)
+            print(f"{os.path.basename(audio_path)} ({info.get('codec')}, {info.get('duration') or 0:.0f}s): "
+                  f"mp3 {mp3:.2f}s, native {native:.2f}s, saved {mp3 - native:.2f}s")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("=" * 60)
+    print(f"Tracks: {len(saved)}")
+    print(f"Mean time saved per track: {sum(saved) / len(saved):.2f}s")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Local HTTP stand-in for the sites download_audio_from_url talks to.
+
+Serves a directory of audio files two ways:
+
+    /files/<name>         direct media link, handled by the yt-dlp fallback
+    /page/<name>          a muzon-club style page whose download button points to
+    /download?q=<name>    the file, handled by the scraper (use platform 'muzon')
+
+so the download stage can be benchmarked without the network. /download
+answers byte-range requests like a CDN, so large files take the parallel
+ranged path of download_service.
+"""
+
+import os
+import re
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+
+class _Handler(SimpleHTTPRequestHandler):
+    # yt-dlp decides a URL is direct media from its content type
+    extensions_map = {
+        **SimpleHTTPRequestHandler.extensions_map,
+        '.mp3': 'audio/mpeg',
+        '.opus': 'audio/ogg',
+        '.ogg': 'audio/ogg',
+        '.m4a': 'audio/mp4',
+        '.flac': 'audio/flac',
+        '.wav': 'audio/wav',
+    }
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith('/files/'):
+            self.path = '/' + url.path[len('/files/'):]
+            return super().do_GET()
+        if url.path.startswith('/page/'):
+            return self._send_page(unquote(url.path[len('/page/'):]))
+        if url.path == '/download':
+            name = parse_qs(url.query).get('q', [''])[0]
+            return self._send_attachment(name)
+        self.send_error(404)
+
+    def _send_page(self, name):
+        if not os.path.isfile(os.path.join(self.directory, name)):
+            return self.send_error(404)
+        title = os.path.splitext(name)[0]
+        body = (f'<html><head><title>{title}</title></head><body>'
+                f'<a class="btn-download" href="/download?q={quote(name)}">Download</a>'
+                f'</body></html>').encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_attachment(self, name):
+        path = os.path.join(self.directory, os.path.basename(name))
+        if not os.path.isfile(path):
+            return self.send_error(404)
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+            if start > end:
+                return self.send_error(416)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(path)}"')
+        self.end_headers()
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(64 * 1024, remaining))
+                if not chunk:
+                    break
+                try:
+                    self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    # A ranged client stops reading the full response after its first segment
+                    return
+                remaining -= len(chunk)
+
+
+class LocalAudioServer:
+    """
+    Serves `directory` on 127.0.0.1 in a background thread.
+
+    Usage:
+        with LocalAudioServer('corpus') as server:
+            url = server.url_for('song.opus', source='page')
+    """
+
+    def __init__(self, directory, port=0):
+        self.directory = os.path.abspath(directory)
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), partial(_Handler, directory=self.directory))
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url_for(self, filename, source='direct'):
+        """
+        URL of a served file: 'direct' (media link) or 'page' (scraped download page).
+        """
+        prefix = '/page/' if source == 'page' else '/files/'
+        return self.base_url + prefix + quote(filename)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='local-audio-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
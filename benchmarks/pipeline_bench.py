@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Offline end-to-end benchmark of process_file and batch_transcribe.
+
+Generates synthetic songs (benchmarks/synthetic.py) in several lengths and
+codecs, serves them from a local HTTP server (benchmarks/local_server.py) and
+runs them through:
+
+  - app.process_file, from a spreadsheet of local URLs (download, separation,
+    transcription and packaging, timed by the job's metrics.json)
+  - batch_transcribe.batch_transcribe, on the same files
+
+once per Whisper model size. Nothing touches the network, the repo's jobs.db
+(JOB_DB points into the work directory before app is imported) or the
+shared cache. Results are written as JSON; pass a previous result file as
+--baseline to flag stages that got slower than --threshold.
+
+Usage:
+    python benchmarks/pipeline_bench.py --sizes tiny,base --out bench.json
+    python benchmarks/pipeline_bench.py --sizes tiny --baseline bench.json --out new.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from local_server import LocalAudioServer
+from synthetic import CODECS, generate_corpus
+
+# Differences below this many seconds are noise, whatever the ratio
+MIN_REGRESSION_SECONDS = 0.5
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _summarize(report):
+    """
+    The comparable numbers of a metrics.json report.
+    """
+    return {
+        'wall_seconds': report['wall_seconds'],
+        'stage_seconds': report['stage_seconds'],
+        'audio_seconds': report['audio_seconds'],
+        'real_time_factor': report['real_time_factor'],
+        'peak_rss_bytes': report['peak_rss_bytes'],
+    }
+
+
+def _median(runs):
+    """
+    Median of every number across repeated runs.
+    """
+    stages = {name for run in runs for name in run['stage_seconds']}
+    return {
+        'wall_seconds': round(statistics.median(r['wall_seconds'] for r in runs), 3),
+        'stage_seconds': {name: round(statistics.median(r['stage_seconds'].get(name, 0.0) for r in runs), 3)
+                          for name in sorted(stages)},
+        'audio_seconds': runs[0]['audio_seconds'],
+        'real_time_factor': statistics.median(r['real_time_factor'] or 0 for r in runs) or None,
+        'peak_rss_bytes': max(r['peak_rss_bytes'] or 0 for r in runs) or None,
+        'runs': len(runs),
+    }
+
+
+def bench_process_file(songs, server, sources, model_size, work_dir):
+    import app as web
+    from job_store import JobStore
+
+    sheet = pd.DataFrame([
+        {'URL': server.url_for(os.path.basename(song['path']), source=sources[i % len(sources)]),
+         'PLATAFORMA': 'muzon' if sources[i % len(sources)] == 'page' else None}
+        for i, song in enumerate(songs)
+    ])
+    sheet_path = os.path.join(work_dir, 'bench.csv')
+    sheet.to_csv(sheet_path, index=False)
+
+    results_dir = os.path.join(work_dir, 'results')
+    os.makedirs(results_dir, exist_ok=True)
+    web.app.config.update(WHISPER_MODEL=model_size, RESULTS_FOLDER=results_dir, CACHE_ENABLED=False)
+    # A private job store, so benchmark jobs never show up in (or resume from) jobs.db
+    web.store = JobStore(os.path.join(work_dir, 'jobs.db'))
+
+    job_id = str(uuid.uuid4())
+    web.store.create_job(job_id, sheet_path)
+    web.process_file(job_id, sheet_path)
+    job = web.store.get_job(job_id)
+    web.store.close()
+    if job['error']:
+        raise RuntimeError(f"process_file failed: {job['error']}")
+    with open(os.path.join(results_dir, job_id, 'metrics.json'), encoding='utf-8') as f:
+        return _summarize(json.load(f))
+
+
+def bench_batch(songs, model_size, work_dir):
+    from batch_transcribe import batch_transcribe
+
+    uploads_dir = os.path.join(work_dir, 'uploads')
+    results_dir = os.path.join(work_dir, 'batch_results')
+    os.makedirs(uploads_dir, exist_ok=True)
+    for song in songs:
+        shutil.copy(song['path'], uploads_dir)
+    batch_transcribe(uploads_dir, results_dir, cache_dir=None, model_size=model_size)
+    with open(os.path.join(results_dir, 'metrics.json'), encoding='utf-8') as f:
+        return _summarize(json.load(f))
+
+
+def compare(baseline, current, threshold):
+    """
+    Lists every timing that got slower than the baseline by more than `threshold` (a ratio).
+
+    Returns:
+        list[str]: One line per regression.
+    """
+    regressions = []
+    for key, result in current['results'].items():
+        base = baseline.get('results', {}).get(key)
+        if not base:
+            continue
+        pairs = [('wall', base['wall_seconds'], result['wall_seconds'])]
+        pairs += [(stage, base['stage_seconds'].get(stage), seconds)
+                  for stage, seconds in result['stage_seconds'].items()]
+        for name, old, new in pairs:
+            if not old:
+                continue
+            if new > old * (1 + threshold) and new - old > MIN_REGRESSION_SECONDS:
+                regressions.append(f"{key} {name}: {old:.2f}s -> {new:.2f}s (+{(new / old - 1):.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='tiny', help='Comma-separated Whisper model sizes (default: tiny)')
+    parser.add_argument('--lengths', default='30,180', help='Comma-separated song lengths in seconds')
+    parser.add_argument('--codecs', default='mp3,opus,m4a',
+                        help=f"Comma-separated codecs, from {', '.join(CODECS)}")
+    parser.add_argument('--sources', default='direct,page',
+                        help="URL kinds assigned round-robin: 'direct' (yt-dlp) and/or 'page' (scraper)")
+    parser.add_argument('--targets', default='process_file,batch', help='What to benchmark')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per target; the median is reported')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic songs')
+    parser.add_argument('--corpus-dir', default=None,
+                        help='Keep the generated songs here and reuse them across runs (default: temporary)')
+    parser.add_argument('--out', default='benchmark_results.json', help='Where to write the results')
+    parser.add_argument('--baseline', help='Previous results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='Slowdown ratio flagged as a regression (default: 0.15)')
+    args = parser.parse_args()
+
+    sizes = [s for s in args.sizes.split(',') if s]
+    lengths = [float(s) for s in args.lengths.split(',') if s]
+    codecs = [c for c in args.codecs.split(',') if c]
+    sources = [s for s in args.sources.split(',') if s]
+    targets = [t for t in args.targets.split(',') if t]
+
+    work_root = tempfile.mkdtemp(prefix='pipeline_bench_')
+    # Read when app is first imported, so its module-level store never opens the repo's jobs.db
+    os.environ['JOB_DB'] = os.path.join(work_root, 'jobs.db')
+    corpus_dir = args.corpus_dir or os.path.join(work_root, 'corpus')
+    try:
+        print(f"Generating {len(lengths) * len(codecs)} synthetic songs in {corpus_dir}...")
+        songs = generate_corpus(corpus_dir, lengths, codecs, seed=args.seed)
+
+        results = {}
+        with LocalAudioServer(corpus_dir) as server:
+            for size in sizes:
+                for target in targets:
+                    runs = []
+                    for n in range(args.repeat):
+                        work_dir = os.path.join(work_root, f"{target}_{size}_{n}")
+                        os.makedirs(work_dir)
+                        print(f"[{target} / {size}] run {n + 1}/{args.repeat}")
+                        if target == 'process_file':
+                            runs.append(bench_process_file(songs, server, sources, size, work_dir))
+                        elif target == 'batch':
+                            runs.append(bench_batch(songs, size, work_dir))
+                        else:
+                            raise SystemExit(f"Unknown target: {target}")
+                        shutil.rmtree(work_dir, ignore_errors=True)
+                    results[f"{target}/{size}"] = _median(runs)
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+    output = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'songs': [{k: s[k] for k in ('name', 'seconds', 'codec')} for s in songs],
+            'sources': sources,
+        },
+        'results': results,
+    }
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=2)
+
+    print("=" * 60)
+    for key, result in results.items():
+        stages = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in result['stage_seconds'].items())
+        rtf = f", real-time factor {result['real_time_factor']:.2f}" if result['real_time_factor'] else ""
+        print(f"{key}: {result['wall_seconds']:.1f}s wall ({stages}{rtf})")
+    print(f"Results saved to: {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, output, args.threshold)
+        if regressions:
+            print(f"REGRESSIONS (> {args.threshold:.0%} slower than {args.baseline}):")
+            for line in regressions:
+                print(f"  {line}")
+            print("=" * 60)
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
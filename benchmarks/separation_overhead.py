@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Compares per-track separation time of the demucs CLI against the in-process engine.
+
+The CLI pays interpreter start-up, torch import and model load for every track,
+while the in-process engine pays the model load once. The first in-process run
+is reported separately so the steady-state cost is visible.
+
+Usage:
+    python benchmarks/separation_overhead.py song1.mp3 song2.mp3 ...
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_separator import separate_audio
+
+
+def time_engine(engine, audio_files, work_dir):
+    timings = []
+    for i, audio_path in enumerate(audio_files):
+        out_dir = os.path.join(work_dir, f"{engine}_{i}")
+        start = time.perf_counter()
+        vocals = separate_audio(audio_path, output_base_dir=out_dir, engine=engine)
+        elapsed = time.perf_counter() - start
+        timings.append(elapsed)
+        status = "ok" if vocals else "FAILED"
+        print(f"  {engine:>3} [{i + 1}/{len(audio_files)}] {os.path.basename(audio_path)}: {elapsed:.2f}s ({status})")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('audio_files', nargs='+', help='Local audio files to separate')
+    parser.add_argument('--keep', action='store_true', help='Keep separated stems in the work directory')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='sep_bench_')
+    try:
+        print("CLI engine:")
+        cli = time_engine('cli', args.audio_files, work_dir)
+        print("In-process engine:")
+        api = time_engine('api', args.audio_files, work_dir)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    n = len(args.audio_files)
+    cli_mean = sum(cli) / n
+    api_steady = api[1:] or api
+    api_mean = sum(api_steady) / len(api_steady)
+
+    print("=" * 60)
+    print(f"CLI mean per track:               {cli_mean:.2f}s")
+    print(f"In-process first track (loads):   {api[0]:.2f}s")
+    print(f"In-process mean per track:        {api_mean:.2f}s")
+    print(f"Per-track overhead saved:         {cli_mean - api_mean:.2f}s")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Startup time of the web server (or the worker) with an import-time profile.
+
+Imports the module in a fresh interpreter under `python -X importtime` and
+reports the import wall time, the time until the first request to / is
+answered (app only), and the slowest imports: the modules imported directly
+by the module and the heaviest packages overall. The warm-up does not run,
+so this is the time before the server can answer.
+
+Usage:
+    python benchmarks/startup_time.py
+    python benchmarks/startup_time.py --module worker --top 20 --repeat 3 --out startup.json
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints the timings as the last line of stdout
+_CHILD = """
+import json, time
+start = time.perf_counter()
+import {module} as target
+imported = time.perf_counter()
+first_request = None
+if hasattr(target, 'app') and hasattr(target.app, 'test_client'):
+    target.app.test_client().get('/')
+    first_request = time.perf_counter() - start
+print(json.dumps({{'import_seconds': imported - start, 'first_request_seconds': first_request}}))
+"""
+
+_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def parse_importtime(stderr):
+    """
+    Parses -X importtime output.
+
+    Returns:
+        list[dict]: name, depth, self and cumulative microseconds of every import.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append({'name': name, 'depth': len(indent) // 2, 'self_us': int(self_us),
+                            'cumulative_us': int(cumulative_us)})
+    return imports
+
+
+def profile(module):
+    env = dict(os.environ, WARMUP='0')
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', _CHILD.format(module=module)],
+                          cwd=REPO_DIR, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{proc.stderr[-2000:]}")
+    timings = json.loads(proc.stdout.strip().splitlines()[-1])
+    return timings, parse_importtime(proc.stderr)
+
+
+def summarize(imports, top):
+    """
+    The slowest direct imports, and the slowest packages at any depth (by top-level name).
+    """
+    direct = sorted((i for i in imports if i['depth'] == 0), key=lambda i: i['cumulative_us'], reverse=True)
+    packages = {}
+    for i in imports:
+        root = i['name'].split('.')[0]
+        packages[root] = max(packages.get(root, 0), i['cumulative_us'])
+    heaviest = sorted(packages.items(), key=lambda p: p[1], reverse=True)
+    return {
+        'direct': [{'name': i['name'], 'seconds': round(i['cumulative_us'] / 1e6, 3)} for i in direct[:top]],
+        'packages': [{'name': name, 'seconds': round(us / 1e6, 3)} for name, us in heaviest[:top]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='app', help='Module to import (default: app)')
+    parser.add_argument('--top', type=int, default=15, help='Imports to list (default: 15)')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs; the median is reported')
+    parser.add_argument('--out', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    runs = [profile(args.module) for _ in range(max(1, args.repeat))]
+    import_seconds = statistics.median(t['import_seconds'] for t, _ in runs)
+    first = [t['first_request_seconds'] for t, _ in runs if t['first_request_seconds'] is not None]
+    # The import profile of the median run
+    _, imports = sorted(runs, key=lambda r: r[0]['import_seconds'])[len(runs) // 2]
+    result = {
+        'module': args.module,
+        'runs': len(runs),
+        'import_seconds': round(import_seconds, 3),
+        'first_request_seconds': round(statistics.median(first), 3) if first else None,
+        **summarize(imports, args.top),
+    }
+
+    print("=" * 60)
+    print(f"import {args.module}: {result['import_seconds']:.2f}s" +
+          (f", first response to /: {result['first_request_seconds']:.2f}s" if first else ""))
+    print("Slowest direct imports:")
+    for i in result['direct']:
+        print(f"  {i['seconds']:7.3f}s  {i['name']}")
+    print("Heaviest packages:")
+    for i in result['packages']:
+        print(f"  {i['seconds']:7.3f}s  {i['name']}")
+    print("=" * 60)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Deterministic synthetic songs for offline benchmarks.
+
+Each song is a chord backing of sine tones plus a speech-like voice: a
+harmonic source at a singing pitch with vibrato, shaped by vowel formants
+that change every syllable, sung in phrases with instrumental gaps. It is
+not intelligible, but it has the structure the pipeline cares about
+(a vocal line Demucs can split off, voiced/unvoiced regions for the VAD,
+realistic length and codec), and the same seed always gives the same file.
+"""
+
+import os
+import subprocess
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 22050
+
+# (ffmpeg encoder arguments, file extension)
+CODECS = {
+    'mp3': (['-acodec', 'libmp3lame', '-b:a', '192k'], '.mp3'),
+    'opus': (['-acodec', 'libopus', '-b:a', '128k'], '.opus'),
+    'm4a': (['-acodec', 'aac', '-b:a', '192k'], '.m4a'),
+    'flac': (['-acodec', 'flac'], '.flac'),
+    'wav': (['-acodec', 'pcm_s16le'], '.wav'),
+}
+
+# Backing chords (Hz), two seconds each
+CHORDS = [(220.0, 277.18, 329.63), (196.0, 246.94, 293.66), (174.61, 220.0, 261.63), (196.0, 246.94, 311.13)]
+# Rough (F1, F2) formants of a few vowels
+VOWELS = [(800, 1200), (400, 2300), (300, 800), (500, 1000), (350, 2000)]
+
+
+def _syllable_plan(seconds, rng):
+    """
+    Returns (start, end, vowel index) of every sung syllable: phrases of 6-12
+    syllables separated by 0.5-2.5 s gaps, after a 4 s instrumental intro.
+    """
+    plan = []
+    t = min(4.0, seconds / 4)
+    while t < seconds - 1.0:
+        for _ in range(rng.integers(6, 13)):
+            length = rng.uniform(0.18, 0.35)
+            if t + length >= seconds:
+                break
+            plan.append((t, t + length, int(rng.integers(len(VOWELS)))))
+            t += length + rng.uniform(0.02, 0.08)
+        t += rng.uniform(0.5, 2.5)
+    return plan
+
+
+def synth_song(seconds, seed=0, sr=SAMPLE_RATE):
+    """
+    Returns a mono float32 signal in [-1, 1].
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sr)
+    # float64: the phase accumulates over millions of samples
+    t = np.arange(n) / sr
+
+    backing = np.zeros(n, dtype=np.float32)
+    chord_samples = 2 * sr
+    for i, start in enumerate(range(0, n, chord_samples)):
+        seg = slice(start, min(start + chord_samples, n))
+        for freq in CHORDS[(i + seed) % len(CHORDS)]:
+            backing[seg] += np.sin(2 * np.pi * freq * t[seg])
+    backing *= 0.08
+
+    # Per-sample formants and loudness envelope from the syllable plan
+    f1 = np.zeros(n, dtype=np.float32)
+    f2 = np.zeros(n, dtype=np.float32)
+    envelope = np.zeros(n, dtype=np.float32)
+    ramp = int(0.01 * sr)
+    for start, end, vowel in _syllable_plan(seconds, rng):
+        a, b = int(start * sr), int(end * sr)
+        f1[a:b], f2[a:b] = VOWELS[vowel]
+        envelope[a:b] = 1.0
+        envelope[a:a + ramp] = np.linspace(0, 1, len(envelope[a:a + ramp]), dtype=np.float32)
+        envelope[b - ramp:b] = np.linspace(1, 0, len(envelope[b - ramp:b]), dtype=np.float32)
+
+    base_pitch = 140 + (40 * seed) % 80
+    f0 = base_pitch * (1 + 0.02 * np.sin(2 * np.pi * 5 * t))
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    voice = np.zeros(n, dtype=np.float32)
+    for k in range(1, 25):
+        harmonic = k * f0
+        amp = np.exp(-((harmonic - f1) / 150) ** 2) + 0.5 * np.exp(-((harmonic - f2) / 200) ** 2)
+        voice += (amp / k ** 0.5 * np.sin(k * phase)).astype(np.float32)
+    voice *= envelope
+    peak = np.abs(voice).max()
+    if peak > 0:
+        voice *= 0.5 / peak
+
+    # A little noise so silent parts are not digital silence
+    mix = backing + voice + rng.normal(0, 0.002, n).astype(np.float32)
+    return np.clip(mix, -1, 1)
+
+
+def write_wav(path, signal, sr=SAMPLE_RATE):
+    pcm = (signal * 32767).astype('<i2')
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes(pcm.tobytes())
+
+
+def generate_song(out_dir, name, seconds, codec='mp3', seed=0):
+    """
+    Writes one synthetic song encoded with `codec` (see CODECS) and returns its path.
+    Existing files are reused, since the same arguments always give the same audio.
+    """
+    encoder_args, ext = CODECS[codec]
+    path = os.path.join(out_dir, name + ext)
+    if os.path.exists(path):
+        return path
+    os.makedirs(out_dir, exist_ok=True)
+    wav_path = os.path.join(out_dir, name + '.src.wav')
+    write_wav(wav_path, synth_song(seconds, seed=seed))
+    try:
+        subprocess.run(['ffmpeg', '-nostdin', '-y', '-i', wav_path, '-ar', '44100', '-ac', '2', *encoder_args, path],
+                       capture_output=True, check=True)
+    finally:
+        os.remove(wav_path)
+    return path
+
+
+def generate_corpus(out_dir, lengths, codecs, seed=0):
+    """
+    Generates one song per (length, codec) pair.
+
+    Returns:
+        list[dict]: name, path, seconds and codec of every song.
+    """
+    songs = []
+    for i, seconds in enumerate(lengths):
+        for j, codec in enumerate(codecs):
+            name = f"synthetic_{int(seconds)}s_{codec}"
+            path = generate_song(out_dir, name, seconds, codec, seed=seed + i * len(codecs) + j)
+            songs.append({'name': name, 'path': path, 'seconds': seconds, 'codec': codec})
+    return songs
@@ -0,0 +1,175 @@
+"""
+Small-to-large model cascade.
+
+Many tracks come out of a fast Whisper model (e.g. 'small') as well as out of
+'large', at a fraction of the cost. In cascade mode a track is transcribed with
+the fast model first and every segment is scored with Whisper's own confidence
+signals:
+- average log-probability of its tokens (below CASCADE_LOGPROB),
+- compression ratio of its text, high for repetition loops (above CASCADE_COMPRESSION),
+- no-speech probability, high for text over what looks like silence (above CASCADE_NO_SPEECH).
+Only the stretches of low-confidence segments are transcribed again with the
+large model, and the large model's segments replace the fast ones there. When more than CASCADE_TRACK_RATIO of a track's speech
+is low-confidence the whole track is re-run instead.
+
+Escalation always runs in this process with the model manager's copy of the
+large model, also for tracks whose fast pass went through the chunked
+long-audio mode, so the long-audio pools never hold a second model size. It
+decodes like the fast pass did: with transcribe(), unless the caller batches
+tracks (transcriber.transcribe_batch), in which case the stretches of all
+tracks share one batched_whisper batch. A whole track is always re-run with
+transcribe().
+
+The result gets a 'cascade' entry with the seconds escalated, so the thresholds
+can be tuned against benchmarks/accuracy_eval.py.
+"""
+
+import logging
+import os
+
+from audio_io import WHISPER_SAMPLE_RATE
+
+# Stricter than transcribe()'s own fallback thresholds (-1.0, 2.4, 0.6): segments
+# reaching those were already re-decoded by the fast model and still came out poor
+LOGPROB_THRESHOLD = float(os.environ.get('CASCADE_LOGPROB', -0.7))
+COMPRESSION_RATIO_THRESHOLD = float(os.environ.get('CASCADE_COMPRESSION', 2.2))
+NO_SPEECH_THRESHOLD = float(os.environ.get('CASCADE_NO_SPEECH', 0.5))
+# Share of a track's speech above which the whole track goes to the large model
+TRACK_RATIO = float(os.environ.get('CASCADE_TRACK_RATIO', 0.5))
+
+# Low-confidence segments closer than this are re-run as one stretch
+MERGE_SECONDS = 2.0
+# Audio decoded on each side of a stretch, so its first and last words have context
+PAD_SECONDS = 1.0
+
+
+def low_confidence(segment):
+    """
+    Whether the large model should redo a segment. Segments without scores
+    (backends that do not report them) are trusted.
+    """
+    if segment.get('avg_logprob', 0.0) < LOGPROB_THRESHOLD:
+        return True
+    if segment.get('compression_ratio', 0.0) > COMPRESSION_RATIO_THRESHOLD:
+        return True
+    return segment.get('no_speech_prob', 0.0) > NO_SPEECH_THRESHOLD
+
+
+def low_confidence_regions(segments):
+    """
+    Merges the spans of low-confidence segments into [start, end] stretches in seconds.
+    """
+    regions = []
+    for segment in sorted(segments, key=lambda s: s['start']):
+        if not low_confidence(segment):
+            continue
+        if regions and segment['start'] - regions[-1][1] <= MERGE_SECONDS:
+            regions[-1][1] = max(regions[-1][1], segment['end'])
+        else:
+            regions.append([segment['start'], segment['end']])
+    return regions
+
+
+def _inside(segment, start, end, shift=0.0):
+    middle = (segment['start'] + segment['end']) / 2 + shift
+    return start <= middle <= end
+
+
+def escalate(results, audios, model_size='large', fast_model=None, vad=False, backend=None, batched=False,
+             batch_size=None, **decode_options):
+    """
+    Re-transcribes the low-confidence parts of fast-model results with model_size.
+
+    Args:
+        results (list[dict]): Fast-model results, one per track. Updated in place.
+        audios (list[numpy.ndarray]): The 16 kHz tracks the results come from.
+        model_size (str): The model low-confidence parts are escalated to.
+        fast_model (str, optional): The model that produced the results, for the stats.
+        vad (bool or list[bool]): VAD gating per track, applied when a whole track is re-run.
+        batched (bool): Decode the stretches together with batched_whisper instead of
+                        one by one with transcribe().
+        backend, batch_size, **decode_options: As in transcriber.transcribe_batch.
+
+    Returns:
+        list[dict]: The results, each with a 'cascade' entry: audio and escalated
+                    seconds, number of low-confidence segments and whether the whole
+                    track was re-run.
+    """
+    from transcriber import transcribe_batch, transcribe_result
+
+    vads = list(vad) if isinstance(vad, (list, tuple)) else [vad] * len(results)
+    # (track, start, end, whole track) of every escalation, grouped by the language
+    # forced on the large model: short stretches are too short to detect it reliably
+    jobs = {}
+    for track, (result, audio) in enumerate(zip(results, audios)):
+        segments = result['segments']
+        regions = low_confidence_regions(segments)
+        speech_seconds = sum(s['end'] - s['start'] for s in segments)
+        escalated_seconds = sum(end - start for start, end in regions)
+        whole = bool(regions) and escalated_seconds > TRACK_RATIO * speech_seconds
+        audio_seconds = len(audio) / WHISPER_SAMPLE_RATE
+        result['cascade'] = {
+            'fast_model': fast_model,
+            'model': model_size,
+            'audio_seconds': round(audio_seconds, 2),
+            'escalated_seconds': round(audio_seconds if whole else escalated_seconds, 2),
+            'segments': len(segments),
+            'low_confidence_segments': sum(1 for s in segments if low_confidence(s)),
+            'whole_track': whole,
+        }
+        if whole:
+            jobs.setdefault(decode_options.get('language'), []).append((track, 0.0, audio_seconds, True))
+        else:
+            language = decode_options.get('language') or result.get('language')
+            for start, end in regions:
+                jobs.setdefault(language, []).append((track, start, end, False))
+
+    for language, group in jobs.items():
+        slices = []
+        for track, start, end, whole in group:
+            audio = audios[track]
+            if whole:
+                slices.append(audio)
+            else:
+                first = max(int((start - PAD_SECONDS) * WHISPER_SAMPLE_RATE), 0)
+                last = min(int((end + PAD_SECONDS) * WHISPER_SAMPLE_RATE), len(audio))
+                slices.append(audio[first:last])
+        options = dict(decode_options, language=language)
+        outputs = [None] * len(group)
+        stretches = [n for n, (_, _, _, whole) in enumerate(group) if batched and not whole]
+        if stretches:
+            batch = transcribe_batch([slices[n] for n in stretches], model_size=model_size, backend=backend,
+                                     batch_size=batch_size, **options)
+            for n, output in zip(stretches, batch):
+                outputs[n] = output
+        for n, (track, _, _, whole) in enumerate(group):
+            if outputs[n] is None:
+                outputs[n] = transcribe_result(slices[n], model_size=model_size, vad=vads[track] and whole,
+                                               backend=backend, **options)
+        for (track, start, end, whole), output in zip(group, outputs):
+            result = results[track]
+            if whole:
+                if 'vad' in result:
+                    output.setdefault('vad', result['vad'])
+                output['cascade'] = result['cascade']
+                results[track] = output
+                continue
+            offset = max(start - PAD_SECONDS, 0.0)
+            kept = [s for s in result['segments'] if not _inside(s, start, end)]
+            for segment in output['segments']:
+                if _inside(segment, start, end, shift=offset):
+                    segment['start'] = round(segment['start'] + offset, 3)
+                    segment['end'] = round(segment['end'] + offset, 3)
+                    kept.append(segment)
+            result['segments'] = kept
+
+    for result in results:
+        stats = result['cascade']
+        if not stats['whole_track']:
+            result['segments'].sort(key=lambda s: s['start'])
+            for i, segment in enumerate(result['segments']):
+                segment['id'] = i
+            result['text'] = ''.join(s['text'] for s in result['segments'])
+        logging.info(f"Cascade: {stats['escalated_seconds']:.0f}s of {stats['audio_seconds']:.0f}s "
+                     f"re-transcribed with {model_size}" + (" (whole track)" if stats['whole_track'] else ""))
+    return results
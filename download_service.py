@@ -0,0 +1,250 @@
+"""
+Shared HTTP and yt-dlp machinery behind downloader.py.
+
+- One requests.Session per host with a keep-alive connection pool, so repeated
+  downloads from the same site reuse their TCP/TLS connections.
+- At most DOWNLOAD_HOST_LIMIT requests per host at a time, so many rows can
+  download at once (DOWNLOAD_WORKERS) without getting a single site to throttle us.
+- Streamed downloads in DOWNLOAD_CHUNK_KB chunks. Files of DOWNLOAD_SEGMENT_MIN_MB
+  or more from servers that accept byte ranges are fetched as up to
+  DOWNLOAD_SEGMENTS parallel ranges, using only host slots that are free.
+- YoutubeDL instances reused per platform and output format: extractors keep
+  their state (cookies, API client ids) from one URL to the next.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Global service instance
+_service = None
+_service_lock = threading.Lock()
+
+
+class DownloadService:
+    """
+    Pooled sessions, per-host limits and reusable YoutubeDL instances.
+
+    Usage:
+        service = get_service()
+        page = service.get(url, headers=headers)
+        path = service.download(file_url, output_dir, headers=headers, filename_for=lambda r: 'song.mp3')
+        with service.youtube_dl(url, output_dir, platform='soundcloud') as ydl:
+            info = ydl.extract_info(url, download=True)
+    """
+
+    def __init__(self, host_limit=4, chunk_size=1024 * 1024, segments=4, segment_min_bytes=8 * 1024 ** 2,
+                 timeout=120):
+        self.host_limit = max(1, host_limit)
+        self.chunk_size = chunk_size
+        self.segments = max(1, segments)
+        self.segment_min_bytes = segment_min_bytes
+        self.timeout = timeout
+        self._sessions = {}
+        self._slots = {}
+        self._idle_ydl = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def host(url):
+        return urlparse(url).netloc.lower()
+
+    def session(self, url):
+        """
+        Returns the keep-alive session of url's host.
+        """
+        host = self.host(url)
+        with self._lock:
+            if host not in self._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.host_limit)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+            return self._sessions[host]
+
+    def _semaphore(self, url):
+        host = self.host(url)
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = threading.BoundedSemaphore(self.host_limit)
+            return self._slots[host]
+
+    @contextmanager
+    def host_slot(self, url):
+        """
+        Holds one of the host's DOWNLOAD_HOST_LIMIT request slots.
+        """
+        slots = self._semaphore(url)
+        slots.acquire()
+        try:
+            yield
+        finally:
+            slots.release()
+
+    def get(self, url, **kwargs):
+        """
+        Non-streamed GET (e.g. an HTML page) through the host's session.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        with self.host_slot(url):
+            return self.session(url).get(url, **kwargs)
+
+    def download(self, url, output_dir, headers=None, filename_for=None):
+        """
+        Downloads url into output_dir. The file is written as <name>.part and
+        renamed when complete, so an interrupted download never looks finished.
+
+        Args:
+            url (str): File URL.
+            output_dir (str): Destination folder.
+            headers (dict, optional): Request headers.
+            filename_for (callable, optional): Gets the response and returns the file
+                                               name; defaults to the last part of the URL.
+
+        Returns:
+            str: Path of the downloaded file.
+
+        Raises:
+            requests.HTTPError: If the server does not answer 200.
+        """
+        headers = dict(headers or {})
+        slots = self._semaphore(url)
+        session = self.session(url)
+        with self.host_slot(url):
+            with session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                if response.status_code != 200:
+                    raise requests.HTTPError(f"Download failed with status: {response.status_code}", response=response)
+                name = filename_for(response) if filename_for else os.path.basename(urlparse(url).path)
+                save_path = os.path.join(output_dir, name)
+                part_path = save_path + '.part'
+                size = int(response.headers.get('Content-Length') or 0)
+
+                extra = 0
+                if response.headers.get('Accept-Ranges', '').lower() == 'bytes' and size >= self.segment_min_bytes:
+                    # Only slots nobody is waiting for, so ranges never exceed the host limit
+                    while extra < self.segments - 1 and slots.acquire(blocking=False):
+                        extra += 1
+                try:
+                    if extra:
+                        try:
+                            self._download_ranges(session, url, headers, part_path, size, extra + 1, response)
+                        except RangeNotSupported:
+                            # Retry as a single stream below
+                            extra = self._release(slots, extra)
+                            response = session.get(url, headers=headers, stream=True, timeout=self.timeout)
+                            response.raise_for_status()
+                    if not extra:
+                        with open(part_path, 'wb') as f:
+                            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                                f.write(chunk)
+                        response.close()
+                except BaseException:
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                    raise
+                finally:
+                    self._release(slots, extra)
+        os.replace(part_path, save_path)
+        return save_path
+
+    @staticmethod
+    def _release(slots, count):
+        for _ in range(count):
+            slots.release()
+        return 0
+
+    def _download_ranges(self, session, url, headers, path, size, parts, first_response):
+        """
+        Fetches the file as `parts` byte ranges in parallel, each written at its
+        offset. The first range is read from the response that is already open.
+        """
+        with open(path, 'wb') as f:
+            f.truncate(size)
+        step = -(-size // parts)
+        ranges = [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+        def write(response, start, end):
+            with open(path, 'r+b') as f:
+                f.seek(start)
+                remaining = end - start + 1
+                for chunk in response.iter_content(chunk_size=min(self.chunk_size, remaining)):
+                    f.write(chunk[:remaining])
+                    remaining -= len(chunk)
+                    if remaining <= 0:
+                        return
+            raise IOError(f"Incomplete range {start}-{end} of {url}")
+
+        def fetch(byte_range):
+            start, end = byte_range
+            range_headers = dict(headers, Range=f"bytes={start}-{end}")
+            with session.get(url, headers=range_headers, stream=True, timeout=self.timeout) as response:
+                if response.status_code != 206:
+                    raise RangeNotSupported(f"Range request answered {response.status_code}")
+                write(response, start, end)
+
+        with ThreadPoolExecutor(max_workers=len(ranges) - 1, thread_name_prefix='range') as pool:
+            futures = [pool.submit(fetch, byte_range) for byte_range in ranges[1:]]
+            write(first_response, *ranges[0])
+            first_response.close()
+            for future in futures:
+                # Re-raises the first failed range
+                future.result()
+
+    @contextmanager
+    def youtube_dl(self, url, output_dir, audio_format=None, platform=None):
+        """
+        Lends an idle YoutubeDL for this platform and output format, or a new one,
+        pointed at output_dir, while holding a slot of url's host.
+        """
+        from downloader import build_ydl_opts
+        import yt_dlp
+
+        key = (platform or self.host(url), audio_format)
+        with self._lock:
+            idle = self._idle_ydl.setdefault(key, [])
+            ydl = idle.pop() if idle else None
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(build_ydl_opts(output_dir, audio_format))
+        ydl.params['paths'] = {'home': output_dir}
+        try:
+            with self.host_slot(url):
+                yield ydl
+        finally:
+            with self._lock:
+                self._idle_ydl[key].append(ydl)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            for idle in self._idle_ydl.values():
+                for ydl in idle:
+                    ydl.close()
+            self._sessions.clear()
+            self._idle_ydl.clear()
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+def get_service():
+    """
+    Returns the process-wide DownloadService, configured from the environment on first use.
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = DownloadService(
+                host_limit=int(os.environ.get('DOWNLOAD_HOST_LIMIT', 4)),
+                chunk_size=int(os.environ.get('DOWNLOAD_CHUNK_KB', 1024)) * 1024,
+                segments=int(os.environ.get('DOWNLOAD_SEGMENTS', 4)),
+                segment_min_bytes=int(float(os.environ.get('DOWNLOAD_SEGMENT_MIN_MB', 8)) * 1024 ** 2),
+            )
+        return _service
@@ -1,11 +1,70 @@
 import os
 import re
-import requests
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, unquote
-import yt_dlp
+from audio_io import probe_audio
+from download_service import get_service
 
-def download_audio_from_url(url, output_dir, platform=None):
+
+def build_ydl_opts(output_dir, audio_format=None):
+    """
+    Builds yt-dlp options for an audio download.
+
+    Args:
+        output_dir (str): The directory to save the file. It is set through 'paths' so a
+                          pooled YoutubeDL can be pointed at another folder per download.
+        audio_format (str, optional): Codec to transcode to (e.g. 'mp3'). By default the
+                                      original codec (opus/m4a/flac...) is kept and the audio
+                                      stream is only extracted from its container, without re-encoding.
+    """
+    return {
+        'format': 'bestaudio/best',
+        'paths': {'home': output_dir},
+        'outtmpl': '%(title)s.%(ext)s',
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            # 'best' copies the stream as-is instead of transcoding
+            'preferredcodec': audio_format or 'best',
+            'preferredquality': '192',
+        }],
+        'quiet': True,
+        'no_warnings': True,
+    }
+
+
+def resolve_download_path(ydl, info):
+    """
+    Returns the final path of a yt-dlp download after post-processing, or None.
+    """
+    for download in info.get('requested_downloads') or []:
+        filepath = download.get('filepath')
+        if filepath and os.path.exists(filepath):
+            return filepath
+
+    # Older yt-dlp versions: guess from the template and the usual extensions
+    filename = ydl.prepare_filename(info)
+    base, _ = os.path.splitext(filename)
+    for candidate in [filename] + [base + ext for ext in ('.mp3', '.opus', '.m4a', '.flac', '.ogg', '.wav')]:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def verify_audio(audio_path):
+    """
+    Probes a downloaded file and returns its path if it holds decodable audio, else None.
+    """
+    if not audio_path:
+        return None
+    info = probe_audio(audio_path)
+    if not info:
+        print(f"Downloaded file has no decodable audio: {audio_path}")
+        return None
+    print(f"Audio probe: {os.path.basename(audio_path)} ({info['codec']}, {info['sample_rate']} Hz)")
+    return audio_path
+
+
+def download_audio_from_url(url, output_dir, platform=None, audio_format=None):
     """
     Downloads audio from a given URL.
     Attempts to support muzon-club specifically, or falls back to generic extraction.
@@ -15,6 +74,8 @@ def download_audio_from_url(url, output_dir, platform=None):
         output_dir (str): The directory to save the file.
         platform (str, optional): The platform name (e.g., 'soundcloud', 'muzon'). 
                                   If provided, prioritizes that specific downloader.
+        audio_format (str, optional): Transcode to this codec (e.g. 'mp3'). By default the
+                                      original codec is kept.
     """
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -30,19 +91,22 @@ def download_audio_from_url(url, output_dir, platform=None):
     # Explicit SoundCloud selection
     if (platform and 'soundcloud' in platform) or 'soundcloud.com' in url:
         from soundcloud_downloader import download_soundcloud
-        return download_soundcloud(url, output_dir)
+        return download_soundcloud(url, output_dir, audio_format=audio_format)
         
     # Explicit Archive.org selection
     if (platform and 'archive' in platform) or 'archive.org' in url:
         from archive_downloader import download_archive
-        return download_archive(url, output_dir)
+        return download_archive(url, output_dir, audio_format=audio_format)
+
 
+    # Pooled keep-alive sessions, per-host limits and reused YoutubeDL instances
+    service = get_service()
 
     # Muzon-Club detection (Explicit or URL-based)
     if (platform and 'muzon' in platform) or 'muzon-club.com' in url:
         print(f"Detected muzon-club URL, using custom scraper")
         try:
-            response = requests.get(url, headers=headers, timeout=30)
+            response = service.get(url, headers=headers, timeout=30)
             if response.status_code == 200:
                 soup = BeautifulSoup(response.content, 'html.parser')
                 
@@ -78,11 +142,7 @@ def download_audio_from_url(url, output_dir, platform=None):
                     if not download_link.startswith('http'):
                         download_link = urljoin(url, download_link)
                     
-                    # Download the file
-                    print(f"Downloading from CDN...")
-                    mp3_response = requests.get(download_link, headers=headers, stream=True, timeout=120)
-                    
-                    if mp3_response.status_code == 200:
+                    def filename_for(mp3_response):
                         # Try to get filename from Content-Disposition header
                         cd = mp3_response.headers.get('Content-Disposition', '')
                         filename = None
@@ -90,7 +150,7 @@ def download_audio_from_url(url, output_dir, platform=None):
                             filename = re.findall(r'filename[^;=\n]*=["\']?([^"\'\n]*)', cd)
                             if filename:
                                 filename = unquote(filename[0])
-                        
+
                         # Fallback: extract from page title or URL
                         if not filename:
                             title_tag = soup.find('title')
@@ -102,20 +162,16 @@ def download_audio_from_url(url, output_dir, platform=None):
                                 filename += '.mp3'
                             else:
                                 filename = 'audio_' + os.path.basename(url).split('.')[0] + '.mp3'
-                        
+
                         if not filename.endswith('.mp3'):
                             filename += '.mp3'
-                        
-                        save_path = os.path.join(output_dir, filename)
-                        
-                        with open(save_path, 'wb') as f:
-                            for chunk in mp3_response.iter_content(chunk_size=8192):
-                                f.write(chunk)
-                        
-                        print(f"Downloaded: {save_path}")
-                        return save_path
-                    else:
-                        print(f"CDN download failed with status: {mp3_response.status_code}")
+                        return filename
+
+                    # Download the file (in parallel ranges when it is large and the CDN allows it)
+                    print(f"Downloading from CDN...")
+                    save_path = service.download(download_link, output_dir, headers=headers, filename_for=filename_for)
+                    print(f"Downloaded: {save_path}")
+                    return verify_audio(save_path)
                 else:
                     print(f"No download link found on page")
             else:
@@ -125,28 +181,9 @@ def download_audio_from_url(url, output_dir, platform=None):
     
     # Fallback to yt-dlp for other sites
     try:
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': os.path.join(output_dir, '%(title)s.%(ext)s'),
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'quiet': True,
-            'no_warnings': True,
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with service.youtube_dl(url, output_dir, audio_format, platform=platform) as ydl:
             info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
-            base, _ = os.path.splitext(filename)
-            final_path = base + ".mp3"
-            
-            if os.path.exists(final_path):
-                return final_path
-            
-            return filename
+            return verify_audio(resolve_download_path(ydl, info))
             
     except Exception as e:
         print(f"yt-dlp failed: {e}")
@@ -0,0 +1,554 @@
+"""
+Durable job and task store backed by a local SQLite file.
+
+One row per job (status, progress, options) and one row per spreadsheet URL
+(last completed stage and output paths), plus the job log. Reads are served
+from an in-memory mirror of the jobs this process touched; writes go to a
+queue that a background thread flushes in a single transaction every
+flush_interval seconds, so many concurrent jobs do not serialize on SQLite.
+Finished jobs leave the mirror retain_finished seconds after they finish,
+once their writes are flushed, and are read back from the file on demand.
+
+The same file doubles as the job queue for worker.py: workers claim
+unfinished jobs with a synchronous write and keep a heartbeat on them, and
+the web server pulls the changes workers make into its mirror (refresh()).
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Seconds without a heartbeat after which a claimed job is considered abandoned
+CLAIM_TIMEOUT = 60
+
+# Seconds a finished job stays in the in-memory mirror
+RETAIN_FINISHED = 600
+
+# Row stages in the order process_file completes them
+STAGES = ('pending', 'downloaded', 'separated', 'transcribed')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    file_path TEXT,
+    options TEXT,
+    status TEXT,
+    progress REAL DEFAULT 0,
+    done INTEGER DEFAULT 0,
+    error TEXT,
+    download_url TEXT,
+    priority INTEGER DEFAULT 0,
+    worker_id TEXT,
+    heartbeat REAL,
+    cancel_requested INTEGER DEFAULT 0,
+    created REAL,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS job_log (
+    job_id TEXT,
+    seq INTEGER,
+    message TEXT,
+    created REAL,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    job_id TEXT,
+    row_idx INTEGER,
+    url TEXT,
+    platform TEXT,
+    stage TEXT DEFAULT 'pending',
+    failed INTEGER DEFAULT 0,
+    audio_path TEXT,
+    audio_hash TEXT,
+    vocals_path TEXT,
+    txt_path TEXT,
+    files TEXT,
+    error TEXT,
+    updated REAL,
+    PRIMARY KEY (job_id, row_idx)
+);
+CREATE TABLE IF NOT EXISTS stage_metrics (
+    job_id TEXT,
+    row_idx INTEGER,
+    stage TEXT,
+    seconds REAL,
+    bytes INTEGER,
+    audio_seconds REAL,
+    peak_rss INTEGER,
+    created REAL
+);
+"""
+
+JOB_FIELDS = ('status', 'progress', 'done', 'error', 'download_url')
+TASK_FIELDS = ('url', 'platform', 'stage', 'failed', 'audio_path', 'audio_hash', 'vocals_path', 'txt_path',
+               'files', 'error')
+
+# Columns added after the first release, created on databases that predate them
+MIGRATIONS = {
+    'jobs': {
+        'priority': 'INTEGER DEFAULT 0',
+        'worker_id': 'TEXT',
+        'heartbeat': 'REAL',
+        'cancel_requested': 'INTEGER DEFAULT 0',
+    },
+    'tasks': {'files': 'TEXT'},
+}
+
+
+class JobStore:
+    """
+    Persistent job/task store with batched writes.
+
+    Args:
+        db_path (str): SQLite file path.
+        flush_interval (float): Seconds between background flushes of queued writes.
+        bus (ProgressBus, optional): Receives a 'status' event for every job update
+                                     and a 'log' event for every log line.
+        retain_finished (float): Seconds a finished job stays in the in-memory mirror.
+    """
+
+    def __init__(self, db_path, flush_interval=0.5, bus=None, retain_finished=RETAIN_FINISHED):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.bus = bus
+        self.retain_finished = retain_finished
+        self._jobs = {}
+        self._tasks = {}
+        # job_id -> time it finished, oldest first
+        self._finished = {}
+        self._lock = threading.RLock()
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+
+        self._writer = threading.Thread(target=self._writer_loop, name='job-store-writer', daemon=True)
+        self._writer.start()
+
+    def _migrate(self):
+        for table, columns in MIGRATIONS.items():
+            existing = {r['name'] for r in self._conn.execute(f'PRAGMA table_info({table})')}
+            for column, column_type in columns.items():
+                if column not in existing:
+                    self._conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+    # ---------------------------------------------------------------- writes
+
+    def _queue(self, sql, params):
+        with self._pending_lock:
+            self._pending.append((sql, params))
+
+    def _writer_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[ERROR] Job store flush failed: {e}")
+
+    def flush(self):
+        """
+        Writes every queued change in one transaction.
+        """
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            with self._db_lock:
+                with self._conn:
+                    for sql, params in pending:
+                        self._conn.execute(sql, params)
+        self._evict_finished()
+
+    def _mark_finished(self, job_id):
+        self._finished.pop(job_id, None)
+        self._finished[job_id] = time.time()
+
+    def _evict_finished(self):
+        """
+        Drops the jobs that finished more than retain_finished seconds ago from
+        the mirror. Nothing is dropped while writes are queued, so the file
+        always holds everything the mirror knew.
+        """
+        cutoff = time.time() - self.retain_finished
+        with self._lock:
+            with self._pending_lock:
+                if self._pending:
+                    return
+            for job_id, finished in list(self._finished.items()):
+                if finished > cutoff:
+                    break
+                del self._finished[job_id]
+                self._jobs.pop(job_id, None)
+                self._tasks.pop(job_id, None)
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        self._writer.join(timeout=5)
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+    # ------------------------------------------------------------------ jobs
+
+    def create_job(self, job_id, file_path, options=None, status='Uploaded'):
+        now = time.time()
+        job = {
+            'job_id': job_id,
+            'file_path': file_path,
+            'options': options or {},
+            'status': status,
+            'progress': 0,
+            'done': False,
+            'error': None,
+            'download_url': None,
+            'log': [],
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._tasks[job_id] = {}
+        self._queue(
+            'INSERT OR REPLACE INTO jobs (job_id, file_path, options, status, progress, done, priority, created, updated) '
+            'VALUES (?, ?, ?, ?, 0, 0, ?, ?, ?)',
+            (job_id, file_path, json.dumps(options or {}), status, (options or {}).get('priority', 0), now, now))
+        # Make sure the job exists on disk before any worker picks it up
+        self._wakeup.set()
+        return job
+
+    def update_job(self, job_id, **fields):
+        """
+        Updates status, progress, done, error and/or download_url of a job.
+        """
+        fields = {k: v for k, v in fields.items() if k in JOB_FIELDS}
+        if not fields:
+            return
+        with self._lock:
+            job = self._load_job(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            if fields.get('done'):
+                self._mark_finished(job_id)
+            # Published under the lock so subscribers see events in the order they happened
+            if self.bus:
+                self.bus.publish(job_id, {'type': 'status', **fields})
+        columns = ', '.join(f"{k} = ?" for k in fields)
+        values = [int(v) if k == 'done' else v for k, v in fields.items()]
+        self._queue(f'UPDATE jobs SET {columns}, updated = ? WHERE job_id = ?',
+                    (*values, time.time(), job_id))
+        if fields.get('done'):
+            self._wakeup.set()
+
+    def append_log(self, job_id, message):
+        """
+        Appends a line to the job log.
+
+        Returns:
+            int: Sequence number of the line (1-based).
+        """
+        with self._lock:
+            job = self._load_job(job_id)
+            if job is None:
+                return 0
+            job['log'].append(message)
+            seq = len(job['log'])
+            if self.bus:
+                self.bus.publish(job_id, {'type': 'log', 'line': seq, 'message': message})
+        self._queue('INSERT OR REPLACE INTO job_log (job_id, seq, message, created) VALUES (?, ?, ?, ?)',
+                    (job_id, seq, message, time.time()))
+        return seq
+
+    def get_job(self, job_id):
+        """
+        Returns a snapshot of the job (with its full log), or None if unknown.
+        """
+        with self._lock:
+            job = self._load_job(job_id)
+            if job is None:
+                return None
+            return dict(job, log=list(job['log']), options=dict(job['options']))
+
+    def _load_job(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        with self._db_lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            log = [r['message'] for r in self._conn.execute(
+                'SELECT message FROM job_log WHERE job_id = ? ORDER BY seq', (job_id,))]
+        job = {
+            'job_id': job_id,
+            'file_path': row['file_path'],
+            'options': json.loads(row['options'] or '{}'),
+            'status': row['status'],
+            'progress': row['progress'],
+            'done': bool(row['done']),
+            'error': row['error'],
+            'download_url': row['download_url'],
+            'log': log,
+        }
+        self._jobs[job_id] = job
+        if job['done']:
+            self._mark_finished(job_id)
+        return job
+
+    def unfinished_jobs(self):
+        """
+        Returns (job_id, file_path) for every job that was not done when the process stopped.
+        """
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute('SELECT job_id, file_path FROM jobs WHERE done = 0 ORDER BY created').fetchall()
+        return [(r['job_id'], r['file_path']) for r in rows]
+
+    def refresh(self):
+        """
+        Pulls what other processes (worker.py) wrote for the unfinished jobs in
+        the mirror, and publishes it on the bus like a local update.
+        """
+        self.flush()
+        with self._lock:
+            watched = {job_id: len(job['log']) for job_id, job in self._jobs.items() if not job['done']}
+        if not watched:
+            return
+        updates = {}
+        with self._db_lock:
+            for job_id, seen in watched.items():
+                row = self._conn.execute(
+                    'SELECT status, progress, done, error, download_url FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+                if row is None:
+                    continue
+                lines = self._conn.execute(
+                    'SELECT seq, message FROM job_log WHERE job_id = ? AND seq > ? ORDER BY seq',
+                    (job_id, seen)).fetchall()
+                updates[job_id] = (row, lines)
+
+        with self._lock:
+            for job_id, (row, lines) in updates.items():
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                # Task files change with every finished row; reload them on the next read
+                self._tasks.pop(job_id, None)
+                for line in lines:
+                    if line['seq'] != len(job['log']) + 1:
+                        continue
+                    job['log'].append(line['message'])
+                    if self.bus:
+                        self.bus.publish(job_id, {'type': 'log', 'line': line['seq'], 'message': line['message']})
+                fields = {k: bool(row[k]) if k == 'done' else row[k] for k in JOB_FIELDS}
+                changed = {k: v for k, v in fields.items() if job[k] != v}
+                if not changed:
+                    continue
+                job.update(changed)
+                if changed.get('done'):
+                    self._mark_finished(job_id)
+                if self.bus:
+                    # The final event carries everything a client needs to show the result
+                    self.bus.publish(job_id, {'type': 'status', **(fields if changed.get('done') else changed)})
+
+    # ----------------------------------------------------------------- queue
+
+    def claim_job(self, worker_id, timeout=CLAIM_TIMEOUT):
+        """
+        Claims the next unfinished job for a worker: highest priority first, then
+        oldest. Jobs whose worker stopped sending heartbeats are claimed again.
+
+        Returns:
+            tuple: (job_id, file_path), or None if nothing is waiting.
+        """
+        self.flush()
+        now = time.time()
+        with self._db_lock:
+            # IMMEDIATE takes the write lock up front, so two workers never claim the same job
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT job_id, file_path FROM jobs WHERE done = 0 AND cancel_requested = 0 '
+                    'AND (worker_id IS NULL OR heartbeat < ?) ORDER BY priority DESC, created LIMIT 1',
+                    (now - timeout,)).fetchone()
+                if row is not None:
+                    self._conn.execute('UPDATE jobs SET worker_id = ?, heartbeat = ? WHERE job_id = ?',
+                                       (worker_id, now, row['job_id']))
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        if row is None:
+            return None
+        # Another process may have changed the job since it was mirrored here
+        with self._lock:
+            self._jobs.pop(row['job_id'], None)
+            self._tasks.pop(row['job_id'], None)
+        return row['job_id'], row['file_path']
+
+    def heartbeat(self, worker_id, job_ids):
+        """
+        Refreshes the claim of a worker on its jobs.
+
+        Returns:
+            set[str]: Jobs among job_ids whose cancellation was requested.
+        """
+        job_ids = list(job_ids)
+        if not job_ids:
+            return set()
+        placeholders = ', '.join('?' for _ in job_ids)
+        with self._db_lock:
+            with self._conn:
+                self._conn.execute(f'UPDATE jobs SET heartbeat = ? WHERE worker_id = ? AND job_id IN ({placeholders})',
+                                   (time.time(), worker_id, *job_ids))
+                rows = self._conn.execute(
+                    f'SELECT job_id FROM jobs WHERE cancel_requested = 1 AND job_id IN ({placeholders})',
+                    job_ids).fetchall()
+        return {r['job_id'] for r in rows}
+
+    def release_jobs(self, worker_id):
+        """
+        Gives up every claim of a worker that is shutting down, so other workers can resume its jobs.
+        """
+        self.flush()
+        with self._db_lock:
+            with self._conn:
+                self._conn.execute('UPDATE jobs SET worker_id = NULL, heartbeat = NULL WHERE worker_id = ? AND done = 0',
+                                   (worker_id,))
+
+    def request_cancel(self, job_id, timeout=CLAIM_TIMEOUT):
+        """
+        Cancels a job that no worker is running, or flags a running one so its worker stops it.
+
+        Returns:
+            str: 'queued' or 'running' depending on what was cancelled, None if the job is not pending.
+        """
+        self.flush()
+        with self._db_lock:
+            with self._conn:
+                cur = self._conn.execute(
+                    "UPDATE jobs SET done = 1, status = 'Cancelled', error = 'Job cancelled', updated = ? "
+                    "WHERE job_id = ? AND done = 0 AND (worker_id IS NULL OR heartbeat < ?)",
+                    (time.time(), job_id, time.time() - timeout))
+                if cur.rowcount:
+                    state = 'queued'
+                else:
+                    cur = self._conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND done = 0',
+                                             (job_id,))
+                    state = 'running' if cur.rowcount else None
+        if state == 'queued':
+            # Mirror and bus only; the row is already written
+            with self._lock:
+                job = self._load_job(job_id)
+                if job is not None:
+                    fields = {'status': 'Cancelled', 'error': 'Job cancelled', 'done': True}
+                    job.update(fields)
+                    self._mark_finished(job_id)
+                    if self.bus:
+                        self.bus.publish(job_id, {'type': 'status', **fields})
+        return state
+
+    def queued_jobs(self):
+        """
+        Returns the unfinished jobs in claim order, with the worker running each (None while waiting).
+        """
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute(
+                'SELECT job_id, priority, worker_id, heartbeat FROM jobs WHERE done = 0 '
+                'ORDER BY priority DESC, created').fetchall()
+        stale = time.time() - CLAIM_TIMEOUT
+        return [{'job_id': r['job_id'], 'priority': r['priority'],
+                 'worker_id': r['worker_id'] if r['heartbeat'] and r['heartbeat'] >= stale else None}
+                for r in rows]
+
+    # --------------------------------------------------------------- metrics
+
+    def record_stage(self, job_id, row_idx, stage, seconds, bytes_downloaded=None, audio_seconds=None, peak_rss=None):
+        """
+        Stores one stage timing of a row (see metrics.JobMetrics).
+        """
+        self._queue('INSERT INTO stage_metrics (job_id, row_idx, stage, seconds, bytes, audio_seconds, peak_rss, created) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (job_id, row_idx, stage, seconds, bytes_downloaded, audio_seconds, peak_rss, time.time()))
+
+    def metrics_summary(self, buckets):
+        """
+        Aggregates the stage timings of every process writing to this database.
+
+        Returns:
+            dict: 'stages' ({stage: {'count', 'sum', 'buckets'}} with cumulative bucket
+                  counts for the given upper bounds), 'bytes_downloaded', 'audio_seconds',
+                  'peak_rss', 'rows' ({'done', 'failed'}) and 'jobs' ({status: count}).
+        """
+        self.flush()
+        bucket_sql = ', '.join(f'SUM(seconds <= {float(b)})' for b in buckets)
+        with self._db_lock:
+            stage_rows = self._conn.execute(
+                f'SELECT stage, COUNT(*), SUM(seconds), {bucket_sql} FROM stage_metrics GROUP BY stage').fetchall()
+            totals = self._conn.execute(
+                'SELECT SUM(bytes), SUM(audio_seconds), MAX(peak_rss) FROM stage_metrics').fetchone()
+            rows = self._conn.execute(
+                "SELECT SUM(failed = 0 AND stage = 'transcribed'), SUM(failed) FROM tasks").fetchone()
+            jobs = self._conn.execute(
+                "SELECT CASE WHEN done = 0 THEN 'active' ELSE status END, COUNT(*) FROM jobs GROUP BY 1").fetchall()
+        return {
+            'stages': {r[0]: {'count': r[1], 'sum': round(r[2] or 0.0, 3), 'buckets': [int(c or 0) for c in r[3:]]}
+                       for r in stage_rows},
+            'bytes_downloaded': totals[0] or 0,
+            'audio_seconds': round(totals[1] or 0.0, 3),
+            'peak_rss': totals[2],
+            'rows': {'done': rows[0] or 0, 'failed': rows[1] or 0},
+            'jobs': {r[0]: r[1] for r in jobs},
+        }
+
+    # ----------------------------------------------------------------- tasks
+
+    def get_tasks(self, job_id):
+        """
+        Returns {row_idx: task dict} for a job.
+        """
+        with self._lock:
+            tasks = self._tasks.get(job_id)
+            if tasks is None:
+                # Tasks leave the mirror with their job, so it has to be there too
+                self._load_job(job_id)
+                with self._db_lock:
+                    rows = self._conn.execute('SELECT * FROM tasks WHERE job_id = ?', (job_id,)).fetchall()
+                tasks = {r['row_idx']: {k: r[k] for k in TASK_FIELDS} for r in rows}
+                for task in tasks.values():
+                    task['failed'] = bool(task['failed'])
+                    task['files'] = json.loads(task['files']) if task['files'] else []
+                self._tasks[job_id] = tasks
+            return {idx: dict(task, files=list(task['files'] or [])) for idx, task in tasks.items()}
+
+    def update_task(self, job_id, row_idx, **fields):
+        """
+        Creates or updates the task of one spreadsheet row.
+        'files' is the list of result files of the row, relative to the job directory.
+        """
+        fields = {k: v for k, v in fields.items() if k in TASK_FIELDS}
+        with self._lock:
+            self.get_tasks(job_id)
+            task = self._tasks[job_id].setdefault(row_idx, {k: None for k in TASK_FIELDS})
+            task.update(fields)
+            snapshot = dict(task)
+        snapshot['stage'] = snapshot['stage'] or 'pending'
+        snapshot['failed'] = int(bool(snapshot['failed']))
+        snapshot['files'] = json.dumps(snapshot['files'] or [])
+        columns = ', '.join(TASK_FIELDS)
+        placeholders = ', '.join('?' for _ in TASK_FIELDS)
+        self._queue(
+            f'INSERT OR REPLACE INTO tasks (job_id, row_idx, {columns}, updated) VALUES (?, ?, {placeholders}, ?)',
+            (job_id, row_idx, *[snapshot[k] for k in TASK_FIELDS], time.time()))
@@ -0,0 +1,220 @@
+"""
+Parallel chunked transcription for long tracks (live sets, DJ mixes).
+
+The audio is split at low-energy points into overlapping chunks. Chunks are
+transcribed in a process pool whose workers each load the Whisper model once
+(through transcriber.get_model) and keep it for later tracks. Segments are
+merged back on the original timeline; in the overlap each boundary keeps the
+segments of whichever chunk owns their midpoint, so nothing is emitted twice.
+
+Every worker holds its own copy of the model, outside the model manager's
+budget, so the pool is small by default (CHUNK_WORKERS, 2) and shrinks to
+what the available memory can hold.
+"""
+
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+from audio_io import WHISPER_SAMPLE_RATE
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+DEFAULT_WORKERS = int(os.environ.get('CHUNK_WORKERS', 2))
+
+# (model size, workers, threads, backend) -> [pool, number of transcriptions using it]
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def find_split_points(audio, samplerate=WHISPER_SAMPLE_RATE, chunk_seconds=300.0, search_seconds=20.0,
+                      frame_ms=50):
+    """
+    Picks split points near every chunk_seconds at the quietest frame within search_seconds.
+
+    Returns:
+        list[float]: Split times in seconds, excluding 0 and the end of the audio.
+    """
+    duration = len(audio) / samplerate
+    frame_len = int(samplerate * frame_ms / 1000)
+    points = []
+    target = chunk_seconds
+    while target < duration - chunk_seconds / 4:
+        lo = int(max(0.0, target - search_seconds / 2) * samplerate)
+        hi = int(min(duration, target + search_seconds / 2) * samplerate)
+        window = audio[lo:hi]
+        n_frames = len(window) // frame_len
+        if n_frames == 0:
+            points.append(target)
+        else:
+            frames = window[:n_frames * frame_len].reshape(n_frames, frame_len)
+            energy = np.mean(frames.astype(np.float64) ** 2, axis=1)
+            quietest = int(np.argmin(energy))
+            points.append((lo + quietest * frame_len + frame_len / 2) / samplerate)
+        target = points[-1] + chunk_seconds
+    return points
+
+
+def _init_worker(model_size, threads, backend):
+    from transcriber import get_model
+    from whisper_backends import configure_threads
+
+    configure_threads(threads)
+    get_model(model_size, backend)
+
+
+def _transcribe_chunk(chunk, offset, model_size, vad, backend, decode_options):
+    from transcriber import transcribe_result
+
+    result = transcribe_result(chunk, model_size=model_size, vad=vad, backend=backend, **decode_options)
+    for segment in result['segments']:
+        segment['start'] += offset
+        segment['end'] += offset
+        for word in segment.get('words') or []:
+            word['start'] += offset
+            word['end'] += offset
+    return result
+
+
+def default_workers(model_size, backend=None):
+    """
+    DEFAULT_WORKERS, lowered to the number of model copies that fit in the
+    memory available now (at least one).
+    """
+    from scheduler import MODEL_RAM_MB
+    from whisper_backends import get_backend
+
+    workers = max(1, min(DEFAULT_WORKERS, os.cpu_count() or 1))
+    if psutil is None:
+        return workers
+    worker_mb = MODEL_RAM_MB.get(model_size, MODEL_RAM_MB['large']) * get_backend(backend)[1]
+    available_mb = psutil.virtual_memory().available / (1024 * 1024)
+    return max(1, min(workers, int(available_mb // worker_mb)))
+
+
+@contextmanager
+def _use_pool(model_size, workers, threads, backend=None):
+    """
+    Holds the pool for a model and worker layout, starting it if needed. Pools
+    of other layouts are only shut down while nobody is using them, so
+    concurrent jobs with different models never lose their pool mid-track.
+    """
+    key = (model_size, workers, threads, backend)
+    with _pool_lock:
+        entry = _pools.get(key)
+        if entry is None:
+            # Idle pools go first: each of their workers holds a model in memory
+            for other in [k for k, (_, users) in _pools.items() if users == 0]:
+                _pools.pop(other)[0].shutdown(wait=False)
+            # Spawned, not forked: this process runs threads and has torch loaded
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=(model_size, threads, backend),
+                                       mp_context=multiprocessing.get_context('spawn'))
+            entry = _pools[key] = [pool, 0]
+        entry[1] += 1
+    try:
+        yield entry[0]
+    finally:
+        with _pool_lock:
+            entry[1] -= 1
+
+
+def shutdown_pool():
+    with _pool_lock:
+        for pool, _ in _pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _pools.clear()
+
+
+atexit.register(shutdown_pool)
+
+
+def transcribe_chunked(audio, model_size='large', workers=None, threads=None, chunk_seconds=300.0,
+                       overlap_seconds=10.0, vad=False, backend=None, **decode_options):
+    """
+    Transcribes a long 16 kHz mono array in overlapping chunks across processes.
+
+    Args:
+        audio (numpy.ndarray): 1-D float32 signal at 16 kHz.
+        model_size (str): Whisper model size.
+        workers (int, optional): Worker processes. Defaults to default_workers(): CHUNK_WORKERS
+                                 (2), fewer if their model copies would not fit in memory.
+        threads (int, optional): Torch threads per worker. Defaults to CPUs / workers.
+        chunk_seconds (float): Target chunk length.
+        overlap_seconds (float): Audio shared by neighbouring chunks.
+        vad (bool): Apply VAD gating inside each chunk.
+        backend (str, optional): Whisper inference backend (see whisper_backends).
+        **decode_options: Extra options passed to model.transcribe.
+
+    Returns:
+        dict: Whisper-style result with 'text', 'segments', 'language' and 'chunks'
+              (plus merged 'vad' stats when vad is set; speech and skipped seconds
+              are estimates).
+    """
+    cpus = os.cpu_count() or 1
+    workers = workers or default_workers(model_size, backend)
+    threads = threads or max(1, cpus // workers)
+
+    samplerate = WHISPER_SAMPLE_RATE
+    duration = len(audio) / samplerate
+    splits = find_split_points(audio, samplerate, chunk_seconds=chunk_seconds)
+    bounds = [0.0] + splits + [duration]
+
+    with _use_pool(model_size, workers, threads, backend) as pool:
+        futures = []
+        for i in range(len(bounds) - 1):
+            start = max(0.0, bounds[i] - overlap_seconds / 2)
+            end = min(duration, bounds[i + 1] + overlap_seconds / 2)
+            chunk = audio[int(start * samplerate):int(end * samplerate)]
+            futures.append(pool.submit(_transcribe_chunk, chunk, start, model_size, vad, backend, decode_options))
+
+        results = [f.result() for f in futures]
+
+    # Each chunk owns the segments whose midpoint falls between its split points
+    segments = []
+    for i, result in enumerate(results):
+        for segment in result['segments']:
+            middle = (segment['start'] + segment['end']) / 2
+            if bounds[i] <= middle < bounds[i + 1] or (i == len(results) - 1 and middle >= bounds[i]):
+                segments.append(segment)
+    for i, segment in enumerate(segments):
+        segment['id'] = i
+
+    languages = [r.get('language') for r in results if r.get('language')]
+    merged = {
+        'text': ''.join(segment['text'] for segment in segments),
+        'segments': segments,
+        'language': max(set(languages), key=languages.count) if languages else None,
+        'chunks': len(results),
+    }
+
+    if vad:
+        # VAD runs per chunk and the overlaps belong to two chunks: each chunk's
+        # figures are scaled to the span it owns, so speech and skipped seconds
+        # are approximate while audio_seconds is the track's own length
+        speech_seconds = seconds_skipped = 0.0
+        regions = 0
+        for i, result in enumerate(results):
+            stats = result.get('vad')
+            if not stats:
+                continue
+            share = (bounds[i + 1] - bounds[i]) / stats['audio_seconds'] if stats['audio_seconds'] else 0.0
+            speech_seconds += stats['speech_seconds'] * min(share, 1.0)
+            seconds_skipped += stats['seconds_skipped'] * min(share, 1.0)
+            regions += stats['regions']
+        merged['vad'] = {
+            'audio_seconds': round(duration, 2),
+            'speech_seconds': round(speech_seconds, 2),
+            'speech_ratio': round(speech_seconds / duration, 3) if duration else 0.0,
+            'seconds_skipped': round(seconds_skipped, 2),
+            'regions': regions,
+        }
+    return merged
@@ -0,0 +1,199 @@
+"""
+Per-row, per-stage instrumentation for jobs.
+
+JobMetrics records how long each stage of each row took, the bytes
+downloaded, the audio duration (for the real-time factor) and the peak RSS
+of the process. process_file and batch_transcribe write its report as JSON
+next to the results. The web app also persists every stage observation in
+the job store, and render_prometheus turns the aggregated observations into
+the Prometheus text format served at /metrics.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+STAGE_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+REPORT_FILENAME = 'metrics.json'
+
+
+def peak_rss_bytes():
+    """
+    Peak resident memory of this process so far, or None if it cannot be read.
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        # peak_wset is the Windows peak working set
+        return getattr(info, 'peak_wset', info.rss)
+    return None
+
+
+def audio_duration(path):
+    """
+    Duration in seconds from ffprobe, or None.
+    """
+    from audio_io import probe_audio
+
+    info = probe_audio(path)
+    return info['duration'] if info else None
+
+
+class JobMetrics:
+    """
+    Collects the metrics of one job (or one batch run). Thread safe, so the
+    pipeline stages of different rows can record at the same time.
+
+    Args:
+        job_id (str): Identifier written in the report.
+        on_stage (callable, optional): Called as on_stage(row, stage, seconds, fields)
+                                       after every timed stage.
+    """
+
+    def __init__(self, job_id, on_stage=None):
+        self.job_id = job_id
+        self.on_stage = on_stage
+        self.started = time.time()
+        self.finished = None
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def _row(self, row):
+        return self._rows.setdefault(row, {'row': row, 'stages': {}})
+
+    def set(self, row, **fields):
+        """
+        Records row attributes such as url, bytes_downloaded or audio_seconds.
+        """
+        with self._lock:
+            self._row(row).update(fields)
+
+    @contextmanager
+    def stage(self, row, name, **fields):
+        """
+        Times a block as stage `name` of a row. Extra fields are stored on the row
+        and passed to on_stage, so callers can add values found inside the block:
+
+            with metrics.stage(i, 'download') as extra:
+                ...
+                extra['bytes_downloaded'] = os.path.getsize(path)
+        """
+        extra = dict(fields)
+        start = time.perf_counter()
+        try:
+            yield extra
+        finally:
+            self.record(row, name, time.perf_counter() - start, **extra)
+
+    def record(self, row, name, seconds, peak_rss=None, **fields):
+        """
+        Records a stage timed elsewhere (e.g. in a worker process, which passes its own peak_rss).
+        """
+        with self._lock:
+            record = self._row(row)
+            record['stages'][name] = round(record['stages'].get(name, 0.0) + seconds, 3)
+            record.update(fields)
+            record['peak_rss_bytes'] = max(peak_rss or 0, record.get('peak_rss_bytes') or 0, peak_rss_bytes() or 0) or None
+        if self.on_stage:
+            self.on_stage(row, name, seconds, fields)
+
+    def finish(self):
+        self.finished = time.time()
+
+    def report(self):
+        """
+        Returns the job report: per-row records plus totals per stage and the real-time factor.
+        """
+        with self._lock:
+            rows = [dict(r, stages=dict(r['stages'])) for _, r in sorted(self._rows.items())]
+        stage_totals = {}
+        for r in rows:
+            for name, seconds in r['stages'].items():
+                stage_totals[name] = round(stage_totals.get(name, 0.0) + seconds, 3)
+            audio_seconds = r.get('audio_seconds')
+            busy = sum(r['stages'].values())
+            # Processing time per second of audio; below 1 is faster than real time
+            r['real_time_factor'] = round(busy / audio_seconds, 3) if audio_seconds else None
+
+        audio_total = sum(r.get('audio_seconds') or 0 for r in rows)
+        wall = (self.finished or time.time()) - self.started
+        return {
+            'job_id': self.job_id,
+            'started': self.started,
+            'wall_seconds': round(wall, 3),
+            'rows': rows,
+            'stage_seconds': stage_totals,
+            'bytes_downloaded': sum(r.get('bytes_downloaded') or 0 for r in rows),
+            'audio_seconds': round(audio_total, 3),
+            # Wall time per second of audio, with stages of different rows overlapping
+            'real_time_factor': round(wall / audio_total, 3) if audio_total else None,
+            # Rows may have been processed in worker processes with their own peaks
+            'peak_rss_bytes': max([peak_rss_bytes() or 0] + [r.get('peak_rss_bytes') or 0 for r in rows]) or None,
+        }
+
+    def write_report(self, directory, filename=REPORT_FILENAME):
+        path = os.path.join(directory, filename)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
+        return path
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+
+def render_prometheus(stage_histograms, counters=(), gauges=(), buckets=STAGE_BUCKETS):
+    """
+    Formats metrics in the Prometheus text exposition format.
+
+    Args:
+        stage_histograms (dict): {stage: {'count': int, 'sum': float, 'buckets': [cumulative counts]}},
+                                 bucket counts aligned with `buckets`.
+        counters (iterable): (name, help, labels dict or None, value) tuples.
+        gauges (iterable): (name, help, labels dict or None, value) tuples.
+
+    Returns:
+        str: The exposition text.
+    """
+    lines = [
+        '# HELP lyric_stage_duration_seconds Time spent per row in each pipeline stage.',
+        '# TYPE lyric_stage_duration_seconds histogram',
+    ]
+    for stage, hist in sorted(stage_histograms.items()):
+        for bound, count in zip(buckets, hist['buckets']):
+            lines.append(f'lyric_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'lyric_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist["count"]}')
+        lines.append(f'lyric_stage_duration_seconds_sum{{stage="{stage}"}} {hist["sum"]}')
+        lines.append(f'lyric_stage_duration_seconds_count{{stage="{stage}"}} {hist["count"]}')
+
+    for kind, metrics in (('counter', counters), ('gauge', gauges)):
+        declared = set()
+        for name, help_text, labels, value in metrics:
+            if value is None:
+                continue
+            if name not in declared:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                declared.add(name)
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,287 @@
+"""
+Process-wide cache of loaded models (Whisper sizes, Demucs models) with a memory budget.
+
+Models are loaded on first use and shared by every thread of the process.
+Code running a model holds it with acquire(), which refcounts it so it is
+never unloaded mid-transcription. Models nobody holds are unloaded:
+- least recently used first when loading another one would go over the
+  budget (MODEL_MEMORY_MB, default half of physical RAM),
+- after MODEL_IDLE_SECONDS without use (default 15 minutes, 0 never).
+A model that does not fit even after freeing everything unused still loads,
+like a job bigger than the scheduler's budget still runs alone.
+"""
+
+import gc
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Global manager instance
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def model_mb(model):
+    """
+    Memory of a torch model's parameters and buffers in MB, or None for other objects.
+    """
+    if not hasattr(model, 'parameters'):
+        return None
+    tensors = list(model.parameters()) + list(model.buffers())
+    for module in model.modules():
+        # Dynamically quantized layers keep their packed weights outside parameters()
+        if hasattr(module, '_weight_bias'):
+            tensors += [t for t in module._weight_bias() if t is not None]
+    return sum(t.numel() * t.element_size() for t in tensors) / (1024 * 1024)
+
+
+def _release_memory():
+    """
+    Hands the memory of unloaded models back to the OS where possible.
+    """
+    gc.collect()
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    if sys.platform.startswith('linux'):
+        # glibc keeps freed heap pages for reuse; without this RSS would not drop
+        try:
+            import ctypes
+            ctypes.CDLL('libc.so.6').malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+
+
+class _Entry:
+    def __init__(self, key, estimate_mb):
+        self.key = key
+        self.model = None
+        self.mb = estimate_mb or 0
+        self.refs = 0
+        self.last_used = time.time()
+        self.loaded = threading.Event()
+
+
+class ModelManager:
+    """
+    Args:
+        budget_mb (float, optional): Memory allowed for loaded models. None disables the limit.
+        idle_seconds (float, optional): Unload models unused for this long. None or 0 disables it.
+
+    Usage:
+        manager = get_manager()
+        with manager.acquire('whisper:large', lambda: whisper.load_model('large'), estimate_mb=6000) as model:
+            model.transcribe(audio)
+        manager.snapshot()   # {'budget_mb': ..., 'loaded_mb': ..., 'models': [...]}
+    """
+
+    def __init__(self, budget_mb=None, idle_seconds=None):
+        self.budget_mb = budget_mb
+        self.idle_seconds = idle_seconds or None
+        # Least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._reaper = None
+        self._stop = threading.Event()
+
+    @contextmanager
+    def acquire(self, key, load, estimate_mb=None):
+        """
+        Holds the model `key`, loading it with load() if needed. It is not unloaded
+        until every holder has left the block.
+
+        Args:
+            key (str): Model identifier, e.g. 'whisper:large'.
+            load (callable): Returns the loaded model.
+            estimate_mb (float, optional): Expected size, used to make room before loading.
+        """
+        entry = self._pin(key, load, estimate_mb)
+        try:
+            yield entry.model
+        finally:
+            self._unpin(entry)
+
+    def get(self, key, load, estimate_mb=None):
+        """
+        Loads the model (e.g. to preload it) and returns it without holding it,
+        so it may be unloaded at any time: use acquire() to run it.
+        """
+        with self.acquire(key, load, estimate_mb) as model:
+            return model
+
+    def _pin(self, key, load, estimate_mb):
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = _Entry(key, estimate_mb)
+                    entry.refs = 1
+                    self._entries[key] = entry
+                    evicted = self._evict_for(keep=entry)
+                    break
+                entry.refs += 1
+                self._entries.move_to_end(key)
+            # Another thread may be loading it
+            entry.loaded.wait()
+            if entry.model is not None:
+                return entry
+            # Its load failed: try again ourselves
+            self._unpin(entry)
+
+        self._unload(evicted)
+        logging.info(f"Loading model '{key}'...")
+        try:
+            model = load()
+        except BaseException:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+                entry.refs -= 1
+            entry.loaded.set()
+            raise
+        with self._lock:
+            entry.model = model
+            entry.mb = model_mb(model) or entry.mb
+            # The estimate may have been short
+            evicted = self._evict_for(keep=entry)
+        entry.loaded.set()
+        self._unload(evicted)
+        logging.info(f"Model '{key}' loaded ({entry.mb:.0f} MB, {self.loaded_mb():.0f} MB in use).")
+        self._start_reaper()
+        return entry
+
+    def _unpin(self, entry):
+        with self._lock:
+            entry.refs -= 1
+            entry.last_used = time.time()
+            # Models left over budget while they were held go as soon as they are free,
+            # except the one just used
+            evicted = self._evict_for(keep=entry) if entry.refs == 0 else []
+        self._unload(evicted)
+
+    def _evict_for(self, keep=None):
+        """
+        Removes unused models other than keep, least recently used first, until
+        everything (including models being loaded) fits in the budget. Called with
+        the lock held; returns the removed entries.
+        """
+        if self.budget_mb is None:
+            return []
+        evicted = []
+        for key, entry in list(self._entries.items()):
+            if self._total_mb() <= self.budget_mb:
+                break
+            if entry is not keep and entry.refs == 0 and entry.model is not None:
+                del self._entries[key]
+                evicted.append(entry)
+        return evicted
+
+    def _total_mb(self):
+        return sum(entry.mb for entry in self._entries.values())
+
+    def _unload(self, entries):
+        if not entries:
+            return
+        for entry in entries:
+            logging.info(f"Unloading model '{entry.key}' ({entry.mb:.0f} MB, "
+                         f"idle {time.time() - entry.last_used:.0f}s).")
+            entry.model = None
+        _release_memory()
+
+    def evict_idle(self):
+        """
+        Unloads the unused models idle for longer than idle_seconds.
+        """
+        if not self.idle_seconds:
+            return []
+        cutoff = time.time() - self.idle_seconds
+        with self._lock:
+            evicted = [entry for entry in self._entries.values()
+                       if entry.refs == 0 and entry.model is not None and entry.last_used <= cutoff]
+            for entry in evicted:
+                del self._entries[entry.key]
+        self._unload(evicted)
+        return [entry.key for entry in evicted]
+
+    def unload(self, key=None):
+        """
+        Unloads one model, or every unused model if key is None. Models in use stay.
+
+        Returns:
+            list[str]: The keys unloaded.
+        """
+        with self._lock:
+            evicted = [entry for k, entry in self._entries.items()
+                       if (key is None or k == key) and entry.refs == 0 and entry.model is not None]
+            for entry in evicted:
+                del self._entries[entry.key]
+        self._unload(evicted)
+        return [entry.key for entry in evicted]
+
+    def _start_reaper(self):
+        if not self.idle_seconds:
+            return
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name='model-reaper', daemon=True)
+        self._reaper.start()
+
+    def _reap_loop(self):
+        interval = min(max(self.idle_seconds / 4, 1), 60)
+        while not self._stop.wait(interval):
+            self.evict_idle()
+
+    def loaded_mb(self):
+        with self._lock:
+            return sum(entry.mb for entry in self._entries.values() if entry.model is not None)
+
+    def snapshot(self):
+        """
+        Returns the budget and the loaded models, least recently used first.
+        """
+        now = time.time()
+        with self._lock:
+            models = [{'key': entry.key, 'mb': round(entry.mb, 1), 'in_use': entry.refs,
+                       'idle_seconds': 0 if entry.refs else round(now - entry.last_used, 1)}
+                      for entry in self._entries.values() if entry.model is not None]
+        return {
+            'budget_mb': self.budget_mb,
+            'idle_timeout_seconds': self.idle_seconds,
+            'loaded_mb': round(sum(m['mb'] for m in models), 1),
+            'models': models,
+        }
+
+
+def default_model_budget_mb():
+    """
+    MODEL_MEMORY_MB if set, else half of physical RAM when psutil is available, else None (no limit).
+    """
+    if os.environ.get('MODEL_MEMORY_MB'):
+        return float(os.environ['MODEL_MEMORY_MB'])
+    if psutil is not None:
+        return psutil.virtual_memory().total / (1024 * 1024) * 0.5
+    return None
+
+
+def get_manager():
+    """
+    Returns the process-wide ModelManager, configured from the environment on first use.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ModelManager(
+                budget_mb=default_model_budget_mb(),
+                idle_seconds=float(os.environ.get('MODEL_IDLE_SECONDS', 900)),
+            )
+        return _manager
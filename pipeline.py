@@ -0,0 +1,150 @@
+"""
+Staged pipeline executor used by process_file.
+
+Each stage runs in its own pool of worker threads and hands items to the next
+stage through a bounded queue, so row N+1 can be downloading while row N is
+being separated and row N-1 is being transcribed. A batched stage takes
+every item already waiting in its queue (up to its batch size) in one call.
+"""
+
+import logging
+import queue
+import threading
+
+# Marks the end of the input for one worker thread
+_SENTINEL = object()
+
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    Args:
+        name (str): Stage name, used in error callbacks and thread names.
+        func (callable): Receives an item and returns the item for the next stage,
+                         or None to drop it.
+        workers (int): Number of threads running this stage.
+        batch_size (int, optional): Makes the stage batched: func receives a list of up
+                                    to batch_size items that were ready at the same time
+                                    (it never waits for more) and returns a list with, for
+                                    each item, what func would return for it alone or the
+                                    exception that item raised.
+    """
+
+    def __init__(self, name, func, workers=1, batch_size=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(batch_size)) if batch_size else None
+
+
+def run_pipeline(items, stages, queue_size=2, on_error=None, stop_event=None, on_drop=None):
+    """
+    Runs every item through the stages, overlapping work between stages.
+
+    Args:
+        items (iterable): Work items fed to the first stage.
+        stages (list[Stage]): Stages in execution order.
+        queue_size (int): Maximum number of items waiting between two stages.
+        on_error (callable, optional): Called as on_error(stage_name, item, exc) when
+                                       a stage raises. The item is dropped.
+        stop_event (threading.Event, optional): Once set, no new item is fed and every
+                                                item is dropped at its next stage boundary.
+                                                A stage call already running returns, but
+                                                its output does not go on to the next stage.
+        on_drop (callable, optional): Called as on_drop(stage_name, item) for every
+                                      queued item dropped after stop_event was set.
+
+    Returns:
+        list: Items that went through every stage, in completion order.
+    """
+    if not stages:
+        return list(items)
+
+    queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in stages]
+    remaining = [stage.workers for stage in stages]
+    remaining_lock = threading.Lock()
+    results = []
+
+    def run(stage, batch):
+        # One output (or exception) per item
+        if stage.batch_size is None:
+            try:
+                return [stage.func(batch[0])]
+            except Exception as e:
+                return [e]
+        try:
+            return stage.func(batch)
+        except Exception as e:
+            return [e] * len(batch)
+
+    def notify(callback, *args):
+        # A failing callback must not kill the worker: the stage would stop draining
+        # its queue and never close the next one
+        try:
+            callback(*args)
+        except Exception:
+            logging.exception(f"Pipeline callback {getattr(callback, '__name__', callback)} failed")
+
+    def worker(idx):
+        stage = stages[idx]
+        in_queue = queues[idx]
+        try:
+            finished = False
+            while not finished:
+                batch = [in_queue.get()]
+                # Whatever else is already waiting joins the batch
+                while len(batch) < (stage.batch_size or 1) and batch[-1] is not _SENTINEL:
+                    try:
+                        batch.append(in_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if batch[-1] is _SENTINEL:
+                    batch.pop()
+                    finished = True
+                if stop_event is not None and stop_event.is_set():
+                    if on_drop:
+                        for item in batch:
+                            notify(on_drop, stage.name, item)
+                    continue
+                if not batch:
+                    continue
+                for item, out in zip(batch, run(stage, batch)):
+                    if isinstance(out, Exception):
+                        if on_error:
+                            notify(on_error, stage.name, item, out)
+                        continue
+                    if out is None:
+                        continue
+                    if idx + 1 < len(stages):
+                        queues[idx + 1].put(out)
+                    else:
+                        results.append(out)
+        finally:
+            # The last worker of a stage to finish closes the next stage, even if this one died
+            with remaining_lock:
+                remaining[idx] -= 1
+                last = remaining[idx] == 0
+            if last and idx + 1 < len(stages):
+                for _ in range(stages[idx + 1].workers):
+                    queues[idx + 1].put(_SENTINEL)
+
+    threads = []
+    for idx, stage in enumerate(stages):
+        for n in range(stage.workers):
+            t = threading.Thread(target=worker, args=(idx,), name=f"{stage.name}-{n}", daemon=True)
+            t.start()
+            threads.append(t)
+
+    # Feeding blocks while the first queue is full, which bounds read-ahead
+    for item in items:
+        if stop_event is not None and stop_event.is_set():
+            break
+        queues[0].put(item)
+    for _ in range(stages[0].workers):
+        queues[0].put(_SENTINEL)
+
+    for t in threads:
+        t.join()
+
+    return results
@@ -0,0 +1,79 @@
+"""
+Publish/subscribe bus for job progress events.
+
+process_file (through the job store) publishes every status change and log
+line as an event with a per-job sequence number. SSE clients block on the bus
+until an event newer than the last one they saw arrives, so nothing is lost
+between ticks and idle connections cost nothing. A reconnecting client sends
+the last sequence number it received (Last-Event-ID) and gets the rest.
+"""
+
+import threading
+from collections import deque
+
+# Events kept per job for reconnecting clients
+HISTORY_SIZE = 5000
+# Seconds a finished job's history is kept before being dropped
+RETAIN_FINISHED = 600
+
+
+class ProgressBus:
+    def __init__(self, history_size=HISTORY_SIZE, retain_finished=RETAIN_FINISHED):
+        self.history_size = history_size
+        self.retain_finished = retain_finished
+        self._events = {}
+        self._seq = {}
+        self._cond = threading.Condition()
+
+    def publish(self, job_id, event):
+        """
+        Publishes an event dict for a job and wakes up its subscribers.
+
+        Returns:
+            int: The event's sequence number.
+        """
+        with self._cond:
+            seq = self._seq.get(job_id, 0) + 1
+            self._seq[job_id] = seq
+            history = self._events.setdefault(job_id, deque(maxlen=self.history_size))
+            history.append((seq, event))
+            self._cond.notify_all()
+
+        if event.get('done'):
+            timer = threading.Timer(self.retain_finished, self.discard, args=(job_id,))
+            timer.daemon = True
+            timer.start()
+        return seq
+
+    def latest_seq(self, job_id):
+        with self._cond:
+            return self._seq.get(job_id, 0)
+
+    def has_since(self, job_id, seq):
+        """
+        True if every event after seq is still in the history (a client can resume from it).
+        """
+        with self._cond:
+            if seq > self._seq.get(job_id, 0):
+                return False
+            history = self._events.get(job_id)
+            if not history:
+                return seq == self._seq.get(job_id, 0)
+            return history[0][0] <= seq + 1
+
+    def wait(self, job_id, after_seq, timeout=15.0):
+        """
+        Blocks until the job has events newer than after_seq, or the timeout expires.
+
+        Returns:
+            list[tuple[int, dict]]: (seq, event) pairs, oldest first. Empty on timeout.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq.get(job_id, 0) > after_seq, timeout=timeout)
+            history = self._events.get(job_id) or ()
+            return [(seq, event) for seq, event in history if seq > after_seq]
+
+    def discard(self, job_id):
+        with self._cond:
+            self._events.pop(job_id, None)
+            self._seq.pop(job_id, None)
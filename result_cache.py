@@ -0,0 +1,356 @@
+"""
+Content-addressed cache for downloads, separated stems and transcripts.
+
+Downloads are looked up by URL. Once the audio is known, separation and
+transcription results are keyed by the SHA-256 of the audio content plus a
+hash of the settings that produced them, so the same song submitted under a
+different URL or in another sheet is only processed once.
+
+Layout under cache_dir:
+    index.db                                LRU index and URL map (SQLite)
+    audio/<audio_hash>/<filename>           downloaded audio
+    stems/<audio_hash>/<settings_key>/      Demucs stems
+    transcripts/<audio_hash>/<settings_key>.json   Whisper output
+
+The index lives in SQLite in WAL mode, so the web server, worker.py processes
+and batch_transcribe.py can share one cache directory: every change is a
+transaction on the shared index, and the size cap and LRU eviction cover
+what all of them stored.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Stages tracked by the hit/miss counters
+STAGES = ('download', 'stems', 'transcript')
+
+# Entries used this recently are not evicted: another process may be linking them
+EVICT_GRACE_SECONDS = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER,
+    last_access REAL
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+CREATE TABLE IF NOT EXISTS urls (
+    url_key TEXT PRIMARY KEY,
+    key TEXT
+);
+"""
+
+# Global cache instances, one per cache directory
+_cache_instances = {}
+_instances_lock = threading.Lock()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """
+    Returns the SHA-256 hex digest of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def settings_key(settings):
+    """
+    Returns a short stable key for a dict of settings.
+    """
+    encoded = json.dumps(settings or {}, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:16]
+
+
+def link_or_copy(src, dst):
+    """
+    Hardlinks src to dst when possible (same filesystem), otherwise copies it.
+    """
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _path_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+class ResultCache:
+    """
+    Size-capped cache with LRU eviction and per-stage hit/miss counters.
+
+    Args:
+        cache_dir (str): Directory holding cached files and the index.
+        max_bytes (int): Size cap. Least recently used entries are evicted above it.
+    """
+
+    def __init__(self, cache_dir, max_bytes=10 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = {stage: 0 for stage in STAGES}
+        self.misses = {stage: 0 for stage in STAGES}
+        self._lock = threading.RLock()
+        os.makedirs(cache_dir, exist_ok=True)
+        # Autocommit: multi-statement changes open their own IMMEDIATE transaction
+        self._conn = sqlite3.connect(os.path.join(cache_dir, 'index.db'), check_same_thread=False, timeout=30,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._import_json_index()
+
+    # ------------------------------------------------------------------ index
+
+    @contextmanager
+    def _transaction(self):
+        # Takes the write lock up front, so the read-modify-write sequences of
+        # processes sharing the cache never interleave
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def _import_json_index(self):
+        """
+        Moves the entries of an index.json written by earlier versions into the database.
+        """
+        json_path = os.path.join(self.cache_dir, 'index.json')
+        if not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"[WARN] Ignoring unreadable cache index {json_path}: {e}")
+            data = {}
+        with self._transaction() as conn:
+            for key, entry in data.get('entries', {}).items():
+                if os.path.exists(self._abs(key)):
+                    conn.execute('INSERT OR IGNORE INTO entries (key, size, last_access) VALUES (?, ?, ?)',
+                                 (key, entry['size'], entry['last_access']))
+            for url_key, key in data.get('urls', {}).items():
+                conn.execute('INSERT OR IGNORE INTO urls (url_key, key) VALUES (?, ?)', (url_key, key))
+        os.replace(json_path, json_path + '.imported')
+
+    def _abs(self, key):
+        return os.path.join(self.cache_dir, *key.split('/'))
+
+    def _lookup(self, key):
+        """
+        Returns the path of a cached entry and marks it used, or None if it is gone.
+        """
+        with self._lock:
+            path = self._abs(key)
+            if os.path.exists(path):
+                updated = self._conn.execute('UPDATE entries SET last_access = ? WHERE key = ?',
+                                             (time.time(), key)).rowcount
+                if updated:
+                    return path
+            # Files removed by hand or by another process
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            return None
+
+    def _count(self, stage, hit):
+        with self._lock:
+            (self.hits if hit else self.misses)[stage] += 1
+
+    def _add(self, key):
+        size = _path_size(self._abs(key))
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO entries (key, size, last_access) VALUES (?, ?, ?)',
+                         (key, size, time.time()))
+            self._evict(conn, keep=key)
+
+    def _evict(self, conn, keep=None):
+        """
+        Removes least recently used entries until the cache fits max_bytes. Runs
+        inside a write transaction, so no other process evicts or adds meanwhile.
+        """
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        cutoff = time.time() - EVICT_GRACE_SECONDS
+        rows = conn.execute('SELECT key, size, last_access FROM entries ORDER BY last_access').fetchall()
+        for key, size, last_access in rows:
+            if total <= self.max_bytes or last_access > cutoff:
+                break
+            if key == keep:
+                continue
+            path = self._abs(key)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total -= size
+
+    # --------------------------------------------------------------- download
+
+    def get_download(self, url, dest_dir, variant=None):
+        """
+        Looks up a previous download of url and links it into dest_dir.
+
+        Args:
+            url (str): Source URL.
+            dest_dir (str): Directory the audio should appear in.
+            variant (dict, optional): Download settings that change the file (e.g. output format).
+
+        Returns:
+            tuple: (audio_path, audio_hash), or (None, None) on a miss.
+        """
+        url_key = settings_key({'url': url, 'variant': variant})
+        with self._lock:
+            row = self._conn.execute('SELECT key FROM urls WHERE url_key = ?', (url_key,)).fetchone()
+        cached = self._lookup(row[0]) if row else None
+        audio_path = None
+        if cached:
+            audio_path = os.path.join(dest_dir, os.path.basename(cached))
+            try:
+                link_or_copy(cached, audio_path)
+            except FileNotFoundError:
+                # Evicted by another process since the lookup
+                audio_path = None
+        self._count('download', audio_path is not None)
+        if not audio_path:
+            if row:
+                with self._transaction() as conn:
+                    conn.execute('DELETE FROM urls WHERE url_key = ?', (url_key,))
+            return None, None
+        return audio_path, row[0].split('/')[1]
+
+    def put_download(self, url, audio_path, variant=None):
+        """
+        Stores a downloaded file and maps url to it.
+
+        Returns:
+            str: The audio content hash.
+        """
+        audio_hash = hash_file(audio_path)
+        key = f"audio/{audio_hash}/{os.path.basename(audio_path)}"
+        if not self._lookup(key):
+            link_or_copy(audio_path, self._abs(key))
+            self._add(key)
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO urls (url_key, key) VALUES (?, ?)',
+                         (settings_key({'url': url, 'variant': variant}), key))
+        return audio_hash
+
+    # ------------------------------------------------------------------ stems
+
+    def get_stems(self, audio_hash, settings, dest_dir):
+        """
+        Links cached stems for audio_hash produced with settings into dest_dir.
+
+        Returns:
+            str: dest_dir on a hit, None on a miss.
+        """
+        key = f"stems/{audio_hash}/{settings_key(settings)}"
+        cached = self._lookup(key)
+        if cached:
+            try:
+                for name in os.listdir(cached):
+                    # settings.json is the cache's own record, not a stem
+                    if name != 'settings.json':
+                        link_or_copy(os.path.join(cached, name), os.path.join(dest_dir, name))
+            except FileNotFoundError:
+                cached = None
+        self._count('stems', cached is not None)
+        return dest_dir if cached else None
+
+    def put_stems(self, audio_hash, settings, stems_dir):
+        """
+        Stores every file in stems_dir as the stems for audio_hash and settings.
+        """
+        key = f"stems/{audio_hash}/{settings_key(settings)}"
+        target = self._abs(key)
+        for name in os.listdir(stems_dir):
+            src = os.path.join(stems_dir, name)
+            if os.path.isfile(src):
+                link_or_copy(src, os.path.join(target, name))
+        with open(os.path.join(target, 'settings.json'), 'w', encoding='utf-8') as f:
+            json.dump(settings, f, sort_keys=True, default=str)
+        self._add(key)
+
+    # ------------------------------------------------------------- transcript
+
+    def get_transcript(self, audio_hash, settings):
+        """
+        Returns the cached Whisper result dict for audio_hash and settings, or None.
+        """
+        key = f"transcripts/{audio_hash}/{settings_key(settings)}.json"
+        cached = self._lookup(key)
+        result = None
+        if cached:
+            try:
+                with open(cached, 'r', encoding='utf-8') as f:
+                    result = json.load(f)
+            except (FileNotFoundError, ValueError):
+                # Evicted, or still being written by another process
+                result = None
+        self._count('transcript', result is not None)
+        return result
+
+    def put_transcript(self, audio_hash, settings, result):
+        """
+        Stores a Whisper result dict for audio_hash and settings.
+        """
+        key = f"transcripts/{audio_hash}/{settings_key(settings)}.json"
+        path = self._abs(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a unique name and renamed, so readers never see half a file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'settings': settings, **result}, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+        self._add(key)
+
+    # ------------------------------------------------------------------ stats
+
+    def stats(self):
+        """
+        Returns hit/miss counters per stage plus the current size and entry count.
+        """
+        with self._lock:
+            entries, size = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+            return {
+                'hits': dict(self.hits),
+                'misses': dict(self.misses),
+                'entries': entries,
+                'size_bytes': size,
+                'max_bytes': self.max_bytes,
+            }
+
+
+def get_cache(cache_dir, max_bytes=None):
+    """
+    Returns the shared ResultCache for cache_dir, creating it on first use.
+    """
+    cache_dir = os.path.abspath(cache_dir)
+    with _instances_lock:
+        if cache_dir not in _cache_instances:
+            if max_bytes is None:
+                max_bytes = int(os.environ.get('CACHE_MAX_BYTES', 10 * 1024 ** 3))
+            _cache_instances[cache_dir] = ResultCache(cache_dir, max_bytes=max_bytes)
+        return _cache_instances[cache_dir]
@@ -0,0 +1,200 @@
+"""
+Job scheduler with a fixed number of worker slots and memory-based admission.
+
+Uploaded jobs wait in a priority queue (higher priority first, FIFO within
+the same priority). A job starts when a slot is free and the estimated RAM of
+everything running plus the new job fits in the memory budget. Loaded models
+are shared by all jobs in the process, so each distinct Whisper model size
+is only counted once, plus a working set per job. Queued jobs can be
+cancelled outright; running jobs get their cancel event set and stop at the
+next stage boundary of each row.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Approximate resident memory of a loaded Whisper model on CPU (fp32), in MB
+MODEL_RAM_MB = {
+    'tiny': 1000,
+    'base': 1200,
+    'small': 2000,
+    'medium': 5000,
+    'large': 10000,
+}
+# htdemucs model loaded once per process
+DEMUCS_RAM_MB = 1500
+# Per-job working memory (decoded audio, stems, Demucs activations)
+JOB_RAM_MB = 1500
+
+
+def default_memory_budget_mb():
+    """
+    MEMORY_BUDGET_MB if set, else 80% of physical RAM when psutil is available, else None (no limit).
+    """
+    if os.environ.get('MEMORY_BUDGET_MB'):
+        return int(os.environ['MEMORY_BUDGET_MB'])
+    if psutil is not None:
+        return int(psutil.virtual_memory().total / (1024 * 1024) * 0.8)
+    return None
+
+
+def estimate_ram_mb(model_sizes):
+    """
+    Estimated RAM for jobs using the given Whisper model sizes. One entry per job:
+    a size, or a tuple of every size the job loads (e.g. a cascade's two models).
+    """
+    if not model_sizes:
+        return 0
+    sizes = set()
+    for job_sizes in model_sizes:
+        sizes.update((job_sizes,) if isinstance(job_sizes, str) else job_sizes)
+    models = sum(MODEL_RAM_MB.get(size, MODEL_RAM_MB['large']) for size in sizes)
+    return models + DEMUCS_RAM_MB + JOB_RAM_MB * len(model_sizes)
+
+
+class JobScheduler:
+    """
+    Args:
+        run_job (callable): Called as run_job(job_id, *args, cancel_event) in a worker thread.
+        slots (int): Maximum number of jobs running at once.
+        memory_budget_mb (int, optional): RAM budget for admission. None disables the check.
+        on_queue_change (callable, optional): Called as on_queue_change(job_id, position)
+                                              for every queued job when positions change.
+        on_cancel (callable, optional): Called as on_cancel(job_id) when a queued job is cancelled.
+    """
+
+    def __init__(self, run_job, slots=2, memory_budget_mb=None, on_queue_change=None, on_cancel=None):
+        self.run_job = run_job
+        self.slots = max(1, int(slots))
+        self.memory_budget_mb = memory_budget_mb
+        self.on_queue_change = on_queue_change
+        self.on_cancel = on_cancel
+        self._queue = []
+        self._queued = {}
+        self._running = {}
+        self._counter = itertools.count()
+        self._positions = {}
+        self._cond = threading.Condition()
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name='job-scheduler', daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, job_id, args=(), priority=0, model_size='large'):
+        """
+        Queues a job.
+
+        Args:
+            model_size (str or tuple): Whisper model size the job loads, or every size
+                                       it loads (see estimate_ram_mb).
+
+        Returns:
+            int: The job's position in the queue (1 = next to start).
+        """
+        with self._cond:
+            entry = {'job_id': job_id, 'args': args, 'priority': priority, 'model_size': model_size}
+            heapq.heappush(self._queue, (-priority, next(self._counter), job_id))
+            self._queued[job_id] = entry
+            self._cond.notify_all()
+        self._publish_positions()
+        return self.position(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued job, or asks a running job to stop.
+
+        Returns:
+            str: 'queued' or 'running' depending on what was cancelled, None if the job is unknown.
+        """
+        with self._cond:
+            if job_id in self._queued:
+                del self._queued[job_id]
+                self._queue = [e for e in self._queue if e[2] != job_id]
+                heapq.heapify(self._queue)
+                state = 'queued'
+            elif job_id in self._running:
+                self._running[job_id]['cancel_event'].set()
+                state = 'running'
+            else:
+                return None
+            self._cond.notify_all()
+        if state == 'queued':
+            if self.on_cancel:
+                self.on_cancel(job_id)
+            self._publish_positions()
+        return state
+
+    def position(self, job_id):
+        """
+        1-based queue position, 0 if running, None if unknown.
+        """
+        with self._cond:
+            if job_id in self._running:
+                return 0
+            order = [e[2] for e in sorted(self._queue)]
+            return order.index(job_id) + 1 if job_id in order else None
+
+    def snapshot(self):
+        """
+        Returns the running and queued jobs, in start order.
+        """
+        with self._cond:
+            running = [{'job_id': j, 'model_size': r['model_size']} for j, r in self._running.items()]
+            queued = [{'job_id': e[2], 'priority': -e[0], 'model_size': self._queued[e[2]]['model_size']}
+                      for e in sorted(self._queue)]
+        return {
+            'slots': self.slots,
+            'memory_budget_mb': self.memory_budget_mb,
+            'estimated_ram_mb': estimate_ram_mb([r['model_size'] for r in running]),
+            'running': running,
+            'queued': queued,
+        }
+
+    def _fits(self, entry):
+        if len(self._running) >= self.slots:
+            return False
+        if self.memory_budget_mb is None or not self._running:
+            # A job bigger than the whole budget still runs, alone
+            return True
+        sizes = [r['model_size'] for r in self._running.values()] + [entry['model_size']]
+        return estimate_ram_mb(sizes) <= self.memory_budget_mb
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                # Strict order: the head of the queue is never overtaken by a smaller job
+                self._cond.wait_for(lambda: self._queue and self._fits(self._queued[self._queue[0][2]]))
+                _, _, job_id = heapq.heappop(self._queue)
+                entry = self._queued.pop(job_id)
+                entry['cancel_event'] = threading.Event()
+                self._running[job_id] = entry
+            thread = threading.Thread(target=self._run, args=(entry,), name=f"job-{job_id[:8]}", daemon=True)
+            thread.start()
+            self._publish_positions()
+
+    def _run(self, entry):
+        try:
+            self.run_job(entry['job_id'], *entry['args'], entry['cancel_event'])
+        finally:
+            with self._cond:
+                self._running.pop(entry['job_id'], None)
+                self._cond.notify_all()
+
+    def _publish_positions(self):
+        if not self.on_queue_change:
+            return
+        changed = []
+        with self._cond:
+            order = [e[2] for e in sorted(self._queue)]
+            positions = {job_id: position for position, job_id in enumerate(order, 1)}
+            for job_id, position in positions.items():
+                if self._positions.get(job_id) != position:
+                    changed.append((job_id, position))
+            self._positions = positions
+        for job_id, position in changed:
+            self.on_queue_change(job_id, position)
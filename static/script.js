@@ -53,6 +53,9 @@ function uploadFile(file) {
 
     const formData = new FormData();
     formData.append('file', file);
+    formData.append('long_audio', document.getElementById('opt-long-audio').checked);
+    formData.append('priority', document.getElementById('opt-priority').value);
+    formData.append('stems', document.getElementById('opt-stems').value);
 
     // Swap UI to progress view
     dropZone.classList.add('hidden');
@@ -81,8 +84,28 @@ function uploadFile(file) {
         
         const jobId = data.job_id;
         
-        // Start listening for progress
+        // Streams the ZIP while it is being built; finished rows arrive first
+        document.getElementById('partial-download').href = `/download/${jobId}/stream`;
+        
+        // Queued jobs are dropped; running jobs drop their rows at the next stage boundary
+        const cancelBtn = document.getElementById('cancel-btn');
+        cancelBtn.onclick = function() {
+            cancelBtn.disabled = true;
+            fetch(`/jobs/${jobId}/cancel`, { method: 'POST' });
+        };
+        
+        // Start listening for progress.
+        // Every event carries an id; on reconnect the browser sends it back as
+        // Last-Event-ID and the server replays whatever was missed.
         const eventSource = new EventSource(`/progress/${jobId}`);
+        let logLines = 0;
+
+        function appendLog(message) {
+            const logEntry = document.createElement('div');
+            logEntry.className = 'log-entry';
+            logEntry.innerText = `> ${message}`;
+            logContainer.appendChild(logEntry);
+        }
         
         eventSource.onmessage = function(event) {
             const data = JSON.parse(event.data);
@@ -99,42 +122,57 @@ function uploadFile(file) {
                 statusText.innerText = data.status;
             }
             
-            // Add Log
-            if (data.log) {
-                const logEntry = document.createElement('div');
-                logEntry.className = 'log-entry';
-                logEntry.innerText = `> ${data.log}`;
-                logContainer.appendChild(logEntry);
+            // Full state: replace the log with the complete history
+            if (data.type === 'snapshot') {
+                logContainer.innerHTML = '';
+                data.log.forEach(appendLog);
+                logLines = data.log.length;
                 logContainer.scrollTop = logContainer.scrollHeight;
             }
             
-            // Handle Completion
-            if (data.done) {
-                eventSource.close();
-                setTimeout(() => {
-                    progressContainer.classList.add('hidden');
-                    resultContainer.classList.remove('hidden');
-                    if (data.download_url) {
-                        downloadBtn.href = data.download_url;
-                    }
-                }, 1000);
+            // Add Log (skip lines the snapshot already contained)
+            if (data.type === 'log' && data.line > logLines) {
+                appendLog(data.message);
+                logLines = data.line;
+                logContainer.scrollTop = logContainer.scrollHeight;
             }
             
             // Handle Error
             if (data.error) {
                 eventSource.close();
+                // A cancelled job still offers the rows it packaged before stopping
+                if (data.download_url) {
+                    resultContainer.querySelector('h2').innerText = 'Job Cancelled';
+                    resultContainer.querySelector('p').innerText = 'The ZIP contains the rows finished before cancelling.';
+                    progressContainer.classList.add('hidden');
+                    resultContainer.classList.remove('hidden');
+                    downloadBtn.href = data.download_url;
+                    return;
+                }
                 statusText.innerText = "Error Occurred";
                 statusText.style.color = "#ff7675";
                 const logEntry = document.createElement('div');
                 logEntry.className = 'log-entry log-error';
                 logEntry.innerText = `ERROR: ${data.error}`;
                 logContainer.appendChild(logEntry);
+                return;
+            }
+            
+            // Handle Completion
+            if (data.done) {
+                eventSource.close();
+                setTimeout(() => {
+                    progressContainer.classList.add('hidden');
+                    resultContainer.classList.remove('hidden');
+                    if (data.download_url) {
+                        downloadBtn.href = data.download_url;
+                    }
+                }, 1000);
             }
         };
         
         eventSource.onerror = function() {
-            // eventSource.close();
-            // console.error("EventSource failed.");
+            // The browser reconnects on its own and resumes from the last event id
         };
     })
     .catch(error => {
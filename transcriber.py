@@ -1,22 +1,58 @@
 
-import whisper
+import logging
 import os
-import subprocess
+from contextlib import contextmanager
 from pathlib import Path
 
-# Global cache for the model
-_model_cache = {}
+from audio_io import WHISPER_SAMPLE_RATE
+from model_manager import get_manager
+from whisper_backends import DEFAULT_BACKEND, configure_threads, get_backend
+
+# fp32 weights of each model size in MB, to make room in the model budget before loading
+MODEL_MB = {
+    'tiny': 150,
+    'base': 290,
+    'small': 930,
+    'medium': 2930,
+    'large': 5900,
+}
+
+
+def _load(model_size, load):
+    # The backends import whisper and torch: only paid when a model is first needed
+    configure_threads()
+    return load(model_size)
+
+
+@contextmanager
+def use_model(model_size, backend=None):
+    """
+    Holds a Whisper model from the shared model manager while transcribing, so
+    it cannot be unloaded (idle or over budget) until the block ends.
+
+    Args:
+        model_size (str): Whisper model size.
+        backend (str, optional): Inference backend (see whisper_backends), default WHISPER_BACKEND.
+    """
+    load, memory_ratio = get_backend(backend)
+    key = f"{backend or DEFAULT_BACKEND}:{model_size}"
+    with get_manager().acquire(key, lambda: _load(model_size, load),
+                               estimate_mb=MODEL_MB.get(model_size, MODEL_MB['large']) * memory_ratio) as model:
+        yield model
+
+
+def get_model(model_size, backend=None):
+    """
+    Loads a Whisper model into the shared model manager (e.g. to preload it) and returns it.
+    """
+    with use_model(model_size, backend) as model:
+        return model
 
-def get_model(model_size):
-    if model_size not in _model_cache:
-        print(f"[DEBUG] Loading Whisper model '{model_size}'...")
-        _model_cache[model_size] = whisper.load_model(model_size)
-        print(f"[DEBUG] Model '{model_size}' loaded.")
-    return _model_cache[model_size]
 
 def separate_vocals(audio_path, output_dir):
     """
-    Separates vocals from audio using Demucs CLI.
+    Separates vocals from audio using Demucs.
+    Delegates to audio_separator, which keeps the Demucs model loaded between calls.
 
     Args:
         audio_path (str): Path to audio file.
@@ -25,53 +61,248 @@ def separate_vocals(audio_path, output_dir):
     Returns:
         str: Path to the separated vocals file.
     """
+    from audio_separator import separate_audio
+
     try:
-        # Create output directory
         os.makedirs(output_dir, exist_ok=True)
+        vocals_path = separate_audio(audio_path, output_base_dir=output_dir)
 
-        # Get the audio filename without extension
-        audio_filename = Path(audio_path).stem
+        if not vocals_path or not os.path.exists(vocals_path):
+            raise FileNotFoundError(f"Vocals file not found for {Path(audio_path).stem}")
 
-        # Execute demucs CLI command
-        # demucs outputs to: output_dir/htdemucs/audio_basename/
-        cmd = ['demucs', '--out', output_dir, audio_path]
+        return vocals_path
 
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    except Exception as e:
+        raise Exception(f"Error separating vocals: {str(e)}")
 
-        # Construct path to vocals file
-        # Structure: output_dir/htdemucs/audio_basename/vocals.wav
-        vocals_path = os.path.join(output_dir, 'htdemucs', audio_filename, 'vocals.wav')
 
-        if not os.path.exists(vocals_path):
-            raise FileNotFoundError(f"Vocals file not found at {vocals_path}")
+def _describe(audio):
+    if isinstance(audio, str):
+        return os.path.basename(audio)
+    return f"<{len(audio) / WHISPER_SAMPLE_RATE:.1f}s in-memory audio>"
 
-        return vocals_path
 
-    except subprocess.CalledProcessError as e:
-        raise Exception(f"Error running demucs: {e.stderr}")
-    except Exception as e:
-        raise Exception(f"Error separating vocals: {str(e)}")
+# Tracks shorter than this are not worth splitting in chunked mode
+LONG_AUDIO_SECONDS = 600
+
+
+def transcribe_result(audio, model_size='large', vad=False, chunked=False, backend=None, cascade=None,
+                      **decode_options):
+    """
+    Transcribes audio and returns the full Whisper result.
+
+    Args:
+        audio (str or numpy.ndarray): Path to audio file, or a 16 kHz mono float32
+                                      array (skips Whisper's own ffmpeg decode).
+        model_size (str): Size of Whisper model ('tiny', 'base', 'small', 'medium', 'large').
+        vad (bool): Only send voiced regions to Whisper (meant for separated vocals).
+                    Timestamps are mapped back to the original timeline and the
+                    result gets a 'vad' entry with the speech ratio and time skipped.
+        chunked (bool): Long-audio mode. Tracks longer than LONG_AUDIO_SECONDS are split
+                        into overlapping chunks transcribed in parallel processes
+                        (see long_audio.transcribe_chunked).
+        backend (str, optional): Inference backend, e.g. 'whisper-int8' (see whisper_backends).
+                                 Default WHISPER_BACKEND, else 'whisper'.
+        cascade (str, optional): Fast model size, e.g. 'small'. The track is transcribed with it
+                                 first and only its low-confidence parts are re-run with
+                                 model_size (see cascade.py). The result gets a 'cascade'
+                                 entry with the seconds escalated.
+        **decode_options: Extra options passed to model.transcribe (e.g. language, temperature).
+
+    Returns:
+        dict: Whisper result with 'text', 'segments' and 'language' (same structure for
+              every backend). Raises on failure.
+    """
+    import whisper
+
+    if cascade and cascade != model_size:
+        from cascade import escalate
+
+        if isinstance(audio, str):
+            audio = whisper.load_audio(audio)
+        result = transcribe_result(audio, model_size=cascade, vad=vad, chunked=chunked, backend=backend,
+                                   **decode_options)
+        return escalate([result], [audio], model_size, fast_model=cascade, vad=vad, backend=backend,
+                        **decode_options)[0]
 
+    if chunked:
+        if isinstance(audio, str):
+            audio = whisper.load_audio(audio)
+        if len(audio) / WHISPER_SAMPLE_RATE > LONG_AUDIO_SECONDS:
+            from long_audio import transcribe_chunked
 
-def transcribe_audio(audio_path, model_size='large', use_separation=True):
+            logging.debug(f"Starting chunked transcription for: {_describe(audio)}")
+            result = transcribe_chunked(audio, model_size=model_size, vad=vad, backend=backend, **decode_options)
+            logging.debug(f"Chunked transcription finished ({result['chunks']} chunks)")
+            return result
+
+    logging.debug(f"Starting transcription for: {_describe(audio)}")
+    # Held for the whole transcription, so the manager cannot unload it meanwhile
+    with use_model(model_size, backend) as model:
+        return _transcribe_with(model, audio, vad, decode_options)
+
+
+def _gate(audio):
+    """
+    Keeps the voiced regions of a 16 kHz array.
+
+    Returns:
+        tuple: (gated audio, mapping for vad.remap_segments, number of regions, 'vad' stats)
+    """
+    from vad import detect_speech, gate_audio
+
+    regions = detect_speech(audio)
+    gated, mapping = gate_audio(audio, regions)
+
+    audio_seconds = len(audio) / WHISPER_SAMPLE_RATE
+    gated_seconds = len(gated) / WHISPER_SAMPLE_RATE
+    speech_seconds = sum(end - start for start, end in regions)
+    stats = {
+        'audio_seconds': round(audio_seconds, 2),
+        'speech_seconds': round(speech_seconds, 2),
+        'speech_ratio': round(speech_seconds / audio_seconds, 3) if audio_seconds else 0.0,
+        'seconds_skipped': round(max(audio_seconds - gated_seconds, 0.0), 2),
+        'regions': len(regions),
+    }
+    return gated, mapping, len(regions), stats
+
+
+def _transcribe_with(model, audio, vad, decode_options):
+    import whisper
+    from vad import remap_segments
+
+    if not vad:
+        result = model.transcribe(audio, **decode_options)
+        logging.debug(f"Transcription finished for: {_describe(audio)}")
+        return result
+
+    if isinstance(audio, str):
+        audio = whisper.load_audio(audio)
+    gated, mapping, regions, stats = _gate(audio)
+
+    if not regions:
+        result = {'text': '', 'segments': [], 'language': None}
+    else:
+        result = model.transcribe(gated, **decode_options)
+        remap_segments(result['segments'], mapping)
+
+    result['vad'] = stats
+    logging.debug(f"Transcription finished for: {_describe(audio)} "
+                  f"(speech {stats['speech_ratio']:.0%}, skipped {stats['seconds_skipped']:.0f}s)")
+    return result
+
+
+def transcribe_batch(audios, model_size='large', vad=False, chunked=False, backend=None, batch_size=None,
+                     cascade=None, **decode_options):
+    """
+    Transcribes several tracks at once, decoding their 30-second windows in
+    shared batches (see batched_whisper.decode_batch) instead of one window
+    of one track at a time.
+
+    Args:
+        audios (list): Paths or 16 kHz mono float32 arrays, as in transcribe_result.
+        model_size (str): Whisper model size.
+        vad (bool or list[bool]): VAD gating, for all tracks or per track (see transcribe_result).
+        chunked (bool): Tracks longer than LONG_AUDIO_SECONDS go through the chunked
+                        long-audio mode on their own instead.
+        backend (str, optional): Inference backend (see whisper_backends). A backend
+                                 without whisper's decode API transcribes track by track.
+        batch_size (int, optional): Windows per batch (default WHISPER_BATCH_SIZE).
+        cascade (str, optional): Fast model size (see transcribe_result). The low-confidence
+                                 stretches of every track are escalated together, in one
+                                 batch; whole tracks are re-run with transcribe().
+        **decode_options: Passed to the model. Only batched_whisper.DECODE_OPTIONS are
+                          batched; with any other option (e.g. initial_prompt) the
+                          tracks are transcribed one by one with transcribe().
+
+    Returns:
+        list[dict]: One transcribe_result-style result per track, in input order.
+    """
+    import whisper
+    from vad import remap_segments
+
+    if cascade and cascade != model_size:
+        from cascade import escalate
+
+        audios = [whisper.load_audio(audio) if isinstance(audio, str) else audio for audio in audios]
+        results = transcribe_batch(audios, model_size=cascade, vad=vad, chunked=chunked, backend=backend,
+                                   batch_size=batch_size, **decode_options)
+        return escalate(results, audios, model_size, fast_model=cascade, vad=vad, backend=backend, batched=True,
+                        batch_size=batch_size, **decode_options)
+
+    vads = list(vad) if isinstance(vad, (list, tuple)) else [vad] * len(audios)
+    results = [None] * len(audios)
+    # (index, audio fed to Whisper, VAD mapping, VAD stats)
+    batched = []
+    for i, (audio, use_vad) in enumerate(zip(audios, vads)):
+        if isinstance(audio, str):
+            audio = whisper.load_audio(audio)
+        if chunked and len(audio) / WHISPER_SAMPLE_RATE > LONG_AUDIO_SECONDS:
+            results[i] = transcribe_result(audio, model_size=model_size, vad=use_vad, chunked=True,
+                                           backend=backend, **decode_options)
+            continue
+        if not use_vad:
+            batched.append((i, audio, None, None))
+            continue
+        gated, mapping, regions, stats = _gate(audio)
+        if regions:
+            batched.append((i, gated, mapping, stats))
+        else:
+            results[i] = {'text': '', 'segments': [], 'language': None, 'vad': stats}
+
+    if batched:
+        logging.debug(f"Starting batched transcription of {len(batched)} tracks")
+        with use_model(model_size, backend) as model:
+            from batched_whisper import DECODE_OPTIONS, decode_batch
+
+            if hasattr(model, 'decode') and set(decode_options) <= set(DECODE_OPTIONS):
+                outputs = decode_batch(model, [audio for _, audio, _, _ in batched], batch_size=batch_size,
+                                       **decode_options)
+            else:
+                outputs = [model.transcribe(audio, **decode_options) for _, audio, _, _ in batched]
+        for (i, _, mapping, stats), result in zip(batched, outputs):
+            if stats is not None:
+                remap_segments(result['segments'], mapping)
+                result['vad'] = stats
+            results[i] = result
+        logging.debug(f"Batched transcription finished for {len(batched)} tracks")
+    return results
+
+
+def transcribe_audio(audio_path, model_size='large', use_separation=True, vad=False, chunked=False,
+                     backend=None, cascade=None, **decode_options):
     """
     Transcribes audio file to text using OpenAI Whisper.
-    Optionally separates vocals first using Demucs CLI for better accuracy with music.
+    Optionally separates vocals first using Demucs for better accuracy with music.
 
     Args:
         audio_path (str): Path to audio file.
         model_size (str): Size of Whisper model ('tiny', 'base', 'small', 'medium', 'large').
         use_separation (bool): Whether to separate vocals before transcribing (default True).
+                               If separation fails the original audio is used.
+        vad (bool): Skip non-voiced regions (see transcribe_result). Only applied to
+                    separated vocals, like in the web app.
+        chunked (bool): Long-audio mode (see transcribe_result).
+        backend (str, optional): Inference backend (see transcribe_result).
+        cascade (str, optional): Fast model tried first, e.g. 'small' (see transcribe_result).
+        **decode_options: Extra options passed to model.transcribe.
 
     Returns:
         str: Transcribed text.
     """
     try:
-        print(f"[DEBUG] Starting transcription for: {os.path.basename(audio_path)}")
-        model = get_model(model_size)
-        result = model.transcribe(audio_path)
-        print(f"[DEBUG] Transcription finished for: {os.path.basename(audio_path)}")
-        return result['text']
+        audio = audio_path
+        separated = False
+        if use_separation:
+            from audio_separator import separate_for_transcription
+
+            try:
+                audio, _ = separate_for_transcription(audio_path)
+                separated = True
+            except Exception as e:
+                print(f"[ERROR] Vocal separation failed, using original audio: {e}")
+        return transcribe_result(audio, model_size=model_size, vad=vad and separated, chunked=chunked,
+                                 backend=backend, cascade=cascade, **decode_options)['text']
 
     except Exception as e:
         print(f"[ERROR] Transcription failed: {e}")
@@ -0,0 +1,127 @@
+"""
+Energy-based voice activity detection for separated vocal stems.
+
+On a Demucs vocals stem, intros, solos and outros are close to digital
+silence, so a frame energy threshold is enough to find the sung regions.
+Only those regions are concatenated and sent to Whisper; the segment
+timestamps are then mapped back onto the original timeline.
+"""
+
+import numpy as np
+
+from audio_io import WHISPER_SAMPLE_RATE
+
+
+def detect_speech(audio, samplerate=WHISPER_SAMPLE_RATE, frame_ms=30, threshold_db=-45.0,
+                  relative_db=35.0, min_speech=0.3, min_silence=0.8, pad=0.25):
+    """
+    Finds voiced regions in a mono float32 signal.
+
+    Args:
+        audio (numpy.ndarray): 1-D float32 signal.
+        samplerate (int): Sample rate of audio.
+        frame_ms (int): Analysis frame length in milliseconds.
+        threshold_db (float): Absolute frame level (dBFS) below which a frame is silent.
+        relative_db (float): Frames more than this many dB below the loudest frame are silent.
+        min_speech (float): Voiced regions shorter than this (seconds) are dropped.
+        min_silence (float): Silent gaps shorter than this (seconds) are bridged.
+        pad (float): Seconds added before and after each region.
+
+    Returns:
+        list[tuple[float, float]]: (start, end) of each region in seconds.
+    """
+    frame_len = max(1, int(samplerate * frame_ms / 1000))
+    n_frames = len(audio) // frame_len
+    if n_frames == 0:
+        return []
+
+    frames = audio[:n_frames * frame_len].reshape(n_frames, frame_len)
+    rms = np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1))
+    level_db = 20 * np.log10(np.maximum(rms, 1e-10))
+    threshold = max(threshold_db, level_db.max() - relative_db)
+    voiced = level_db > threshold
+
+    frame_s = frame_len / samplerate
+    regions = []
+    start = None
+    for i, is_voiced in enumerate(voiced):
+        if is_voiced and start is None:
+            start = i
+        elif not is_voiced and start is not None:
+            regions.append([start * frame_s, i * frame_s])
+            start = None
+    if start is not None:
+        regions.append([start * frame_s, n_frames * frame_s])
+
+    # Bridge short pauses between phrases
+    merged = []
+    for region in regions:
+        if merged and region[0] - merged[-1][1] < min_silence:
+            merged[-1][1] = region[1]
+        else:
+            merged.append(region)
+
+    duration = len(audio) / samplerate
+    result = []
+    for start_s, end_s in merged:
+        if end_s - start_s < min_speech:
+            continue
+        start_s = max(0.0, start_s - pad)
+        end_s = min(duration, end_s + pad)
+        if result and start_s <= result[-1][1]:
+            result[-1] = (result[-1][0], end_s)
+        else:
+            result.append((start_s, end_s))
+    return result
+
+
+def gate_audio(audio, regions, samplerate=WHISPER_SAMPLE_RATE, gap=0.5):
+    """
+    Concatenates the voiced regions, separated by short silences.
+
+    Returns:
+        tuple: (gated 1-D float32 array, mapping) where mapping is a list of
+               (gated_start, original_start, length) in seconds.
+    """
+    silence = np.zeros(int(gap * samplerate), dtype=np.float32)
+    pieces = []
+    mapping = []
+    position = 0.0
+    for i, (start_s, end_s) in enumerate(regions):
+        if i:
+            pieces.append(silence)
+            position += len(silence) / samplerate
+        chunk = audio[int(start_s * samplerate):int(end_s * samplerate)]
+        pieces.append(chunk.astype(np.float32, copy=False))
+        mapping.append((position, start_s, len(chunk) / samplerate))
+        position += len(chunk) / samplerate
+    gated = np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.float32)
+    return gated, mapping
+
+
+def to_original_time(t, mapping):
+    """
+    Maps a time on the gated timeline back to the original timeline.
+    Times that fall in an inserted gap snap to the nearest region edge.
+    """
+    for gated_start, original_start, length in mapping:
+        if t <= gated_start + length:
+            offset = min(max(t - gated_start, 0.0), length)
+            return original_start + offset
+    if not mapping:
+        return t
+    gated_start, original_start, length = mapping[-1]
+    return original_start + length
+
+
+def remap_segments(segments, mapping):
+    """
+    Rewrites segment (and word) timestamps in place from the gated timeline to the original one.
+    """
+    for segment in segments:
+        segment['start'] = to_original_time(segment['start'], mapping)
+        segment['end'] = to_original_time(segment['end'], mapping)
+        for word in segment.get('words') or []:
+            word['start'] = to_original_time(word['start'], mapping)
+            word['end'] = to_original_time(word['end'], mapping)
+    return segments
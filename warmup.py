@@ -0,0 +1,69 @@
+"""
+Background warm-up of heavy imports and models.
+
+The server starts serving right away with everything heavy imported lazily.
+A Warmup runs its steps (e.g. import the pipeline modules, load the Whisper
+and Demucs models) one after another in a daemon thread, so the first job
+does not pay for them, and reports each step's state for /ready.
+"""
+
+import threading
+import time
+
+
+class Warmup:
+    """
+    Runs named steps in order in a background thread.
+
+    Usage:
+        warmup = Warmup([('whisper', lambda: get_model('large'))])
+        warmup.start()
+        warmup.status()   # {'state': 'warming', 'ready': False, 'steps': {...}}
+
+    A failed step is recorded and the remaining steps still run.
+    """
+
+    def __init__(self, steps):
+        self._steps = list(steps)
+        self._state = {name: {'state': 'pending', 'seconds': None, 'error': None} for name, _ in self._steps}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._done = threading.Event()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='warmup', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        for name, func in self._steps:
+            with self._lock:
+                self._state[name]['state'] = 'running'
+            start = time.perf_counter()
+            try:
+                func()
+                state, error = 'ready', None
+            except Exception as e:
+                state, error = 'failed', str(e)
+            with self._lock:
+                self._state[name].update(state=state, seconds=round(time.perf_counter() - start, 3), error=error)
+        self._done.set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def status(self):
+        """
+        Overall state: 'idle' (not started), 'warming', 'ready', or 'failed' if any step failed.
+        """
+        with self._lock:
+            steps = {name: dict(step) for name, step in self._state.items()}
+        if self._thread is None:
+            state = 'idle'
+        elif not self._done.is_set():
+            state = 'warming'
+        elif any(step['state'] == 'failed' for step in steps.values()):
+            state = 'failed'
+        else:
+            state = 'ready'
+        return {'state': state, 'ready': state == 'ready', 'steps': steps}
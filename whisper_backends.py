@@ -0,0 +1,119 @@
+"""
+Inference backends for Whisper.
+
+A backend loads a model for a size. The model has a transcribe(audio, **decode_options)
+method that returns the openai-whisper result structure ('text', 'segments',
+'language'), so the rest of the pipeline does not care which backend ran.
+
+- 'whisper'       openai-whisper as is (fp32 on CPU, fp16 on CUDA)
+- 'whisper-int8'  openai-whisper with its Linear layers dynamically quantized
+                  to int8 (CPU only). Most of the weights and compute are in
+                  those layers, so the model is about a third of the size and
+                  decodes faster on CPU. The output can differ slightly from fp32.
+
+Other backends are added with register_backend. WHISPER_THREADS and
+WHISPER_INTEROP_THREADS set torch's intra-op and inter-op thread counts.
+"""
+
+import logging
+import os
+import threading
+
+DEFAULT_BACKEND = os.environ.get('WHISPER_BACKEND', 'whisper')
+
+# name -> (load(model_size) -> model, fraction of the fp32 weights it keeps in memory)
+_backends = {}
+
+_threads_lock = threading.Lock()
+_threads_configured = False
+
+
+def register_backend(name, load, memory_ratio=1.0):
+    """
+    Makes a backend available by name.
+
+    Args:
+        name (str): Backend name, e.g. 'whisper-int8'.
+        load (callable): Called as load(model_size); returns a model with transcribe().
+        memory_ratio (float): Size relative to the fp32 model, to plan the model budget.
+    """
+    _backends[name] = (load, memory_ratio)
+
+
+def backend_names():
+    return tuple(_backends)
+
+
+def get_backend(name=None):
+    """
+    Returns (load, memory_ratio) of a backend, DEFAULT_BACKEND if name is None.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    name = name or DEFAULT_BACKEND
+    if name not in _backends:
+        raise ValueError(f"Unknown Whisper backend {name!r}, expected one of {', '.join(_backends)}")
+    return _backends[name]
+
+
+def configure_threads(intra=None, interop=None):
+    """
+    Sets torch's thread counts once per process. Later calls do nothing, so a
+    worker initializer that sets them first wins over the environment.
+
+    Args:
+        intra (int, optional): Intra-op threads (within an operator). Default WHISPER_THREADS.
+        interop (int, optional): Inter-op threads (between operators). Default WHISPER_INTEROP_THREADS.
+                                 Torch only accepts it before its first parallel work.
+    """
+    global _threads_configured
+    with _threads_lock:
+        if _threads_configured:
+            return
+        _threads_configured = True
+        intra = intra or int(os.environ.get('WHISPER_THREADS') or 0)
+        interop = interop or int(os.environ.get('WHISPER_INTEROP_THREADS') or 0)
+        if not intra and not interop:
+            return
+        import torch
+
+        if intra:
+            torch.set_num_threads(intra)
+        if interop:
+            try:
+                torch.set_num_interop_threads(interop)
+            except RuntimeError as e:
+                print(f"[ERROR] Could not set {interop} inter-op threads: {e}")
+        logging.info(f"Torch threads: {torch.get_num_threads()} intra-op, {torch.get_num_interop_threads()} inter-op")
+
+
+def _load_whisper(model_size):
+    import whisper
+
+    return whisper.load_model(model_size)
+
+
+def quantize_int8(model):
+    """
+    Dynamically quantizes the Linear layers of a CPU Whisper model to int8:
+    weights are stored as int8, activations are quantized on the fly.
+    """
+    import torch
+
+    # whisper subclasses nn.Linear only to cast the weight to the input dtype, a
+    # no-op in fp32; quantize_dynamic only swaps modules of exactly nn.Linear
+    for module in model.modules():
+        if isinstance(module, torch.nn.Linear) and type(module) is not torch.nn.Linear:
+            module.__class__ = torch.nn.Linear
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def _load_whisper_int8(model_size):
+    import whisper
+
+    return quantize_int8(whisper.load_model(model_size, device='cpu'))
+
+
+register_backend('whisper', _load_whisper)
+register_backend('whisper-int8', _load_whisper_int8, memory_ratio=0.35)
@@ -0,0 +1,110 @@
+"""
+Standalone worker process.
+
+Runs jobs outside the web server, so Whisper and Demucs do not compete with
+the HTTP threads for the GIL:
+
+    WORKER_MODE=external python app.py    # uploads, progress and downloads only
+    python worker.py --slots 2            # start as many workers as the machine allows
+
+The job queue is the jobs.db SQLite file, no broker needed. Each worker
+claims the highest-priority, oldest unclaimed job, runs it with process_file
+and keeps a heartbeat on it. A job whose worker stopped sending heartbeats
+for CLAIM_TIMEOUT seconds is claimed again and resumes from the last
+completed stage of each row. Workers must share the folder of app.py
+(uploads, results, cache and jobs.db) on the same machine.
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+
+import app as web
+from job_store import CLAIM_TIMEOUT
+
+# Seconds between looking for new jobs and refreshing heartbeats
+POLL_INTERVAL = 2.0
+
+
+def run_worker(worker_id, slots, poll_interval=POLL_INTERVAL, stop_event=None):
+    """
+    Claims and runs jobs until stop_event is set.
+
+    Args:
+        worker_id (str): Name recorded on claimed jobs.
+        slots (int): Maximum number of jobs this worker runs at once.
+        poll_interval (float): Seconds between queue polls and heartbeats.
+        stop_event (threading.Event, optional): Set to stop the worker.
+    """
+    stop_event = stop_event or threading.Event()
+    store = web.store
+    scheduler = web.scheduler
+    scheduler.slots = slots
+    # Progress reaches the web server through the database, not this process' bus
+    store.bus = None
+
+    mine = set()
+    cancel_seen = set()
+    logging.info(f"Worker {worker_id} started with {slots} slot(s)")
+    try:
+        while not stop_event.is_set():
+            # Forget jobs the scheduler has finished
+            snapshot = scheduler.snapshot()
+            active = {j['job_id'] for j in snapshot['running'] + snapshot['queued']}
+            mine &= active
+            cancel_seen &= mine
+
+            for job_id in store.heartbeat(worker_id, mine) - cancel_seen:
+                cancel_seen.add(job_id)
+                store.append_log(job_id, "Cancellation requested, stopping once the steps already running finish...")
+                scheduler.cancel(job_id)
+
+            while len(mine) < slots:
+                claimed = store.claim_job(worker_id)
+                if claimed is None:
+                    break
+                job_id, file_path = claimed
+                if not file_path or not os.path.exists(file_path):
+                    store.update_job(job_id, error='Uploaded file is missing', done=True, status='Failed')
+                    continue
+                logging.info(f"Worker {worker_id} claimed job {job_id}")
+                store.append_log(job_id, f"Picked up by worker {worker_id}.")
+                mine.add(job_id)
+                web._submit_job(job_id, file_path)
+
+            stop_event.wait(poll_interval)
+    finally:
+        # Unfinished jobs go back to the queue right away instead of after CLAIM_TIMEOUT
+        store.release_jobs(worker_id)
+        logging.info(f"Worker {worker_id} stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run transcription jobs queued by the web server.")
+    parser.add_argument('--slots', type=int, default=web.app.config['JOB_SLOTS'],
+                        help="Jobs run at once by this worker (default: JOB_SLOTS)")
+    parser.add_argument('--worker-id', default=f"{socket.gethostname()}-{os.getpid()}",
+                        help="Name recorded on claimed jobs")
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+                        help=f"Seconds between queue polls; must stay well below {CLAIM_TIMEOUT}")
+    args = parser.parse_args()
+
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop_event.set())
+
+    if web.app.config['WARMUP']:
+        # Load the models while polling for the first job
+        web.Warmup(web.warmup_steps()).start()
+
+    run_worker(args.worker_id, max(1, args.slots), args.poll_interval, stop_event)
+
+
+if __name__ == '__main__':
+    # Needed for the long-audio process pool in the bundled exe
+    import multiprocessing
+    multiprocessing.freeze_support()
+    main()
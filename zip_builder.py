@@ -0,0 +1,134 @@
+"""
+Result archive helpers.
+
+ResultZip appends each row's files to the job's ZIP as soon as the row is
+done, so the archive on disk always holds every finished row. Entries keep
+their path relative to the job directory (same-named stems from different
+songs no longer overwrite each other) and already-compressed audio is
+stored rather than deflated again.
+
+ZipStream builds a ZIP on the fly for streaming responses, so a client can
+start downloading results while the job is still running.
+"""
+
+import io
+import os
+import threading
+import zipfile
+
+# Codecs that are already compressed: deflating them again only burns CPU
+STORED_EXTENSIONS = ('.mp3', '.opus', '.ogg', '.m4a', '.aac', '.flac', '.webm', '.zip')
+
+
+def compress_type_for(path):
+    if path.lower().endswith(STORED_EXTENSIONS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def arcname_for(path, base_dir):
+    return os.path.relpath(path, base_dir).replace(os.sep, '/')
+
+
+class ResultZip:
+    """
+    ZIP archive that grows as rows finish.
+
+    Args:
+        zip_path (str): Archive path. An existing archive (from a resumed job) is extended.
+        base_dir (str): Entries are named relative to this directory.
+    """
+
+    def __init__(self, zip_path, base_dir):
+        self.zip_path = zip_path
+        self.base_dir = base_dir
+        self._lock = threading.Lock()
+        self._names = set()
+        if os.path.exists(zip_path):
+            try:
+                with zipfile.ZipFile(zip_path, 'r') as zipf:
+                    self._names = set(zipf.namelist())
+            except zipfile.BadZipFile:
+                os.remove(zip_path)
+
+    def add(self, paths):
+        """
+        Appends files to the archive, skipping missing files and entries already present.
+
+        Returns:
+            list[str]: Archive names of the files that were added.
+        """
+        added = []
+        with self._lock:
+            with zipfile.ZipFile(self.zip_path, 'a') as zipf:
+                for path in paths:
+                    if not path or not os.path.isfile(path):
+                        continue
+                    arcname = arcname_for(path, self.base_dir)
+                    if arcname in self._names:
+                        continue
+                    zipf.write(path, arcname, compress_type=compress_type_for(path))
+                    self._names.add(arcname)
+                    added.append(arcname)
+        return added
+
+
+class _StreamWriter(io.RawIOBase):
+    """
+    Unseekable sink for zipfile; written bytes are collected until drained.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class ZipStream:
+    """
+    Builds a ZIP incrementally and hands out the bytes as they are produced.
+
+    Usage:
+        stream = ZipStream()
+        for chunk in stream.write_file(path, arcname): yield chunk
+        for chunk in stream.close(): yield chunk
+    """
+
+    def __init__(self, chunk_size=1024 * 1024):
+        self.chunk_size = chunk_size
+        self._sink = _StreamWriter()
+        self._zip = zipfile.ZipFile(self._sink, 'w')
+
+    def write_file(self, path, arcname):
+        info = zipfile.ZipInfo.from_file(path, arcname)
+        info.compress_type = compress_type_for(path)
+        with open(path, 'rb') as src, self._zip.open(info, 'w', force_zip64=info.file_size > zipfile.ZIP64_LIMIT) as dst:
+            for chunk in iter(lambda: src.read(self.chunk_size), b''):
+                dst.write(chunk)
+                data = self._sink.drain()
+                if data:
+                    yield data
+        data = self._sink.drain()
+        if data:
+            yield data
+
+    def close(self):
+        self._zip.close()
+        data = self._sink.drain()
+        if data:
+            yield data